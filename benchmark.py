@@ -0,0 +1,228 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from src.melody import Band8bit, Guitar8bit, Bass8bit, Drum8bit
+from src.utils import gen_square_wave, gen_triangle_wave, gen_noise_wave
+
+SAMPLE_RATE = 11025
+
+GUITAR_TECHNIQUES = ['', 'pr', 'tr', 'sl', 'maj-chord', 'maj-arpeggio', 'min-chord', 'min-arpeggio',
+                     'dim-chord', 'dim-arpeggio', 'aug-chord', 'aug-arpeggio']
+
+# 两小节的基础乐谱，用来拼出不同长度的歌曲
+GUITAR_SCORE = [('G4', '1/8', 'pr'), ('A4', '1/8', 'pr'), ('C5', '1/4.', 'tr'), ('D5', '1/8', 'pr'),
+                ('E5', '1/8', 'sl'), ('B4', '1/8', 'pr'), ('A4', '1/16', 'sl'), ('B4', '1/16', 'sl'),
+                ('G4', '1/8', 'pr'), ('A4', '1/2', 'tr'), ('O', '1/4', '')]
+BASS_SCORE = [('E3', '1/2', 'min-chord'), ('C3', '1/2', 'maj-arpeggio'),
+              ('D3', '1/2', 'maj-chord'), ('G3', '1/2', 'pr')]
+DRUM_BEAT = '4/4-disco1'
+# 每次计时至少运行的秒数，短的用例循环多次取平均，减小计时噪声
+MIN_MEASURE_SECONDS = 0.1
+# 比较基线时，耗时和峰值内存的增量都超过这些绝对值才记为退化
+MIN_REGRESSION_SECONDS = 0.001
+MIN_REGRESSION_BYTES = 64 * 1024
+
+
+def measure(func, repeat=3, min_seconds=MIN_MEASURE_SECONDS):
+    """
+    运行func若干次，返回 (最短的单次耗时, 峰值内存, func的返回值)
+    每次计时连续运行func直到至少min_seconds，取单次的平均耗时，repeat次计时中取最短的
+    计时期间与timeit一样关闭垃圾回收
+    峰值内存用tracemalloc单独测一次，避免影响计时
+    """
+    np.random.seed(0)
+    result = func()
+    best = float('inf')
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            np.random.seed(0)
+            loops = 0
+            start = time.perf_counter()
+            while True:
+                func()
+                loops += 1
+                seconds = time.perf_counter() - start
+                if seconds >= min_seconds:
+                    break
+            best = min(best, seconds / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    np.random.seed(0)
+    tracemalloc.start()
+    func()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak_bytes, result
+
+
+def make_band(bpm, instrument_count):
+    """
+    instrument_count个乐器，按吉他、贝司、鼓轮流分配
+    """
+    instrument_types = ['guitar', 'bass', 'drum']
+    instrument_dict = {f'{instrument_types[i % 3]}_{i}': instrument_types[i % 3] for i in range(instrument_count)}
+    return Band8bit(bpm, instrument_dict)
+
+
+def make_score_dict(band, bars):
+    score_dict = {}
+    for instrument, instrument_obj in band.instrument_obj_dict.items():
+        if isinstance(instrument_obj, Drum8bit):
+            score_dict[instrument] = [(instrument_obj.common_beat_score_list(DRUM_BEAT), bars)]
+        elif isinstance(instrument_obj, Bass8bit):
+            score_dict[instrument] = [(BASS_SCORE, bars // 2)]
+        else:
+            score_dict[instrument] = [(GUITAR_SCORE, bars // 2)]
+    return score_dict
+
+
+def bench_generators(repeat):
+    results = {}
+    duration = 1.0
+    for name, func in [('gen_square_wave', lambda: gen_square_wave(440.0, 16, duration, SAMPLE_RATE)),
+                       ('gen_triangle_wave', lambda: gen_triangle_wave(440.0, 32, duration, SAMPLE_RATE)),
+                       ('gen_noise_wave', lambda: gen_noise_wave(16, duration, SAMPLE_RATE))]:
+        results[f'utils/{name}'] = (measure(func, repeat), int(duration * SAMPLE_RATE))
+    return results
+
+
+def bench_one_score_wave(repeat):
+    results = {}
+    guitar = Guitar8bit(120)
+    for technique in GUITAR_TECHNIQUES:
+        score = ('C4', '1/2', technique)
+        measured = measure(lambda: guitar.gen_one_score_wave(score), repeat)
+        results[f'gen_one_score_wave/guitar/{technique or "plain"}'] = (measured, len(measured[2]))
+    drum = Drum8bit(120)
+    for pitch in ['K', 'S', 'H']:
+        score = (pitch, '1/8', '')
+        measured = measure(lambda: drum.gen_one_score_wave(score), repeat)
+        results[f'gen_one_score_wave/drum/{pitch}'] = (measured, len(measured[2]))
+    return results
+
+
+def bench_gen_wave(repeat):
+    results = {}
+    guitar = Guitar8bit(120)
+    for repeat_times in [1, 16, 64]:
+        measured = measure(lambda: guitar.gen_wave(GUITAR_SCORE, repeat_times), repeat)
+        results[f'gen_wave/guitar/repeat{repeat_times}'] = (measured, len(measured[2]))
+    return results
+
+
+def bench_gen_music(repeat, bars_list, instrument_count_list, bpm_list):
+    results = {}
+    for bars in bars_list:
+        for instrument_count in instrument_count_list:
+            for bpm in bpm_list:
+                band = make_band(bpm, instrument_count)
+                score_dict = make_score_dict(band, bars)
+                measured = measure(lambda: band.gen_music(score_dict), repeat)
+                name = f'gen_music/bars{bars}/instruments{instrument_count}/bpm{bpm}'
+                results[name] = (measured, len(measured[2]) * instrument_count)
+    return results
+
+
+def bench_write_music(repeat, bars_list):
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, 'bench.wav')
+        for bars in bars_list:
+            band = make_band(120, 3)
+            band.gen_music(make_score_dict(band, bars))
+            measured = measure(lambda: band.write_music(file_path), repeat)
+            results[f'write_music/bars{bars}'] = (measured, len(band.music_wav))
+    return results
+
+
+def run_benchmarks(repeat=5, bars_list=(8, 32, 128), instrument_count_list=(1, 3, 6), bpm_list=(60, 120, 240)):
+    """
+    返回 {case_name: {'seconds', 'samples', 'samples_per_sec', 'peak_bytes'}}
+    """
+    raw_results = {}
+    raw_results.update(bench_generators(repeat))
+    raw_results.update(bench_one_score_wave(repeat))
+    raw_results.update(bench_gen_wave(repeat))
+    raw_results.update(bench_gen_music(repeat, bars_list, instrument_count_list, bpm_list))
+    raw_results.update(bench_write_music(repeat, bars_list))
+
+    results = {}
+    for name, ((seconds, peak_bytes, _), samples) in raw_results.items():
+        results[name] = {'seconds': seconds,
+                         'samples': samples,
+                         'samples_per_sec': samples / seconds if seconds > 0 else float('inf'),
+                         'peak_bytes': peak_bytes}
+    return results
+
+
+def compare_results(baseline, results, threshold=0.2, min_seconds=MIN_REGRESSION_SECONDS,
+                    min_bytes=MIN_REGRESSION_BYTES):
+    """
+    与基线比较，耗时或峰值内存比基线多出threshold以上、且增量超过min_seconds或min_bytes的记为退化
+    返回退化列表 [(case_name, metric, baseline_value, current_value),...]
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, min_delta in [('seconds', min_seconds), ('peak_bytes', min_bytes)]:
+            baseline_value = baseline[name][metric]
+            if (baseline_value > 0 and result[metric] > baseline_value * (1 + threshold)
+                    and result[metric] - baseline_value > min_delta):
+                regressions.append((name, metric, baseline_value, result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='8bit synthesis benchmarks')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case, the best is kept')
+    parser.add_argument('--bars', type=int, nargs='+', default=[8, 32, 128], help='song lengths in bars')
+    parser.add_argument('--instruments', type=int, nargs='+', default=[1, 3, 6], help='instrument counts')
+    parser.add_argument('--bpm', type=int, nargs='+', default=[60, 120, 240], help='tempos')
+    parser.add_argument('--save', help='save results as a JSON baseline')
+    parser.add_argument('--compare', help='compare against a saved JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio before flagging')
+    parser.add_argument('--min-delta-ms', type=float, default=MIN_REGRESSION_SECONDS * 1000,
+                        help='slowdowns smaller than this many milliseconds are never flagged')
+    parser.add_argument('--min-delta-kib', type=float, default=MIN_REGRESSION_BYTES / 1024,
+                        help='peak memory growth smaller than this many KiB is never flagged')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat, args.bars, args.instruments, args.bpm)
+    print(f"{'case':<52}{'ms':>10}{'Msamples/s':>12}{'peak KiB':>12}")
+    for name, result in results.items():
+        print(f"{name:<52}{result['seconds'] * 1000:>10.3f}{result['samples_per_sec'] / 1e6:>12.2f}"
+              f"{result['peak_bytes'] / 1024:>12.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(baseline, results, args.threshold, args.min_delta_ms / 1000,
+                                      args.min_delta_kib * 1024)
+        for name, metric, baseline_value, value in regressions:
+            print(f"REGRESSION {name} {metric}: {baseline_value:.6g} -> {value:.6g}")
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.cache import WaveCache
+from src.melody import Band8bit
+from src.midi_import import MIDI_FILE_EXTENSIONS, import_midi
+from src.score_format import ScoreArray, load_song, load_song_metadata, get_output_paths
+from src.stem_cache import StemCache
+
+SCORE_FILE_EXTENSIONS = ('.json', '.8bsc') + MIDI_FILE_EXTENSIONS
+
+# 整段乐谱缓存，同一进程渲染的所有歌曲共用，相同的乐器块只合成一次；
+# 指定cache_dir时是磁盘上的StemCache，所有进程和每次运行共用
+_segment_cache = None
+
+
+def load_score_file(file_path):
+    """
+    返回 (metadata, score_dict)，乐谱都转换为ScoreArray，两种格式中相同的块缓存键相同
+    .json: {"bpm": 120, "one_beat_note": "quarter", "sample_rate": 11025,
+            "instruments": {"guitar_theme": "guitar", ...},
+            "scores": {"guitar_theme": [[[["G4", "1/8", "pr"], ...], repeat_times], ...], ...}}
+    .8bsc: src.score_format.save_song写入的文件，bpm、instruments等保存在metadata中
+    .mid, .midi: Standard MIDI File，用src.midi_import.import_midi的默认参数转换
+    """
+    if file_path.endswith('.8bsc'):
+        return load_song_metadata(file_path), load_song(file_path)
+    if file_path.lower().endswith(MIDI_FILE_EXTENSIONS):
+        return import_midi(file_path)
+    with open(file_path, encoding='utf-8') as f:
+        song = json.load(f)
+    score_dict = {instrument: [(ScoreArray.from_score_list([tuple(score) for score in score_list]), repeat_times)
+                               for score_list, repeat_times in score_list_list]
+                  for instrument, score_list_list in song.pop('scores').items()}
+    return song, score_dict
+
+
+def find_score_files(inputs, manifest=None):
+    """
+    inputs: 乐谱文件或目录，目录中按文件名顺序取所有乐谱文件
+    manifest: 每行一个乐谱文件路径的文本文件，相对路径以manifest所在目录为准，#开头的行被忽略
+    """
+    file_paths = []
+    if manifest is not None:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) > 0 and not line.startswith('#'):
+                    file_paths.append(os.path.join(manifest_dir, line))
+    for path in inputs:
+        if os.path.isdir(path):
+            file_paths += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if name.endswith(SCORE_FILE_EXTENSIONS)]
+        else:
+            file_paths.append(path)
+    # 同一个文件只渲染一次
+    path_dict = {}
+    for file_path in file_paths:
+        path_dict.setdefault(os.path.normcase(os.path.abspath(file_path)), file_path)
+    return list(path_dict.values())
+
+
+def _init_worker(cache_bytes, cache_dir=None, cache_dir_bytes=None):
+    global _segment_cache
+    if cache_dir is not None:
+        _segment_cache = StemCache(cache_dir, cache_dir_bytes)
+    else:
+        _segment_cache = WaveCache(cache_bytes)
+
+
+def render_song(file_path, out_path, mix_mode=None):
+    """
+    渲染一首歌并写入wav文件，在工作进程中运行
+    mix_mode: 'clip'或'normalize'，None表示使用乐谱metadata中的mix_mode，没有时为'clip'
+    返回 {'input', 'output', 'samples', 'seconds', 'hits', 'misses'}
+    """
+    global _segment_cache
+    if _segment_cache is None:
+        _segment_cache = WaveCache()
+    start = time.perf_counter()
+    hits, misses = _segment_cache.hits, _segment_cache.misses
+    metadata, score_dict = load_score_file(file_path)
+    band = Band8bit(metadata['bpm'], metadata['instruments'], metadata.get('one_beat_note', 'quarter'),
+                    segment_cache=_segment_cache, sample_rate=metadata.get('sample_rate', 11025))
+    music_wav = band.update_music(score_dict, mix_mode or metadata.get('mix_mode', 'clip'))
+    band.write_music(out_path)
+    return {'input': file_path,
+            'output': out_path,
+            'samples': len(music_wav),
+            'seconds': time.perf_counter() - start,
+            'hits': _segment_cache.hits - hits,
+            'misses': _segment_cache.misses - misses}
+
+
+def render_batch(file_paths, out_dir, workers=None, mix_mode=None, cache_bytes=256 * 1024 * 1024, report=None,
+                 cache_dir=None, cache_dir_bytes=1024 * 1024 * 1024):
+    """
+    用一个常驻的进程池渲染所有乐谱，每个进程只启动一次
+    workers: 进程数，None表示CPU核数，0表示在当前进程中渲染
+    mix_mode: 所有乐谱统一的混音方式，优先于乐谱metadata中的mix_mode，None表示按各乐谱的设置，见render_song
+    输出文件名见src.score_format.get_output_paths
+    cache_dir: 磁盘缓存目录，代替每个进程内存中的块缓存，所有进程和多次运行共用，
+        常用的伴奏块（例如相同bpm的鼓点）只合成一次；None表示只使用内存缓存
+    report: 每首歌完成时调用report(result)，失败时result中有'error'
+    返回结果列表，顺序与完成顺序一致
+    """
+    tasks = list(zip(file_paths, get_output_paths(file_paths, out_dir, '.wav')))
+    for out_dir_path in {os.path.dirname(out_path) for _, out_path in tasks} | {out_dir}:
+        os.makedirs(out_dir_path, exist_ok=True)
+    results = []
+
+    def finish(file_path, out_path, get_result):
+        try:
+            result = get_result()
+        except Exception as e:
+            result = {'input': file_path, 'output': out_path, 'error': f'{type(e).__name__}: {e}'}
+        results.append(result)
+        if report is not None:
+            report(result)
+
+    if workers == 0:
+        _init_worker(cache_bytes, cache_dir, cache_dir_bytes)
+        for file_path, out_path in tasks:
+            finish(file_path, out_path, lambda: render_song(file_path, out_path, mix_mode))
+        return results
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(cache_bytes, cache_dir, cache_dir_bytes)) as executor:
+        future_dict = {executor.submit(render_song, file_path, out_path, mix_mode): (file_path, out_path)
+                       for file_path, out_path in tasks}
+        for future in as_completed(future_dict):
+            finish(*future_dict[future], future.result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='batch render 8bit score files to wav')
+    parser.add_argument('inputs', nargs='*',
+                        help=f"score files ({', '.join(SCORE_FILE_EXTENSIONS)}) or directories of them")
+    parser.add_argument('--manifest', help='text file listing one score file per line')
+    parser.add_argument('-o', '--out-dir', default='out', help='directory for the rendered wav files')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes, default is the CPU count, 0 renders in this process')
+    parser.add_argument('--mix-mode', choices=['clip', 'normalize'],
+                        help="overrides the mix_mode stored in each score file, default is the file's mix_mode or clip")
+    parser.add_argument('--cache-mb', type=int, default=256, help='per-worker block cache size in MiB')
+    parser.add_argument('--cache-dir', help='on-disk block cache directory shared by all workers and runs')
+    parser.add_argument('--cache-dir-mb', type=int, default=1024, help='on-disk block cache size in MiB')
+    args = parser.parse_args(argv)
+
+    file_paths = find_score_files(args.inputs, args.manifest)
+    if len(file_paths) == 0:
+        parser.error('no score files given')
+
+    def report(result):
+        if 'error' in result:
+            print(f"FAILED {result['input']}: {result['error']}", file=sys.stderr)
+        else:
+            print(f"{result['input']} -> {result['output']}  {result['seconds'] * 1000:.1f} ms  "
+                  f"{result['samples'] / result['seconds'] / 1e6:.2f} Msamples/s  "
+                  f"blocks {result['hits']} cached / {result['misses']} rendered")
+
+    start = time.perf_counter()
+    results = render_batch(file_paths, args.out_dir, args.workers, args.mix_mode, args.cache_mb * 1024 * 1024,
+                           report, args.cache_dir, args.cache_dir_mb * 1024 * 1024)
+    seconds = time.perf_counter() - start
+    done = [result for result in results if 'error' not in result]
+    samples = sum(result['samples'] for result in done)
+    print(f"{len(done)}/{len(results)} songs in {seconds:.2f} s, {len(done) / seconds:.1f} songs/s, "
+          f"{samples / seconds / 1e6:.2f} Msamples/s")
+    return 0 if len(done) == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import os
+import time
+import weakref
+import numpy as np
+from src.compiler import render_events, split_by_technique
+
+
+def _render_score_events(score_events, by_technique=False):
+    """
+    返回 (波形, [(技法编号, 合成耗时, 发声的采样点数),...])，在执行器中计时，不包含排队等待的时间
+    by_technique为True时按技法编号分别合成并计时，同Rhythm8bit.render_score_events，否则只有一项且编号为None
+    """
+    wav = np.zeros(score_events.sample_count, dtype=np.uint8)
+    if not by_technique:
+        start = time.perf_counter()
+        render_events(score_events, wav)
+        return wav, [(None, time.perf_counter() - start, len(wav))]
+    timings = []
+    for technique_code, technique_events in split_by_technique(score_events):
+        start = time.perf_counter()
+        render_events(technique_events, wav)
+        timings.append((technique_code, time.perf_counter() - start, int(technique_events.events['length'].sum())))
+    return wav, timings
+
+
+# asyncio渲染接口
+class AsyncRenderer:
+    def __init__(self, executor=None, max_concurrency=None):
+        """
+        executor: 合成用的ThreadPoolExecutor或ProcessPoolExecutor，None表示事件循环默认的线程池
+            进程池中只传递编译好的ScoreEvents，与render_blocks_parallel相同
+        max_concurrency: 同时在执行器中运行的任务数上限，同一个事件循环中的所有请求共用，None表示CPU核数
+        可以在多个事件循环中使用，每个事件循环有各自的信号量
+        """
+        self.executor = executor
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self._semaphore_dict = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore_dict.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphore_dict[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _run(self, executor, func, *args):
+        async with self._get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+    async def iter_gen_music(self, band, score_dict, mix_mode='clip'):
+        """
+        异步生成混音，每渲染完一个块、一个乐器和混音结束时各产生一个进度事件
+        event example:
+            {'type': 'block', 'instrument': 'guitar_theme', 'block': 0, 'blocks': 2, 'samples': 18375}
+            {'type': 'instrument', 'instrument': 'guitar_theme', 'samples': 36750}
+            {'type': 'done', 'samples': 36750}
+        结束后结果保存在band.music_wav中，同gen_music；音轨的生成和混音与gen_music共用Band8bit的方法，
+        band的stem_cache、profiler和音符统计同样生效（合成耗时同样按技法统计），stem_cache命中的乐器没有block事件
+        取消时已经提交的块会执行完，其余块不再提交
+        """
+        for instrument in score_dict.keys():
+            if instrument not in band.instrument_obj_dict.keys():
+                raise ValueError(f"Unknown instrument: {instrument}, should be one of "
+                                 f"{band.instrument_obj_dict.keys()}")
+        track_dict = {}
+        for instrument, score_list_list in score_dict.items():
+            track = None
+            if band.stem_cache is not None:
+                digest, track = await self._run(None, band._get_cached_stem, instrument, score_list_list)
+            if track is None:
+                # 编译需要乐器对象，在线程中进行；合成只需要ScoreEvents，可以交给进程池
+                block_list = await self._run(None, band.compile_one_instrument, instrument, score_list_list)
+                instrument_obj = band.instrument_obj_dict[instrument]
+                builder = band._iter_instrument_track(instrument, block_list, score_list_list)
+                try:
+                    i, score_events = next(builder)
+                    while True:
+                        wav = None
+                        if score_events is not None:
+                            wav, timings = await self._run(self.executor, _render_score_events, score_events,
+                                                           band.profiler is not None)
+                            if band.profiler is not None:
+                                nbytes = wav.nbytes
+                                for technique_code, seconds, samples in timings:
+                                    band.profiler.record_phase('synthesize', instrument,
+                                                               instrument_obj.get_technique_name(technique_code),
+                                                               seconds, samples, nbytes)
+                                    nbytes = 0
+                        block_score_events, repeat_times = block_list[i]
+                        yield {'type': 'block', 'instrument': instrument, 'block': i, 'blocks': len(block_list),
+                               'samples': block_score_events.sample_count * repeat_times}
+                        i, score_events = builder.send(wav)
+                except StopIteration as stop:
+                    track = stop.value
+                if band.stem_cache is not None:
+                    await self._run(None, band.stem_cache.put, digest, track.expand())
+            track_dict[instrument] = track
+            yield {'type': 'instrument', 'instrument': instrument, 'samples': track.sample_count}
+
+        music_wav = await self._run(None, band._mix_tracks, track_dict, mix_mode)
+        yield {'type': 'done', 'samples': len(music_wav)}
+
+    async def gen_music(self, band, score_dict, mix_mode='clip', timeout=None, progress=None):
+        """
+        Band8bit.gen_music的异步版本，返回band.music_wav
+        timeout: 秒，超时抛出asyncio.TimeoutError
+        progress: 每个进度事件调用一次progress(event)，可以是普通函数或协程函数
+        """
+        async def run():
+            async for event in self.iter_gen_music(band, score_dict, mix_mode):
+                if progress is not None:
+                    result = progress(event)
+                    if asyncio.iscoroutine(result):
+                        await result
+            return band.music_wav
+
+        return await asyncio.wait_for(run(), timeout)
+
+    async def write_music(self, band, file_path, timeout=None):
+        """
+        Band8bit.write_music的异步版本
+        """
+        await asyncio.wait_for(self._run(None, band.write_music, file_path), timeout)
+
+    async def render_music_to_file(self, band, file_path, score_dict, mix_mode='clip', timeout=None):
+        """
+        Band8bit.render_music_to_file的异步版本，返回写入的采样点数
+        """
+        return await asyncio.wait_for(self._run(None, band.render_music_to_file, file_path, score_dict, mix_mode),
+                                      timeout)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+# 音符波形缓存
+class WaveCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        max_bytes: 缓存占用内存上限（字节），超出后按LRU淘汰最久未使用的波形
+        key example:
+            ('Guitar8bit', 120, 'quarter', 11025, 16, ('A4', '1/8', 'pr'))  逐音符生成的波形
+            ('Guitar8bit', 120, 'quarter', 11025, 16, 'events', ('A4', '1/8', 'pr'))  编译的事件模板
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes should be positive")
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._wav_dict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._wav_dict)
+
+    def __contains__(self, key):
+        return key in self._wav_dict
+
+    def get(self, key):
+        """
+        命中返回只读波形，未命中返回None
+        """
+        with self._lock:
+            wav = self._wav_dict.get(key)
+            if wav is None:
+                self.misses += 1
+                return None
+            self._wav_dict.move_to_end(key)
+            self.hits += 1
+            return wav
+
+    def put(self, key, wav):
+        """
+        存入波形，返回只读的波形
+        单个波形超过max_bytes时不缓存，直接返回只读波形
+        """
+        # 视图可能被其他数组改写，先复制一份
+        if wav.base is not None:
+            wav = wav.copy()
+        wav.flags.writeable = False
+        if wav.nbytes > self.max_bytes:
+            return wav
+        with self._lock:
+            old_wav = self._wav_dict.pop(key, None)
+            if old_wav is not None:
+                self.current_bytes -= old_wav.nbytes
+            self._wav_dict[key] = wav
+            self.current_bytes += wav.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted_wav = self._wav_dict.popitem(last=False)
+                self.current_bytes -= evicted_wav.nbytes
+                self.evictions += 1
+        return wav
+
+    def clear(self):
+        with self._lock:
+            self._wav_dict.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'entries': len(self._wav_dict),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes}
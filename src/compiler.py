@@ -0,0 +1,189 @@
+import numpy as np
+from src.utils import get_wavetable, get_noise_table, get_phase_ramp, PHASE_BITS, PHASE_MASK, WAVETABLE_BITS, \
+    WAVETABLE_SIZE, NOISE_TABLE_SIZE
+
+# 音符事件：onset和length以采样点为单位
+# gate_period>0时按周期开关声音（颤音），每个周期内前gate_on个采样点发声且相位从零开始
+# voice是声部编号，同一声部内的事件互不重叠（和弦的三个音各占一个声部）
+EVENT_DTYPE = np.dtype([('onset', np.int64),
+                        ('length', np.int64),
+                        ('frequency', np.float64),
+                        ('amplitude', np.uint8),
+                        ('technique', np.int8),
+                        ('gate_period', np.int64),
+                        ('gate_on', np.int64),
+                        ('voice', np.int8)])
+
+WAVE_SHAPES = ['square', 'triangle', 'noise']
+
+# 一次向量化合成的采样点数上限，限制临时数组的内存
+RENDER_CHUNK_SAMPLES = 1 << 20
+
+
+# 编译后的音轨
+class ScoreEvents:
+    def __init__(self, events, sample_count, shape, sample_rate):
+        """
+        events: EVENT_DTYPE数组，按onset排序
+        sample_count: 音轨总采样点数（包含休止符）
+        shape: 'square', 'triangle', 'noise'
+        """
+        if shape not in WAVE_SHAPES:
+            raise ValueError(f"Unknown shape: {shape}, should be one of {WAVE_SHAPES}")
+        self.events = events
+        self.sample_count = sample_count
+        self.shape = shape
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.events)
+
+
+def assemble_score_events(templates, template_sample_counts, score_ids):
+    """
+    把每种音符的事件模板按乐谱顺序拼成整条音轨的事件数组
+    templates: 每种音符的事件数组列表，onset相对音符起点
+    template_sample_counts: 每种音符的采样点数
+    score_ids: 乐谱中每个音符对应的模板序号
+    返回 (events, sample_count)
+    """
+    score_ids = np.asarray(score_ids, dtype=np.intp)
+    note_sample_counts = np.asarray(template_sample_counts, dtype=np.int64)[score_ids]
+    note_onsets = np.cumsum(note_sample_counts) - note_sample_counts
+    sample_count = int(note_sample_counts.sum())
+    if len(templates) == 0:
+        return np.empty(0, dtype=EVENT_DTYPE), sample_count
+
+    template_event_counts = np.array([len(template) for template in templates], dtype=np.int64)
+    template_starts = np.cumsum(template_event_counts) - template_event_counts
+    all_templates = np.concatenate(templates)
+
+    note_event_counts = template_event_counts[score_ids]
+    note_event_starts = np.cumsum(note_event_counts) - note_event_counts
+    event_count = int(note_event_counts.sum())
+    note_index = np.repeat(np.arange(len(score_ids)), note_event_counts)
+    rows = template_starts[score_ids][note_index] + np.arange(event_count) - note_event_starts[note_index]
+
+    events = all_templates[rows]
+    events['onset'] += note_onsets[note_index]
+    return events, sample_count
+
+
+def split_by_technique(score_events):
+    """
+    按技法编号拆分音轨，返回 [(technique_code, ScoreEvents),...]，用于按技法统计合成耗时
+    各部分依次render_events到同一个out上，结果与整条音轨一次合成相同
+    """
+    codes = score_events.events['technique']
+    return [(int(code), ScoreEvents(score_events.events[codes == code], score_events.sample_count,
+                                    score_events.shape, score_events.sample_rate))
+            for code in np.unique(codes)]
+
+
+def render_events(score_events, out):
+    """
+    把编译后的音轨叠加到out上，out可以是uint8或更宽的整数数组，长度至少为sample_count
+    返回out
+    """
+    events = score_events.events
+    events = events[events['length'] > 0]
+    if len(events) == 0:
+        return out
+    for voice in np.unique(events['voice']):
+        voice_events = events[events['voice'] == voice]
+        # 按采样点位置分块，避免一次生成整条音轨长度的临时数组
+        chunk_ids = voice_events['onset'] // RENDER_CHUNK_SAMPLES
+        split_index = np.flatnonzero(np.diff(chunk_ids)) + 1
+        for chunk_events in np.split(voice_events, split_index):
+            _render_voice_chunk(chunk_events, score_events.shape, score_events.sample_rate, out)
+    return out
+
+
+def render_events_range(score_events, out, start, end):
+    """
+    只合成与[start, end)重叠的事件，叠加到out上，out[0]对应start，长度至少为end - start
+    跨区间边界的事件整条合成后只加重叠部分，耗时与区间长度有关，与音轨长度无关
+    结果与render_events后取[start, end)相同
+    """
+    events = score_events.events
+    ends = events['onset'] + events['length']
+    overlap = (events['onset'] < end) & (ends > start) & (events['length'] > 0)
+    events = events[overlap]
+    if len(events) == 0:
+        return out
+    buffer_start = min(start, int(events['onset'].min()))
+    buffer_end = max(end, int(ends[overlap].max()))
+    events = events.copy()
+    events['onset'] -= buffer_start
+    buffer = np.zeros(buffer_end - buffer_start, dtype=out.dtype)
+    render_events(ScoreEvents(events, len(buffer), score_events.shape, score_events.sample_rate), buffer)
+    out[:end - start] += buffer[start - buffer_start:end - buffer_start]
+    return out
+
+
+def _render_voice_chunk(events, shape, sample_rate, out):
+    """
+    同一声部的事件互不重叠，把事件之间的空隙也当作静音段，
+    整块连续生成后一次叠加到out[start:end]，不需要逐采样点的散列写入
+    """
+    onsets = events['onset']
+    ends = onsets + events['length']
+    start = int(onsets[0])
+    end = int(ends[-1])
+
+    # 每个事件前插入一个静音段
+    segment_count = 2 * len(events)
+    segment_lengths = np.empty(segment_count, dtype=np.int64)
+    segment_lengths[0::2] = onsets - np.concatenate([[start], ends[:-1]])
+    segment_lengths[1::2] = events['length']
+    segment_starts = np.cumsum(segment_lengths) - segment_lengths
+    segment_sound = np.zeros(segment_count, dtype=np.uint8)
+    segment_sound[1::2] = 1
+
+    total = end - start
+    local = get_phase_ramp(total) - np.repeat(segment_starts.astype(np.uint32), segment_lengths)
+
+    # 颤音：相位在每个周期重新开始，周期后段静音
+    sound = np.repeat(segment_sound, segment_lengths)
+    gate_periods = events['gate_period']
+    if np.any(gate_periods > 0):
+        segment_periods = np.full(segment_count, PHASE_MASK, dtype=np.uint32)
+        segment_periods[1::2] = np.where(gate_periods > 0, gate_periods, PHASE_MASK)
+        segment_gate_on = np.full(segment_count, PHASE_MASK, dtype=np.uint32)
+        segment_gate_on[1::2] = np.where(gate_periods > 0, events['gate_on'], PHASE_MASK)
+        local %= np.repeat(segment_periods, segment_lengths)
+        sound &= local < np.repeat(segment_gate_on, segment_lengths)
+
+    amplitudes = events['amplitude']
+    single_amplitude = bool(np.all(amplitudes == amplitudes[0]))
+    if shape == 'noise':
+        # 每个事件都从噪音表开头读取，与gen_noise_wave一致
+        if single_amplitude:
+            values = np.take(get_noise_table(int(amplitudes[0])), local, mode='wrap')
+        else:
+            amplitude_list = np.unique(amplitudes)
+            noise_tables = np.concatenate([get_noise_table(int(a)) for a in amplitude_list])
+            local %= NOISE_TABLE_SIZE
+            segment_offsets = np.zeros(segment_count, dtype=np.uint32)
+            segment_offsets[1::2] = np.searchsorted(amplitude_list, amplitudes) * NOISE_TABLE_SIZE
+            local += np.repeat(segment_offsets, segment_lengths)
+            values = np.take(noise_tables, local)
+    else:
+        segment_increments = np.zeros(segment_count, dtype=np.uint32)
+        segment_increments[1::2] = (np.round(events['frequency'] * (1 << PHASE_BITS) / sample_rate)
+                                    .astype(np.int64) & PHASE_MASK)
+        acc = local
+        acc *= np.repeat(segment_increments, segment_lengths)
+        acc >>= PHASE_BITS - WAVETABLE_BITS
+        if single_amplitude:
+            values = np.take(get_wavetable(shape, int(amplitudes[0])), acc)
+        else:
+            amplitude_list = np.unique(amplitudes)
+            wavetables = np.concatenate([get_wavetable(shape, int(a)) for a in amplitude_list])
+            segment_offsets = np.zeros(segment_count, dtype=np.uint32)
+            segment_offsets[1::2] = np.searchsorted(amplitude_list, amplitudes) * WAVETABLE_SIZE
+            acc += np.repeat(segment_offsets, segment_lengths)
+            values = np.take(wavetables, acc)
+
+    values *= sound
+    out[start:end] += values
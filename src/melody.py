@@ -1,73 +1,144 @@
+import hashlib
 import numpy as np
 import wave
+from collections import Counter
 from abc import ABC, abstractmethod
-from src.utils import gen_square_wave, gen_triangle_wave, gen_zero_wave, gen_noise_wave, regularize_wave
+from functools import lru_cache
+from types import MappingProxyType
+from src.utils import gen_square_wave, gen_triangle_wave, gen_zero_wave, gen_noise_wave, get_noise_table, \
+    regularize_wave, gen_wave_blocks
+from src.compiler import EVENT_DTYPE, ScoreEvents, assemble_score_events, render_events, split_by_technique
+from src.mixer import MixBus, Track, get_blocks_sample_count, convert_to_uint8, get_dirty_range, merge_ranges, \
+    get_mix_dtype
+from src.parallel import render_blocks_parallel
+from src.pitch import PITCH_FREQUENCY_DICT, PITCH_CLASS_DICT, SCALE_PITCH_DICT, CHORD_TYPES, CHORD_PITCH_DICT, \
+    INTERVAL_DICT, METHOD_SEMITONE_DICT, pitch_to_midi, midi_to_pitch, pitches_to_midi, midis_to_pitches, \
+    transpose_midis, midis_to_frequencies
+from src.timing import get_timing_table
+from src.cache import WaveCache
+from src.profiler import profile_phase
+from src.score_format import ScoreArray, get_score_list_key
+from src.onset_index import OnsetIndex
+from src.wavio import write_wave_file, create_wave_memmap
+
+# 各乐器共享的只读表
+EMPTY_PERFORMANCES = MappingProxyType({})
+REST_PITCH_DICT = MappingProxyType({'O': 0})
+# 特殊技法：延音、颤音、滑音、三和弦、三和弦琶音
+GUITAR_PERFORMANCES = MappingProxyType({'pr': 'prolong 延音',
+                                        'tr': 'trill 颤音',
+                                        'sl': 'slide 滑音',
+                                        'maj-chord': 'major triad 大三和弦',
+                                        'maj-arpeggio': 'major triad arpeggio 大三和弦琶音',
+                                        'min-chord': 'minor triad 小三和弦',
+                                        'min-arpeggio': 'minor triad arpeggio 小三和弦琶音',
+                                        'dim-chord': 'diminished triad 减三和弦',
+                                        'dim-arpeggio': 'diminished triad arpeggio 减三和弦琶音',
+                                        'aug-chord': 'augmented triad 增三和弦',
+                                        'aug-arpeggio': 'augmented triad arpeggio 增三和弦琶音',
+                                        })
+DRUM_PITCH_DICT = MappingProxyType({'K': 0.08,  # second of kick 底鼓
+                                    'S': 0.05,  # second of snare 军鼓
+                                    'H': 0.02,  # second of hi-hat 镲音
+                                    'O': 0.0})
+INSTRUMENT_TYPES = ('guitar', 'bass', 'drum')
+CHORD_SEQ_DICT = MappingProxyType({'I': 0, 'II': 1, 'III': 2, 'IV': 3, 'V': 4, 'VI': 5, 'VII': 6})
+CHORD_DEGREE_NAMES = tuple(CHORD_SEQ_DICT.keys())
+TONIC_CHORDS = ('I', 'VI')
+DOMINANT_CHORDS = ('V', 'III', 'VII')
+SUBDOMINANT_CHORDS = ('II', 'IV')
+CHORD_FUNC_DICT = MappingProxyType({'T': TONIC_CHORDS, 'D': DOMINANT_CHORDS, 'S': SUBDOMINANT_CHORDS})
+POPULAR_CHORD_PROGRESSION_TYPES = ('T-S-D-T', 'S-D-D-T-S-D-T-T', 'T-D-T-D-S-T-S-T')
+# 大调 全全半全全全半，小调 全半全全半全全
+MODE_SCALE_STEPS = MappingProxyType({'maj': (0, 2, 2, 1, 2, 2, 2), 'min': (0, 2, 1, 2, 2, 1, 2)})
+# 合成结果的版本，合成算法或波形格式改变时加一，使磁盘上旧版本的缓存不再命中
+RENDER_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def get_drum_hit_waves(amplitude, sample_rate):
+    """
+    每种鼓一次敲击的只读波形，从同一张确定的噪音表切片得到，相同参数的鼓共用
+    """
+    noise_table = get_noise_table(amplitude)
+    hit_wave_dict = {}
+    for pitch, duration in DRUM_PITCH_DICT.items():
+        sample_count = int(duration * sample_rate)
+        if sample_count <= len(noise_table):
+            hit_wave_dict[pitch] = noise_table[:sample_count]
+        else:
+            hit_wave_dict[pitch] = gen_noise_wave(amplitude, duration, sample_rate)
+            hit_wave_dict[pitch].flags.writeable = False
+    return MappingProxyType(hit_wave_dict)
+
+
+@lru_cache(maxsize=None)
+def get_scale_table(tonality):
+    """
+    调性的七个自然音，返回只读的int8音名编码数组，编码是PITCH_CLASS_NAMES的序号
+    tonality example: 'C-maj', 'A-min', '#F-maj'
+    """
+    tonality = tonality.split('-')
+    if len(tonality) != 2 or tonality[0] not in PITCH_CLASS_DICT.keys() or tonality[1] not in MODE_SCALE_STEPS.keys():
+        raise ValueError("mode example: 'C-maj', 'A-min', '#F-maj'")
+    scale_table = ((PITCH_CLASS_DICT[tonality[0]] + np.cumsum(MODE_SCALE_STEPS[tonality[1]])) % 12).astype(np.int8)
+    scale_table.flags.writeable = False
+    return scale_table
+
+
+@lru_cache(maxsize=None)
+def get_chord_progression_table(chord_progression_type):
+    """
+    和弦进行类型每个位置可选的级数，返回只读的int8数组，形状为(和弦数, 3)，不足3个的用-1补齐
+    chord_progression_type example: 'T-S-D-T'
+    """
+    chord_funcs = chord_progression_type.split('-')
+    for chord_func in chord_funcs:
+        if chord_func not in CHORD_FUNC_DICT.keys():
+            raise ValueError(f"Unknown chord function: {chord_func}, should be one of {list(CHORD_FUNC_DICT.keys())}")
+    progression_table = np.full((len(chord_funcs), 3), -1, dtype=np.int8)
+    for i, chord_func in enumerate(chord_funcs):
+        chords = CHORD_FUNC_DICT[chord_func]
+        progression_table[i, :len(chords)] = [CHORD_SEQ_DICT[chord] for chord in chords]
+    progression_table.flags.writeable = False
+    return progression_table
 
 
 # 节拍类
 class Rhythm8bit(ABC):
-    def __init__(self, bpm, one_beat_note='quarter'):
+    __slots__ = ('bpm', 'one_beat_note', 'sample_rate', 'wav', 'wave_cache',
+                 'amplitude', 'instrument_duration', 'performances', 'pitch_dict', 'wave_shape',
+                 'eighth_beat_sample_count', 'quarter_beat_sample_count', 'half_beat_sample_count',
+                 'one_beat_sample_count', 'two_beat_sample_count', 'four_beat_sample_count',
+                 'eight_beat_sample_count', 'note_sample_count', 'instrument_name', 'profiler')
+
+    def __init__(self, bpm, one_beat_note='quarter', wave_cache=None, sample_rate=11025):
         self.bpm = bpm  # beats per minute 60-240 节拍数
         self.one_beat_note = one_beat_note  # 'half', 'quarter', 'eighth' 以几分音符为一拍
-        self.sample_rate = 11025  # 采样率  # Hz 采样率
+        self.sample_rate = sample_rate  # Hz 采样率，例如11025、22050、44100
         self.wav = np.array([], dtype=np.uint8)  # 音频数据
+        self.wave_cache = wave_cache  # WaveCache 逐音符生成时缓存波形，编译时缓存音符的事件模板，None表示不缓存
+        self.instrument_name = type(self).__name__  # 统计中使用的乐器名
+        self.profiler = None  # RenderProfiler 渲染统计，None表示不统计
 
         # child class set
         self.amplitude = 0  # 0-255 音量
         self.instrument_duration = 0  # seconds 器乐固有时长
-        self.performances = {}  # 演奏技法
-        self.pitch_dict = {'O': 0}  # 音符字典 必须包含'O'，表示休止符
-
-        if self.bpm < 60 or self.bpm > 240:
-            raise ValueError("BPM should be between 60 and 240")
-        if self.one_beat_note not in ['half', 'quarter', 'eighth']:
-            raise ValueError("One beat note should be 'half', 'quarter', or 'eighth'")
-
-        one_beat_duration = 60 / self.bpm  # seconds
-        eighth_beat_duration = one_beat_duration * 0.125
-
-        self.eighth_beat_sample_count = int(round(eighth_beat_duration * self.sample_rate))
-        self.quarter_beat_sample_count = int(self.eighth_beat_sample_count * 2)
-        self.half_beat_sample_count = int(self.eighth_beat_sample_count * 4)
-        self.one_beat_sample_count = int(self.eighth_beat_sample_count * 8)
-        self.two_beat_sample_count = int(self.eighth_beat_sample_count * 16)
-        self.four_beat_sample_count = int(self.eighth_beat_sample_count * 32)
-        self.eight_beat_sample_count = int(self.eighth_beat_sample_count * 64)
-
-        # 以二分音符为一拍
-        if self.one_beat_note == 'half':
-            # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的采样点数
-            self.note_sample_count = {'1/2': self.one_beat_sample_count,
-                                      '1/2.': self.one_beat_sample_count + self.half_beat_sample_count,
-                                      '1/4': self.half_beat_sample_count,
-                                      '1/4.': self.half_beat_sample_count + self.quarter_beat_sample_count,
-                                      '1/8': self.quarter_beat_sample_count,
-                                      '1/8.': self.quarter_beat_sample_count + self.eighth_beat_sample_count,
-                                      '1': self.two_beat_sample_count}
-        # 以四分音符为一拍
-        elif self.one_beat_note == 'quarter':
-            # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的时长
-            self.note_sample_count = {'1/2': self.two_beat_sample_count,
-                                      '1/2.': self.two_beat_sample_count + self.one_beat_sample_count,
-                                      '1/4': self.one_beat_sample_count,
-                                      '1/4.': self.one_beat_sample_count + self.half_beat_sample_count,
-                                      '1/8': self.half_beat_sample_count,
-                                      '1/8.': self.half_beat_sample_count + self.quarter_beat_sample_count,
-                                      '1/16': self.quarter_beat_sample_count,
-                                      '1/16.': self.quarter_beat_sample_count + self.eighth_beat_sample_count,
-                                      '1': self.four_beat_sample_count}
-        # 以八分音符为一拍
-        elif self.one_beat_note == 'eighth':
-            # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的时长
-            self.note_sample_count = {'1/2': self.four_beat_sample_count,
-                                      '1/2.': self.four_beat_sample_count + self.two_beat_sample_count,
-                                      '1/4': self.two_beat_sample_count,
-                                      '1/4.': self.two_beat_sample_count + self.one_beat_sample_count,
-                                      '1/8': self.one_beat_sample_count,
-                                      '1/8.': self.one_beat_sample_count + self.half_beat_sample_count,
-                                      '1/16': self.half_beat_sample_count,
-                                      '1/16.': self.half_beat_sample_count + self.quarter_beat_sample_count,
-                                      '1': self.eight_beat_sample_count}
+        self.performances = EMPTY_PERFORMANCES  # 演奏技法
+        self.pitch_dict = REST_PITCH_DICT  # 音符字典 必须包含'O'，表示休止符
+        self.wave_shape = 'square'  # 'square', 'triangle', 'noise' 向量化合成用的波形
+
+        # 相同参数的乐器共享同一张只读时值表
+        timing_table = get_timing_table(self.bpm, self.one_beat_note, self.sample_rate)
+        self.sample_rate = timing_table.sample_rate
+        self.eighth_beat_sample_count = timing_table.eighth_beat_sample_count
+        self.quarter_beat_sample_count = timing_table.quarter_beat_sample_count
+        self.half_beat_sample_count = timing_table.half_beat_sample_count
+        self.one_beat_sample_count = timing_table.one_beat_sample_count
+        self.two_beat_sample_count = timing_table.two_beat_sample_count
+        self.four_beat_sample_count = timing_table.four_beat_sample_count
+        self.eight_beat_sample_count = timing_table.eight_beat_sample_count
+        self.note_sample_count = timing_table.note_sample_count
 
     @abstractmethod
     def gen_timbre_wave(self, pitch: str, *args) -> np.array:
@@ -87,15 +158,48 @@ class Rhythm8bit(ABC):
         """
         pass
 
-    def gen_one_score_wave(self, score: (str, str, str)) -> np.array:
+    @abstractmethod
+    def compile_timbre_events(self, pitch: str, one_score_sample_count: int) -> list:
         """
-        生成一个音符的波形
-        score是音符，格式为(pitch,note,technique)的元组
+        编译一个普通单音，返回事件元组列表（见make_event），onset相对音符起点
+        """
+        pass
+
+    @abstractmethod
+    def compile_technique_events(self, pitch: str, one_score_sample_count: int, technique: str) -> list:
+        """
+        编译一个特技演奏音符，返回事件元组列表（见make_event），onset相对音符起点
+        """
+        pass
+
+    def get_technique_code(self, technique):
+        """
+        技法编号，普通单音为0，其余按self.performances中的顺序从1开始
+        """
+        if len(technique) == 0:
+            return 0
+        return list(self.performances.keys()).index(technique) + 1
+
+    def get_technique_name(self, technique_code):
+        """
+        get_technique_code的逆运算，0返回''
         """
+        if technique_code == 0:
+            return ''
+        return list(self.performances.keys())[technique_code - 1]
+
+    def make_event(self, onset, length, frequency, technique, gate_period=0, gate_on=0, voice=0):
+        """
+        生成一个EVENT_DTYPE格式的事件元组
+        """
+        return onset, length, frequency, self.amplitude, self.get_technique_code(technique), gate_period, gate_on, voice
+
+    def check_score(self, score):
+        if not isinstance(score, tuple) or len(score) != 3:
+            raise ValueError(f"score_list: [(pitch, note, technique),...]")
         pitch = score[0]
         note = score[1]
         technique = score[2]
-
         if pitch not in self.pitch_dict.keys():
             raise ValueError(f'Unknown pitch: {pitch}, should be one of {self.pitch_dict.keys()}')
         if note not in self.note_sample_count.keys():
@@ -103,71 +207,250 @@ class Rhythm8bit(ABC):
         if technique not in self.performances.keys() and len(technique) > 0:
             raise ValueError(f'Unknown technique: {technique}, should be one of {self.performances.keys()}')
 
+    def gen_one_score_wave(self, score: (str, str, str)) -> np.array:
+        """
+        生成一个音符的波形
+        score是音符，格式为(pitch,note,technique)的元组
+        设置了wave_cache时返回的是只读波形
+        """
+        if self.profiler is not None:
+            self.profiler.count_notes(self.instrument_name, score[2], 1)
+        if self.wave_cache is None:
+            wav = self._gen_one_score_wave(score)
+            # 鼓的波形可能是共用的只读噪音表切片
+            return wav if wav.flags.writeable else wav.copy()
+        key = (type(self).__name__, self.bpm, self.one_beat_note, self.sample_rate, self.amplitude, score)
+        wav = self.wave_cache.get(key)
+        if wav is None:
+            wav = self.wave_cache.put(key, self._gen_one_score_wave(score))
+        return wav
+
+    def _gen_one_score_wave(self, score):
+        self.check_score(score)
+        pitch = score[0]
+        note = score[1]
+        technique = score[2]
+
         score_sample_count = self.note_sample_count[note]
 
         # 休止符
         if pitch == 'O':
             return gen_zero_wave(score_sample_count)
 
-        # 普通单音
-        if len(technique) == 0:
-            wav = self.gen_timbre_wave(pitch)
-        # 特殊技法
+        with profile_phase(self.profiler, 'synthesize', self.instrument_name, technique) as phase:
+            # 普通单音
+            if len(technique) == 0:
+                wav = self.gen_timbre_wave(pitch)
+            # 特殊技法
+            else:
+                wav = self.gen_instrument_technique_wave(pitch, score_sample_count, technique)
+            phase.record(wav)
+
+        with profile_phase(self.profiler, 'regularize', self.instrument_name, technique):
+            return regularize_wave(wav, score_sample_count)
+
+    def compile_one_score(self, score):
+        """
+        编译一个音符，返回 (events, score_sample_count)，events中onset相对音符起点
+        超出音符时值的部分被截断，与regularize_wave一致
+        """
+        self.check_score(score)
+        pitch = score[0]
+        note = score[1]
+        technique = score[2]
+
+        score_sample_count = self.note_sample_count[note]
+        if pitch == 'O':
+            event_list = []
+        elif len(technique) == 0:
+            event_list = self.compile_timbre_events(pitch, score_sample_count)
+        else:
+            event_list = self.compile_technique_events(pitch, score_sample_count, technique)
+
+        events = np.array(event_list, dtype=EVENT_DTYPE)
+        events = events[events['onset'] < score_sample_count]
+        events['length'] = np.minimum(events['length'], score_sample_count - events['onset'])
+        return events, score_sample_count
+
+    def get_score_template(self, score):
+        """
+        设置了wave_cache时，相同乐器参数的音符只编译一次，缓存只读的事件模板
+        返回值同compile_one_score
+        """
+        if self.wave_cache is None:
+            return self.compile_one_score(score)
+        key = (type(self).__name__, self.bpm, self.one_beat_note, self.sample_rate, self.amplitude, 'events', score)
+        events = self.wave_cache.get(key)
+        if events is None:
+            events = self.wave_cache.put(key, self.compile_one_score(score)[0])
+        return events, self.note_sample_count[score[1]]
+
+    def get_score_digest(self, score_list):
+        """
+        乐器参数、RENDER_VERSION和乐谱内容的哈希，用作整段乐谱渲染结果的缓存键
+        score_list是元组列表或ScoreArray，内容相同时哈希相同
+        """
+        key = (RENDER_VERSION, type(self).__name__, self.bpm, self.one_beat_note, self.sample_rate, self.amplitude,
+               get_score_list_key(score_list))
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+    def compile_score(self, score_list: [(str, str, str)]) -> ScoreEvents:
+        """
+        把乐谱编译成事件数组，相同的音符只编译一次
+        score_list: [(pitch, note, technique),...]或ScoreArray
+        """
+        if isinstance(score_list, ScoreArray):
+            scores, score_ids = score_list.unique_scores()
+            for score in scores:
+                self.check_score(score)
         else:
-            wav = self.gen_instrument_technique_wave(pitch, score_sample_count, technique)
+            score_id_dict = {}
+            score_ids = []
+            for score in score_list:
+                score_id = score_id_dict.get(score)
+                if score_id is None:
+                    self.check_score(score)
+                    score_id = score_id_dict[score] = len(score_id_dict)
+                score_ids.append(score_id)
+            scores = score_id_dict.keys()
 
-        return regularize_wave(wav, score_sample_count)
+        templates = []
+        template_sample_counts = []
+        for score in scores:
+            events, score_sample_count = self.get_score_template(score)
+            templates.append(events)
+            template_sample_counts.append(score_sample_count)
+        events, sample_count = assemble_score_events(templates, template_sample_counts, score_ids)
+        return ScoreEvents(events, sample_count, self.wave_shape, self.sample_rate)
+
+    def render_score_events(self, score_events, out=None):
+        """
+        合成编译好的音轨，叠加到out上，out为None时新建uint8数组，返回out
+        开启统计时按技法编号分别合成，synthesize阶段的耗时和发声的采样点数计入对应的技法；
+        regularize阶段只在逐音符生成（gen_one_score_wave）时出现
+        """
+        if out is None:
+            out = np.zeros(score_events.sample_count, dtype=np.uint8)
+            nbytes = out.nbytes
+        else:
+            nbytes = 0
+        if self.profiler is None:
+            return render_events(score_events, out)
+        for technique_code, technique_events in split_by_technique(score_events):
+            with profile_phase(self.profiler, 'synthesize', self.instrument_name,
+                               self.get_technique_name(technique_code)) as phase:
+                render_events(technique_events, out)
+                phase.samples += int(technique_events.events['length'].sum())
+                phase.nbytes += nbytes
+                nbytes = 0
+        return out
+
+    def get_note_sample_counts(self, score_list):
+        """
+        返回乐谱中每个音符采样点数的int64数组
+        """
+        if isinstance(score_list, ScoreArray):
+            for note in score_list.note_names:
+                if note not in self.note_sample_count.keys():
+                    raise ValueError(f'Unknown note: {note}, should be one of {self.note_sample_count.keys()}')
+            note_table = np.array([self.note_sample_count[note] for note in score_list.note_names], dtype=np.int64)
+            return note_table[score_list.records['note']]
+        note_sample_counts = np.empty(len(score_list), dtype=np.int64)
+        for i, score in enumerate(score_list):
+            self.check_score(score)
+            note_sample_counts[i] = self.note_sample_count[score[1]]
+        return note_sample_counts
+
+    def build_onset_index(self, score_list_list):
+        """
+        score_list_list: [(score_list, repeat_times),...]
+        返回OnsetIndex，用于render_range
+        """
+        return OnsetIndex([(score_list, self.get_note_sample_counts(score_list), repeat_times)
+                           for score_list, repeat_times in score_list_list])
+
+    def render_range(self, onset_index, start, end, out=None):
+        """
+        只合成与[start, end)重叠的音符，结果与整段生成后切片一致，耗时与区间长度有关，与乐谱长度无关
+        onset_index: build_onset_index的返回值
+        out: 叠加到out上，长度为end - start；None表示新建uint8数组，超出音轨的部分为静音
+        返回out
+        """
+        if out is None:
+            out = np.zeros(max(end - start, 0), dtype=np.uint8)
+        wav_dict = {}
+        for block_index, repeat_start, first_note, last_note in onset_index.find(start, end):
+            note_onsets = onset_index.note_onsets[block_index]
+            key = (block_index, first_note, last_note)
+            wav = wav_dict.get(key)
+            if wav is None:
+                with profile_phase(self.profiler, 'compile', self.instrument_name):
+                    score_events = self.compile_score(onset_index.score_lists[block_index][first_note:last_note])
+                wav = wav_dict[key] = self.render_score_events(score_events)
+            wav_start = repeat_start + int(note_onsets[first_note])
+            range_start = max(start, wav_start)
+            range_end = min(end, wav_start + len(wav))
+            out[range_start - start:range_end - start] += wav[range_start - wav_start:range_end - wav_start]
+        return out
 
     def gen_wave(self, score_list: [(str, str, str)], repeat_times=1):
         """
-        score_list: [(pitch, note, technique),...]
+        score_list: [(pitch, note, technique),...]或ScoreArray
         """
-        wave_list = []
-        for score in score_list:
-            if not isinstance(score, tuple) or len(score) != 3:
-                raise ValueError(f"score_list: [(pitch, note, technique),...]")
-            wave_list.append(self.gen_one_score_wave(score))
-        wav = np.concatenate(wave_list)
-        self.wav = np.tile(wav, repeat_times)
+        self.count_score_notes(score_list, repeat_times)
+        with profile_phase(self.profiler, 'compile', self.instrument_name):
+            score_events = self.compile_score(score_list)
+        wav = self.render_score_events(score_events)
+        with profile_phase(self.profiler, 'concatenate', self.instrument_name) as phase:
+            self.wav = np.tile(wav, repeat_times)
+            phase.record(self.wav)
         return self.wav
 
+    def count_score_notes(self, score_list, repeat_times=1):
+        """
+        开启统计时按技法累计音符数
+        """
+        if self.profiler is None:
+            return
+        if isinstance(score_list, ScoreArray):
+            technique_counts = score_list.count_techniques()
+        else:
+            technique_counts = Counter(score[2] for score in score_list)
+        for technique, notes in technique_counts.items():
+            self.profiler.count_notes(self.instrument_name, technique, notes * repeat_times)
+
+    def iter_score_waves(self, score_list_list):
+        """
+        按音符依次生成波形，不拼接整段音频
+        score_list_list: [(score_list, repeat_times),...]
+        """
+        for score_list, repeat_times in score_list_list:
+            for score in score_list:
+                self.check_score(score)
+            for _ in range(repeat_times):
+                for score in score_list:
+                    yield self.gen_one_score_wave(score)
+
     def write_wave(self, file_path):
-        with wave.open(file_path, 'wb') as f:
-            f.setnchannels(1)
-            f.setsampwidth(1)
-            f.setframerate(self.sample_rate)
-            f.writeframes(self.wav.tobytes())
+        with profile_phase(self.profiler, 'write', self.instrument_name) as phase:
+            write_wave_file(file_path, self.wav, self.sample_rate)
+            phase.record(self.wav)
 
 
 # 旋律类
 class Melody8bit:
+    __slots__ = ('pitch_dict', 'pitch_scale', 'scale_pitch', 'chord_types')
+
     def __init__(self):
-        # 十二平均律
-        self.pitch_dict = {'C1': 32.70, 'D1': 36.71, 'E1': 41.20, 'F1': 43.65, 'G1': 48.99, 'A1': 55.00,
-                           'B1': 61.74, 'C2': 65.41, 'D2': 73.42, 'E2': 82.41, 'F2': 87.31, 'G2': 97.99,
-                           'A2': 110.00, 'B2': 123.47, 'C3': 130.81, 'D3': 146.83, 'E3': 164.81, 'F3': 174.61,
-                           'G3': 196.00, 'A3': 220.00, 'B3': 246.94, 'C4': 261.63, 'D4': 293.66, 'E4': 329.63,
-                           'F4': 349.23, 'G4': 392.00, 'A4': 440.00, 'B4': 493.88, 'C5': 523.25, 'D5': 587.33,
-                           'E5': 659.26, 'F5': 698.46, 'G5': 783.99, 'A5': 880.00, 'B5': 987.77, 'C6': 1046.50,
-                           'D6': 1174.66, 'E6': 1318.51, 'F6': 1396.91, 'G6': 1567.98, 'A6': 1760.00, 'B6': 1975.53,
-                           'C7': 2093.00, 'D7': 2349.32, 'E7': 2637.02, 'F7': 2793.83, 'G7': 3135.96, 'A7': 3520.00,
-                           'B7': 3951.07, '#C1': 34.65, '#D1': 39.20, '#F1': 46.25, '#G1': 52.00, '#A1': 58.27,
-                           '#C2': 69.30, '#D2': 78.39, '#F2': 92.50, '#G2': 103.83, '#A2': 116.54, '#C3': 138.59,
-                           '#D3': 155.56, '#F3': 185.00, '#G3': 207.65, '#A3': 233.08, '#C4': 277.18, '#D4': 311.13,
-                           '#F4': 369.99, '#G4': 415.30, '#A4': 466.16, '#C5': 554.37, '#D5': 622.25, '#F5': 739.99,
-                           '#G5': 830.61, '#A5': 932.33, '#C6': 1108.73, '#D6': 1244.51, '#F6': 1479.98, '#G6': 1661.22,
-                           '#A6': 1864.66, '#C7': 2217.46, '#D7': 2489.02, '#F7': 2959.96, '#G7': 3322.44,
-                           '#A7': 3729.31,
-                           'O': 0.0}
+        # 十二平均律，所有实例共享只读的表
+        self.pitch_dict = PITCH_FREQUENCY_DICT
 
         # 音名的音阶关系 方便计算用
-        self.pitch_scale = {'C': 0, '#C': 1, 'D': 2, '#D': 3, 'E': 4, 'F': 5,
-                            '#F': 6, 'G': 7, '#G': 8, 'A': 9, '#A': 10, 'B': 11}
-        self.scale_pitch = {0: 'C', 1: '#C', 2: 'D', 3: '#D', 4: 'E', 5: 'F',
-                            6: '#F', 7: 'G', 8: '#G', 9: 'A', 10: '#A', 11: 'B'}
+        self.pitch_scale = PITCH_CLASS_DICT
+        self.scale_pitch = SCALE_PITCH_DICT
 
         # 常用和弦类型
-        self.chord_types = ['maj', 'min', 'dim', 'aug', 'maj7', '7', 'min7', 'm7-5', 'dim7']
+        self.chord_types = CHORD_TYPES
 
     # 音名计算
     def cal_pitch(self, in_pitch, method):
@@ -177,126 +460,66 @@ class Melody8bit:
             '-min3' 减三小度
             '-semi5' 减五个半音
         """
-        method_scale_dict = {'maj3': 4, 'min3': 3,
-                             'semi1': 1, 'semi2': 2, 'semi3': 3, 'semi4': 4, 'semi5': 5, 'semi6': 6, 'semi7': 7,
-                             'semi8': 8, 'semi9': 9, 'semi10': 10, 'semi11': 11, 'semi12': 12}
-        if method[0] not in ['+', '-']:
-            raise ValueError("method example: '+maj3', '-semi5'")
-        method_start = method[0]
-        method_scale = method[1:]
-        if method_scale not in method_scale_dict.keys():
-            raise ValueError(f"Unknown scale: {method_scale}, should be one of {method_scale_dict.keys()}")
+        semitone = METHOD_SEMITONE_DICT.get(method)
+        if semitone is None:
+            if len(method) == 0 or method[0] not in ['+', '-']:
+                raise ValueError("method example: '+maj3', '-semi5'")
+            raise ValueError(f"Unknown scale: {method[1:]}, should be one of {INTERVAL_DICT.keys()}")
         if in_pitch in self.pitch_scale.keys():
-            base_pitch = in_pitch
-            base_pitch_scale = self.pitch_scale[base_pitch]
-            if method_start == '+':
-                new_pitch_scale = (base_pitch_scale + method_scale_dict[method_scale]) % 12
-            else:
-                new_pitch_scale = (base_pitch_scale - method_scale_dict[method_scale]) % 12
-            return self.scale_pitch[new_pitch_scale]
-        elif in_pitch in self.pitch_dict.keys():
-            n = int(in_pitch[-1])
-            base_pitch = in_pitch[:-1]
-            base_pitch_scale = self.pitch_scale[base_pitch]
-            if method_start == '+':
-                new_pitch_scale = (base_pitch_scale + method_scale_dict[method_scale]) % 12
-                n_add = (base_pitch_scale + method_scale_dict[method_scale]) // 12
-            else:
-                new_pitch_scale = (base_pitch_scale - method_scale_dict[method_scale]) % 12
-                n_add = (base_pitch_scale - method_scale_dict[method_scale]) // 12
-            new_pitch = self.scale_pitch[new_pitch_scale] + str(n + n_add)
-            return new_pitch
+            return self.scale_pitch[(self.pitch_scale[in_pitch] + semitone) % 12]
+        elif in_pitch in self.pitch_dict.keys() and in_pitch != 'O':
+            return midi_to_pitch(pitch_to_midi(in_pitch) + semitone)
         else:
             raise ValueError(f"Unknown pitch: {in_pitch}, should be one of "
                              f"{self.pitch_dict.keys()} or {self.pitch_scale.keys()}")
 
     def get_chord_pitches(self, pitch, chord_type):
+        """
+        查预先计算的和弦表，返回[根音, 三音, 五音(, 七音)]
+        """
         if chord_type not in self.chord_types:
             raise ValueError(f"Unknown chord type: {chord_type}, should be one of {self.chord_types}")
-        if chord_type == 'maj':
-            # 大三和弦，根音、三音（大三度）、五音（小三度）
-            third_pitch = self.cal_pitch(pitch, '+maj3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            return [pitch, third_pitch, fifth_pitch]
-        elif chord_type == 'min':
-            # 小三和弦，根音、三音（小三度）、五音（大三度）
-            third_pitch = self.cal_pitch(pitch, '+min3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+maj3')
-            return [pitch, third_pitch, fifth_pitch]
-        elif chord_type == 'dim':
-            # 减三和弦，根音、三音（小三度）、五音（小三度）
-            third_pitch = self.cal_pitch(pitch, '+min3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            return [pitch, third_pitch, fifth_pitch]
-        elif chord_type == 'aug':
-            # 增三和弦，根音、三音（大三度）、五音（大三度）
-            third_pitch = self.cal_pitch(pitch, '+maj3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+maj3')
-            return [pitch, third_pitch, fifth_pitch]
-        elif chord_type == 'maj7':
-            # 大七和弦：大三和弦+七音（五音大三度）
-            third_pitch = self.cal_pitch(pitch, '+maj3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            seventh_pitch = self.cal_pitch(fifth_pitch, '+maj3')
-            return [pitch, third_pitch, fifth_pitch, seventh_pitch]
-        elif chord_type == '7':
-            # 属七和弦：大三和弦+降七音（五音小三度）
-            third_pitch = self.cal_pitch(pitch, '+maj3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            seventh_pitch = self.cal_pitch(fifth_pitch, '+min3')
-            return [pitch, third_pitch, fifth_pitch, seventh_pitch]
-        elif chord_type == 'min7':
-            # 小七和弦：小三和弦+降七音（五音小三度）
-            third_pitch = self.cal_pitch(pitch, '+min3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+maj3')
-            seventh_pitch = self.cal_pitch(fifth_pitch, '+min3')
-            return [pitch, third_pitch, fifth_pitch, seventh_pitch]
-        elif chord_type == 'm7-5':
-            # 半减七和弦：减三和弦+小七度
-            third_pitch = self.cal_pitch(pitch, '+min3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            seventh_pitch = self.cal_pitch(fifth_pitch, '+maj3')
-            return [pitch, third_pitch, fifth_pitch, seventh_pitch]
-        elif chord_type == 'dim7':
-            # 减七和弦：减三和弦+七音（五音小三度）
-            third_pitch = self.cal_pitch(pitch, '+min3')
-            fifth_pitch = self.cal_pitch(third_pitch, '+min3')
-            seventh_pitch = self.cal_pitch(fifth_pitch, '+min3')
-            return [pitch, third_pitch, fifth_pitch, seventh_pitch]
+        chord_pitches = CHORD_PITCH_DICT.get((pitch, chord_type))
+        if chord_pitches is None:
+            raise ValueError(f"Unknown pitch: {pitch}, should be one of "
+                             f"{self.pitch_dict.keys()} or {self.pitch_scale.keys()}")
+        return list(chord_pitches)
+
+    # 整体移调
+    def transpose_score(self, score_list, semitones):
+        """
+        score_list: [(pitch, note, technique),...]
+        semitones: 移动的半音数，正数升调，负数降调，休止符不变
+        """
+        midis = transpose_midis(pitches_to_midi([score[0] for score in score_list]), semitones)
+        return [(pitch, score[1], score[2]) for pitch, score in zip(midis_to_pitches(midis), score_list)]
 
 
 # 吉他
 class Guitar8bit(Rhythm8bit):
-    def __init__(self, bpm, one_beat_note='quarter'):
-        super().__init__(bpm, one_beat_note)
+    __slots__ = ('melody',)
+
+    def __init__(self, bpm, one_beat_note='quarter', wave_cache=None, sample_rate=11025):
+        super().__init__(bpm, one_beat_note, wave_cache, sample_rate)
         self.instrument_duration = 0.1  # seconds
         self.amplitude = 16
         # 特殊技法：延音、颤音、滑音、三和弦、三和弦琶音
-        self.performances = {'pr': 'prolong 延音',
-                             'tr': 'trill 颤音',
-                             'sl': 'slide 滑音',
-                             'maj-chord': 'major triad 大三和弦',
-                             'maj-arpeggio': 'major triad arpeggio 大三和弦琶音',
-                             'min-chord': 'minor triad 小三和弦',
-                             'min-arpeggio': 'minor triad arpeggio 小三和弦琶音',
-                             'dim-chord': 'diminished triad 减三和弦',
-                             'dim-arpeggio': 'diminished triad arpeggio 减三和弦琶音',
-                             'aug-chord': 'augmented triad 增三和弦',
-                             'aug-arpeggio': 'augmented triad arpeggio 增三和弦琶音',
-                             }
+        self.performances = GUITAR_PERFORMANCES
         self.melody = Melody8bit()
         self.pitch_dict = self.melody.pitch_dict
+        self.wave_shape = 'square'
 
     def gen_timbre_wave(self, pitch, *args):
         frequency = self.pitch_dict[pitch]
-        duration = args[0]
+        duration = args[0] if len(args) > 0 else self.instrument_duration
         return gen_square_wave(frequency, self.amplitude, duration, self.sample_rate)
 
     def gen_prolong_wave(self, pitch, one_score_sample_count):
         one_score_duration = one_score_sample_count / self.sample_rate
         prolong_duration = one_score_duration * 0.9
         wav = self.gen_timbre_wave(pitch, prolong_duration)
-        return regularize_wave(wav, one_score_sample_count)
+        with profile_phase(self.profiler, 'regularize'):
+            return regularize_wave(wav, one_score_sample_count)
 
     def gen_trill_wave(self, pitch, one_score_sample_count):
         trill_blank_duration = 0.01
@@ -304,9 +527,12 @@ class Guitar8bit(Rhythm8bit):
         wav1 = self.gen_timbre_wave(pitch, instrument_duration)
         trill_blank_sample_count = int(round(trill_blank_duration * self.sample_rate))
         wav2 = gen_zero_wave(trill_blank_sample_count)
-        wav_one_trill = np.concatenate([wav1, wav2])
-        trill_count = int(one_score_sample_count / len(wav_one_trill))
-        return np.tile(wav_one_trill, trill_count)
+        with profile_phase(self.profiler, 'concatenate') as phase:
+            wav_one_trill = np.concatenate([wav1, wav2])
+            trill_count = int(one_score_sample_count / len(wav_one_trill))
+            wav = np.tile(wav_one_trill, trill_count)
+            phase.record(wav)
+        return wav
 
     def gen_slide_wave(self, pitch, one_score_sample_count):
         one_score_duration = one_score_sample_count / self.sample_rate
@@ -316,7 +542,9 @@ class Guitar8bit(Rhythm8bit):
         wav1 = self.gen_prolong_wave(root_pitch, one_score_sample_count)
         wav2 = self.gen_prolong_wave(third_pitch, one_score_sample_count)
         wav3 = self.gen_prolong_wave(fifth_pitch, one_score_sample_count)
-        wav = wav1 + wav2 + wav3
+        with profile_phase(self.profiler, 'mix') as phase:
+            wav = wav1 + wav2 + wav3
+            phase.record(wav)
         return wav
 
     def gen_arpeggio_wave(self, root_pitch, third_pitch, fifth_pitch, one_score_sample_count):
@@ -329,7 +557,10 @@ class Guitar8bit(Rhythm8bit):
         wav_fifth = self.gen_timbre_wave(fifth_pitch, instrument_duration)
         wav_root_high = self.gen_timbre_wave(root_pitch_high, instrument_duration)
         wav_blank = gen_zero_wave(blank_sample_count)
-        return np.concatenate([wav_root, wav_blank, wav_third, wav_blank, wav_fifth, wav_blank, wav_root_high])
+        with profile_phase(self.profiler, 'concatenate') as phase:
+            wav = np.concatenate([wav_root, wav_blank, wav_third, wav_blank, wav_fifth, wav_blank, wav_root_high])
+            phase.record(wav)
+        return wav
 
     def gen_instrument_technique_wave(self, pitch, one_score_sample_count, technique):
         if technique not in self.performances.keys():
@@ -354,38 +585,98 @@ class Guitar8bit(Rhythm8bit):
             elif perform_type == 'arpeggio':
                 return self.gen_arpeggio_wave(root_pitch, third_pitch, fifth_pitch, one_score_sample_count)
 
+    def get_frequencies(self, pitches):
+        """
+        编译时用的频率，音名转为MIDI编号后查FREQUENCY_TABLE，与pitch_dict中的频率相同
+        """
+        return midis_to_frequencies(pitches_to_midi(pitches)).tolist()
+
+    def compile_timbre_events(self, pitch, one_score_sample_count):
+        sample_count = int(self.instrument_duration * self.sample_rate)
+        return [self.make_event(0, sample_count, self.get_frequencies([pitch])[0], '')]
+
+    def compile_technique_events(self, pitch, one_score_sample_count, technique):
+        """
+        与gen_instrument_technique_wave生成的波形一致
+        """
+        if technique not in self.performances.keys():
+            raise ValueError(f'Unknown technique: {technique}, should be one of {self.performances.keys()}')
+        one_score_duration = one_score_sample_count / self.sample_rate
+        prolong_sample_count = int(one_score_duration * 0.9 * self.sample_rate)
+        if '-' not in technique:
+            frequency = self.get_frequencies([pitch])[0]
+            if technique == 'pr':
+                return [self.make_event(0, prolong_sample_count, frequency, technique)]
+            elif technique == 'tr':
+                trill_sample_count = int(self.instrument_duration * 0.8 * self.sample_rate)
+                trill_period = trill_sample_count + int(round(0.01 * self.sample_rate))
+                trill_count = int(one_score_sample_count / trill_period)
+                return [self.make_event(0, trill_count * trill_period, frequency, technique,
+                                        gate_period=trill_period, gate_on=trill_sample_count)]
+            elif technique == 'sl':
+                return [self.make_event(0, int(one_score_duration * self.sample_rate), frequency, technique)]
+        else:
+            techniques = technique.split('-')
+            chord_type = techniques[0]
+            perform_type = techniques[1]
+            chord_pitches = self.melody.get_chord_pitches(pitch, chord_type)[:3]
+            if perform_type == 'chord':
+                # 三个音各占一个声部
+                return [self.make_event(0, prolong_sample_count, frequency, technique, voice=i)
+                        for i, frequency in enumerate(self.get_frequencies(chord_pitches))]
+            elif perform_type == 'arpeggio':
+                arpeggio_pitches = chord_pitches + [self.melody.cal_pitch(chord_pitches[0], '+semi12')]
+                arpeggio_sample_count = int(0.1 * self.sample_rate)
+                arpeggio_period = arpeggio_sample_count + int(round(0.01 * self.sample_rate))
+                return [self.make_event(i * arpeggio_period, arpeggio_sample_count, frequency, technique)
+                        for i, frequency in enumerate(self.get_frequencies(arpeggio_pitches))]
+
 
 # 贝司音色波形
 class Bass8bit(Guitar8bit):
-    def __init__(self, bpm, one_beat_note='quarter'):
-        super().__init__(bpm, one_beat_note)
+    __slots__ = ()
+
+    def __init__(self, bpm, one_beat_note='quarter', wave_cache=None, sample_rate=11025):
+        super().__init__(bpm, one_beat_note, wave_cache, sample_rate)
         self.amplitude = 32
+        self.wave_shape = 'triangle'
 
     def gen_timbre_wave(self, pitch, *args):
         frequency = self.pitch_dict[pitch]
-        duration = args[0]
+        duration = args[0] if len(args) > 0 else self.instrument_duration
         return gen_triangle_wave(frequency, self.amplitude, duration, self.sample_rate)
 
 
 # 架子鼓音色波形
 class Drum8bit(Rhythm8bit):
-    def __init__(self, bpm, one_beat_note='quarter'):
-        super().__init__(bpm, one_beat_note)
+    __slots__ = ()
+
+    def __init__(self, bpm, one_beat_note='quarter', wave_cache=None, sample_rate=11025):
+        super().__init__(bpm, one_beat_note, wave_cache, sample_rate)
         self.amplitude = 16
-        self.pitch_dict = {'K': 0.08,  # second of kick 底鼓
-                           'S': 0.05,  # second of snare 军鼓
-                           'H': 0.02,  # second of hi-hat 镲音
-                           'O': 0.0}
+        self.pitch_dict = DRUM_PITCH_DICT  # 每种鼓的发声时长（秒）
+        self.wave_shape = 'noise'
 
     def gen_timbre_wave(self, pitch, *args):
-        duration = self.pitch_dict[pitch]
-        return gen_noise_wave(self.amplitude, duration, self.sample_rate)
+        """
+        返回预先生成的只读鼓声波形，每次敲击完全相同
+        """
+        return get_drum_hit_waves(self.amplitude, self.sample_rate)[pitch]
 
     def gen_instrument_technique_wave(self, pitch: str, one_score_sample_count: int, technique: str):
         if technique not in self.performances.keys():
             raise ValueError(f'Unknown technique: {technique}, should be one of {self.performances.keys()}')
         return np.array([], dtype=np.uint8)
 
+    def compile_timbre_events(self, pitch, one_score_sample_count):
+        sample_count = int(self.pitch_dict[pitch] * self.sample_rate)
+        return [self.make_event(0, sample_count, 0.0, '')]
+
+    def compile_technique_events(self, pitch, one_score_sample_count, technique):
+        if technique not in self.performances.keys():
+            raise ValueError(f'Unknown technique: {technique}, should be one of {self.performances.keys()}')
+        return []
+
     def common_beat_score_list(self, beat_name):
         beat_names = ['4/4-money', '4/4-disco1', '4/4-disco2', '4/4-funk',
                       '3/4-ball',
@@ -419,7 +710,12 @@ class Drum8bit(Rhythm8bit):
 
 
 class Band8bit:
-    def __init__(self, bpm, instrument_dict, one_beat_note='quarter'):
+    __slots__ = ('bpm', 'one_beat_note', 'sample_rate', 'instrument_types', 'instrument_obj_dict',
+                 'instrument_wav_dict', 'instrument_track_dict', 'music_wav', 'wave_cache', 'profiler', 'segment_cache',
+                 'stem_cache', 'mix_bus', 'block_layout_dict', 'mix_mode')
+
+    def __init__(self, bpm, instrument_dict, one_beat_note='quarter', wave_cache=None, segment_cache=None,
+                 sample_rate=11025, stem_cache=None):
         """
         instrument_dict example:
         {
@@ -428,38 +724,146 @@ class Band8bit:
             'bass': 'bass',
             'drum': 'drum',
         }
+        wave_cache: WaveCache，所有乐器共享的音符缓存，gen_music、update_music等编译时缓存音符的事件模板，
+            iter_music_blocks等逐音符生成时缓存音符波形
+        segment_cache: WaveCache，update_music使用的整段乐谱波形缓存，None表示首次增量渲染时创建
+        sample_rate: 所有乐器共用的采样率（Hz），合成全程使用整数相位累加和uint8波形，
+            每个采样点的临时内存与采样率无关
+        stem_cache: StemCache，按get_stem_digest保存整条乐器音轨的磁盘缓存，多个进程共用，None表示不使用
         """
 
         self.bpm = bpm
         self.one_beat_note = one_beat_note
-        self.instrument_types = ['guitar', 'bass', 'drum']
+        # 校验采样率并转换为int，没有乐器时也写入正确的wav文件头
+        self.sample_rate = get_timing_table(bpm, one_beat_note, sample_rate).sample_rate
+        self.instrument_types = INSTRUMENT_TYPES
         self.instrument_obj_dict = {}
         self.instrument_wav_dict = {}
+        self.instrument_track_dict = {}
         self.music_wav = np.array([], dtype=np.uint8)
+        self.wave_cache = wave_cache
+        self.profiler = None
+        self.segment_cache = segment_cache
+        self.stem_cache = stem_cache
+        self.mix_bus = None  # 上次update_music的混音总线
+        self.block_layout_dict = {}  # 上次update_music各乐器的块布局
+        self.mix_mode = None
 
         for instrument_name, instrument_type in instrument_dict.items():
             if instrument_type == 'guitar':
-                self.instrument_obj_dict[instrument_name] = Guitar8bit(bpm, one_beat_note)
+                self.instrument_obj_dict[instrument_name] = Guitar8bit(bpm, one_beat_note, wave_cache, sample_rate)
             elif instrument_type == 'bass':
-                self.instrument_obj_dict[instrument_name] = Bass8bit(bpm, one_beat_note)
+                self.instrument_obj_dict[instrument_name] = Bass8bit(bpm, one_beat_note, wave_cache, sample_rate)
             elif instrument_type == 'drum':
-                self.instrument_obj_dict[instrument_name] = Drum8bit(bpm, one_beat_note)
+                self.instrument_obj_dict[instrument_name] = Drum8bit(bpm, one_beat_note, wave_cache, sample_rate)
             else:
                 raise ValueError(
                     f"Unknown instrument type: {instrument_type}, should be one of {self.instrument_types}")
+            self.instrument_obj_dict[instrument_name].instrument_name = instrument_name
 
-    def gen_one_instrument_wave(self, instrument, score_list_list):
+    def set_profiler(self, profiler):
+        """
+        profiler: RenderProfiler，乐队和所有乐器共用；None表示关闭统计
+        """
+        self.profiler = profiler
+        for instrument_obj in self.instrument_obj_dict.values():
+            instrument_obj.profiler = profiler
+
+    def compile_one_instrument(self, instrument, score_list_list):
+        """
+        返回 [(ScoreEvents, repeat_times),...]
+        """
+        if instrument not in self.instrument_obj_dict.keys():
+            raise ValueError(f"Unknown instrument: {instrument}, should be one of "
+                             f"{self.instrument_obj_dict.keys()}")
+        instrument_obj = self.instrument_obj_dict[instrument]
+        with profile_phase(self.profiler, 'compile', instrument):
+            return [(instrument_obj.compile_score(score_list), repeat_times)
+                    for score_list, repeat_times in score_list_list]
+
+    def gen_one_instrument_track(self, instrument, score_list_list):
+        """
+        生成分段音轨，相同的score_list只渲染一次，重复只记录次数
+        """
+        return self._gen_one_instrument_track(instrument, self.compile_one_instrument(instrument, score_list_list),
+                                              score_list_list)
+
+    def _gen_one_instrument_track(self, instrument, block_list, score_list_list):
+        builder = self._iter_instrument_track(instrument, block_list, score_list_list)
+        try:
+            _, score_events = next(builder)
+            while True:
+                wav = None
+                if score_events is not None:
+                    wav = self.instrument_obj_dict[instrument].render_score_events(score_events)
+                _, score_events = builder.send(wav)
+        except StopIteration as stop:
+            return stop.value
+
+    def _iter_instrument_track(self, instrument, block_list, score_list_list):
+        """
+        逐块生成分段音轨的生成器，gen_music和AsyncRenderer共用
+        每个块产出 (block_index, score_events)，score_events不为None时调用方合成后把波形send回来，
+        相同的score_list只合成一次；结束时音轨保存在instrument_track_dict中并作为返回值
+        """
+        track = Track()
+        block_wav_dict = {}
+        for i, ((score_events, repeat_times), (score_list, _)) in enumerate(zip(block_list, score_list_list)):
+            self.instrument_obj_dict[instrument].count_score_notes(score_list, repeat_times)
+            key = get_score_list_key(score_list)
+            wav = block_wav_dict.get(key)
+            rendered_wav = yield i, score_events if wav is None else None
+            if wav is None:
+                wav = block_wav_dict[key] = rendered_wav
+            track.append(wav, repeat_times)
+        self.instrument_track_dict[instrument] = track
+        return track
+
+    def get_stem_digest(self, instrument, score_list_list):
+        """
+        乐器类型、bpm、one_beat_note、采样率、RENDER_VERSION和所有块的哈希，与乐器在乐队中的名字无关，
+        不同乐队中相同的伴奏音轨键相同
+        """
         if instrument not in self.instrument_obj_dict.keys():
             raise ValueError(f"Unknown instrument: {instrument}, should be one of "
                              f"{self.instrument_obj_dict.keys()}")
-        wav = np.array([], dtype=np.uint8)
+        instrument_obj = self.instrument_obj_dict[instrument]
+        digest = hashlib.blake2b(digest_size=16)
         for score_list, repeat_times in score_list_list:
-            one_wav = self.instrument_obj_dict[instrument].gen_wave(score_list, repeat_times)
-            wav = np.concatenate([wav, one_wav])
+            digest.update(f"{instrument_obj.get_score_digest(score_list)}*{int(repeat_times)};".encode())
+        return digest.hexdigest()
+
+    def _get_cached_stem(self, instrument, score_list_list):
+        """
+        返回 (digest, Track)，stem_cache中没有时Track为None
+        """
+        digest = self.get_stem_digest(instrument, score_list_list)
+        wav = self.stem_cache.get(digest)
+        if wav is None:
+            return digest, None
+        for score_list, repeat_times in score_list_list:
+            self.instrument_obj_dict[instrument].count_score_notes(score_list, repeat_times)
+        track = Track()
+        track.append(wav)
+        self.instrument_track_dict[instrument] = track
+        return digest, track
+
+    def gen_one_instrument_wave(self, instrument, score_list_list):
+        """
+        设置了stem_cache时先查缓存，返回的可能是只读的np.memmap
+        """
+        if self.stem_cache is not None:
+            digest, track = self._get_cached_stem(instrument, score_list_list)
+            if track is not None:
+                wav = track.segments[0][1] if track.sample_count > 0 else np.zeros(0, dtype=np.uint8)
+            else:
+                wav = self.stem_cache.put(digest, self.gen_one_instrument_track(instrument, score_list_list).expand())
+        else:
+            wav = self.gen_one_instrument_track(instrument, score_list_list).expand()
         self.instrument_wav_dict[instrument] = wav
         return wav
 
-    def gen_music(self, score_dict):
+    def gen_music(self, score_dict, mix_mode='clip', workers=None):
         """
         score_dict example:
         {
@@ -469,37 +873,289 @@ class Band8bit:
             'drum': [(score_list, repeat_times),...],
         }
         score_list example:
-        [('C4', '1/4','pr'),...]
+        [('C4', '1/4','pr'),...]，或src.score_format.ScoreArray
+        mix_mode: 'clip' 削顶，'normalize' 按峰值整体缩放，见convert_to_uint8
+        workers: None表示在当前进程依次渲染；进程数或ProcessPoolExecutor表示多进程并行渲染，进程数相同时复用同一个进程池
+        各乐器的分段音轨保存在instrument_track_dict中，混音时才展开重复部分，
+        直接叠加到同一个宽整数混音总线上，不再保存到instrument_wav_dict
+        设置了stem_cache时，缓存中已有的乐器音轨不再编译和合成；多进程渲染时只读取缓存，不写入
         """
+        self._reset_update_state()
+        block_list_dict = {}
+        stem_track_dict = {}
+        stem_digest_dict = {}
         max_len = 0
         for instrument, score_list_list in score_dict.items():
-            self.gen_one_instrument_wave(instrument, score_list_list)
-            max_len = max(max_len, len(self.instrument_wav_dict[instrument]))
+            if self.stem_cache is not None:
+                stem_digest_dict[instrument], track = self._get_cached_stem(instrument, score_list_list)
+                if track is not None:
+                    stem_track_dict[instrument] = track
+                    max_len = max(max_len, track.sample_count)
+                    continue
+            block_list_dict[instrument] = self.compile_one_instrument(instrument, score_list_list)
+            max_len = max(max_len, get_blocks_sample_count(block_list_dict[instrument]))
         # sum all waves
-        music_wav = np.zeros(max_len, dtype=np.uint8)
-        for instrument, wav in self.instrument_wav_dict.items():
-            music_wav[:len(wav)] += wav
-        self.music_wav = music_wav
-        return music_wav
+        if workers is not None:
+            for instrument, block_list in block_list_dict.items():
+                for score_list, repeat_times in score_dict[instrument]:
+                    self.instrument_obj_dict[instrument].count_score_notes(score_list, repeat_times)
+            with profile_phase(self.profiler, 'synthesize') as phase:
+                music_wav = render_blocks_parallel(block_list_dict, max_len, workers, get_mix_dtype(len(score_dict)))
+                phase.record(music_wav)
+            with profile_phase(self.profiler, 'mix') as phase:
+                for track in stem_track_dict.values():
+                    track.add_to(music_wav)
+                self.music_wav = convert_to_uint8(music_wav, mix_mode)
+                phase.record(self.music_wav)
+            return self.music_wav
+        track_dict = {}
+        for instrument in score_dict.keys():
+            track = stem_track_dict.get(instrument)
+            if track is None:
+                track = self._gen_one_instrument_track(instrument, block_list_dict[instrument], score_dict[instrument])
+                if self.stem_cache is not None:
+                    self.stem_cache.put(stem_digest_dict[instrument], track.expand())
+            track_dict[instrument] = track
+        return self._mix_tracks(track_dict, mix_mode)
+
+    def _reset_update_state(self):
+        # 整体重新渲染后，update_music保存的状态失效
+        self.mix_bus = None
+        self.block_layout_dict = {}
+        self.mix_mode = None
+
+    def _mix_tracks(self, track_dict, mix_mode):
+        """
+        把各乐器的音轨混音为music_wav，gen_music和AsyncRenderer共用
+        """
+        self._reset_update_state()
+        mix_bus = MixBus(max([track.sample_count for track in track_dict.values()], default=0),
+                         get_mix_dtype(len(track_dict)))
+        for instrument, track in track_dict.items():
+            with profile_phase(self.profiler, 'mix', instrument):
+                mix_bus.add_track(track)
+        with profile_phase(self.profiler, 'mix') as phase:
+            self.music_wav = mix_bus.to_uint8(mix_mode)
+            phase.record(mix_bus.wav)
+            phase.record(self.music_wav)
+        return self.music_wav
+
+    def _gen_cached_track(self, instrument, score_list_list):
+        """
+        按内容哈希从segment_cache中取各块的波形，只编译和合成缓存中没有的块
+        返回 (Track, layout)，layout: [(digest, sample_count, repeat_times),...]
+        """
+        if instrument not in self.instrument_obj_dict.keys():
+            raise ValueError(f"Unknown instrument: {instrument}, should be one of "
+                             f"{self.instrument_obj_dict.keys()}")
+        instrument_obj = self.instrument_obj_dict[instrument]
+        track = Track()
+        layout = []
+        for score_list, repeat_times in score_list_list:
+            instrument_obj.count_score_notes(score_list, repeat_times)
+            digest = instrument_obj.get_score_digest(score_list)
+            wav = self.segment_cache.get(digest)
+            if wav is None:
+                with profile_phase(self.profiler, 'compile', instrument):
+                    score_events = instrument_obj.compile_score(score_list)
+                wav = instrument_obj.render_score_events(score_events)
+                wav = self.segment_cache.put(digest, wav)
+            track.append(wav, repeat_times)
+            layout.append((digest, len(wav), repeat_times))
+        return track, layout
+
+    def update_music(self, score_dict, mix_mode='clip'):
+        """
+        增量渲染，score_dict和mix_mode同gen_music，结果与gen_music一致
+        每个(score_list, repeat_times)块按乐器参数和乐谱内容哈希，波形保存在segment_cache中，
+        只合成缓存中没有的块，只对布局发生变化的采样区间重新混音，
+        修改一小节后的重新渲染耗时取决于改动的大小，与歌曲长度无关
+        'normalize'依赖整首歌的峰值，混音仍是增量的，但需要整体重新转换为uint8
+        每次返回新的数组，之前返回的结果不会被修改
+        """
+        if self.segment_cache is None:
+            self.segment_cache = WaveCache()
+        track_dict = {}
+        layout_dict = {}
+        for instrument, score_list_list in score_dict.items():
+            track_dict[instrument], layout_dict[instrument] = self._gen_cached_track(instrument, score_list_list)
+        sample_count = max([track.sample_count for track in track_dict.values()], default=0)
+
+        dirty_ranges = []
+        for instrument in set(layout_dict.keys()) | set(self.block_layout_dict.keys()):
+            dirty_range = get_dirty_range(self.block_layout_dict.get(instrument, []), layout_dict.get(instrument, []))
+            if dirty_range is not None:
+                dirty_ranges.append((dirty_range[0], min(dirty_range[1], sample_count)))
+        mix_dtype = get_mix_dtype(len(track_dict))
+        if self.mix_bus is None or self.mix_bus.wav.dtype != mix_dtype:
+            self.mix_bus = MixBus(sample_count, mix_dtype)
+            dirty_ranges = [(0, sample_count)]
+        elif self.mix_bus.sample_count != sample_count:
+            # 变长的部分一定包含在某个乐器的改动区间内
+            mix_bus = MixBus(sample_count, mix_dtype)
+            keep = min(sample_count, self.mix_bus.sample_count)
+            mix_bus.wav[:keep] = self.mix_bus.wav[:keep]
+            self.mix_bus = mix_bus
+        dirty_ranges = merge_ranges(dirty_ranges)
+
+        for start, end in dirty_ranges:
+            with profile_phase(self.profiler, 'mix') as phase:
+                bus_range = self.mix_bus.wav[start:end]
+                bus_range[:] = 0
+                for track in track_dict.values():
+                    track.add_range_to(bus_range, start)
+                phase.record(bus_range)
+
+        with profile_phase(self.profiler, 'mix') as phase:
+            if mix_mode == 'normalize' or mix_mode != self.mix_mode or len(self.music_wav) != sample_count:
+                self.music_wav = self.mix_bus.to_uint8(mix_mode)
+                phase.record(self.music_wav)
+            else:
+                # 之前返回的music_wav可能仍被调用方持有，复制后再改写，只多一次uint8数组的内存拷贝
+                self.music_wav = self.music_wav.copy()
+                for start, end in dirty_ranges:
+                    self.music_wav[start:end] = convert_to_uint8(self.mix_bus.wav[start:end], mix_mode)
+                    phase.record(self.music_wav[start:end])
+        self.mix_mode = mix_mode
+        self.instrument_track_dict.update(track_dict)
+        self.block_layout_dict = layout_dict
+        return self.music_wav
+
+    def build_onset_index(self, score_dict):
+        """
+        返回 {instrument: OnsetIndex}，可以在多次render_range之间复用
+        """
+        onset_index_dict = {}
+        for instrument, score_list_list in score_dict.items():
+            if instrument not in self.instrument_obj_dict.keys():
+                raise ValueError(f"Unknown instrument: {instrument}, should be one of "
+                                 f"{self.instrument_obj_dict.keys()}")
+            onset_index_dict[instrument] = self.instrument_obj_dict[instrument].build_onset_index(score_list_list)
+        return onset_index_dict
+
+    def render_range(self, score_dict, start, end, mix_mode='clip', onset_index_dict=None):
+        """
+        只渲染[start, end)区间的混音，用于预览、跳转播放和分段并行渲染
+        onset_index_dict: build_onset_index的返回值，None表示现场建立（耗时与音符数有关）
+        区间超出歌曲的部分被截掉；'clip'的结果与gen_music的对应区间一致，'normalize'按区间内的峰值缩放
+        """
+        if onset_index_dict is None:
+            onset_index_dict = self.build_onset_index(score_dict)
+        sample_count = max([len(onset_index) for onset_index in onset_index_dict.values()], default=0)
+        start = max(start, 0)
+        end = min(end, sample_count)
+        music_range = np.zeros(max(end - start, 0), dtype=np.int32)
+        for instrument, onset_index in onset_index_dict.items():
+            self.instrument_obj_dict[instrument].render_range(onset_index, start, end, music_range)
+        with profile_phase(self.profiler, 'mix') as phase:
+            music_range = convert_to_uint8(music_range, mix_mode)
+            phase.record(music_range)
+        return music_range
 
     def write_music(self, file_path):
+        with profile_phase(self.profiler, 'write') as phase:
+            write_wave_file(file_path, self.music_wav, self.sample_rate)
+            phase.record(self.music_wav)
+
+    def render_music_to_file(self, file_path, score_dict, mix_mode='clip', block_size=1 << 16):
+        """
+        预先分配wav文件，把混音结果按块直接写入映射到文件的np.memmap，
+        内存中只有各乐器不重复的块和一个block_size长的混音缓冲，不保存整首歌的音频
+        score_dict和mix_mode同gen_music，'normalize'需要先扫描一遍求峰值
+        返回写入的采样点数
+        """
+        track_dict = {instrument: self.gen_one_instrument_track(instrument, score_list_list)
+                      for instrument, score_list_list in score_dict.items()}
+        sample_count = max([track.sample_count for track in track_dict.values()], default=0)
+        music_block = np.zeros(min(block_size, sample_count), dtype=np.int32)
+
+        def mix_block(start):
+            block = music_block[:min(block_size, sample_count - start)]
+            block[:] = 0
+            for instrument, track in track_dict.items():
+                with profile_phase(self.profiler, 'mix', instrument):
+                    track.add_range_to(block, start)
+            return block
+
+        peak = 255
+        if mix_mode == 'normalize':
+            for start in range(0, sample_count, block_size):
+                peak = max(peak, int(mix_block(start).max()))
+        out = create_wave_memmap(file_path, sample_count, self.sample_rate)
+        for start in range(0, sample_count, block_size):
+            block = mix_block(start)
+            with profile_phase(self.profiler, 'write') as phase:
+                if peak > 255:
+                    block = block * 255 // peak
+                out[start:start + len(block)] = convert_to_uint8(block)
+                phase.record(block)
+        if isinstance(out, np.memmap):
+            out.flush()
+        del out
+        return sample_count
+
+    def iter_music_blocks(self, score_dict, block_size=4096):
+        """
+        流式生成混音，依次返回长度为block_size的uint8块，最后一块可能不足block_size
+        内存占用只与block_size有关，与歌曲长度无关
+        score_dict格式同gen_music
+        """
+        block_iter_dict = {}
+        for instrument, score_list_list in score_dict.items():
+            if instrument not in self.instrument_obj_dict.keys():
+                raise ValueError(f"Unknown instrument: {instrument}, should be one of "
+                                 f"{self.instrument_obj_dict.keys()}")
+            wav_iter = self.instrument_obj_dict[instrument].iter_score_waves(score_list_list)
+            block_iter_dict[instrument] = gen_wave_blocks(wav_iter, block_size)
+
+        while len(block_iter_dict) > 0:
+            music_block = np.zeros(block_size, dtype=np.int32)
+            block_len = 0
+            for instrument in list(block_iter_dict.keys()):
+                block = next(block_iter_dict[instrument], None)
+                if block is None:
+                    del block_iter_dict[instrument]
+                    continue
+                with profile_phase(self.profiler, 'mix', instrument):
+                    music_block[:len(block)] += block
+                block_len = max(block_len, len(block))
+            if block_len > 0:
+                with profile_phase(self.profiler, 'mix') as phase:
+                    music_block = convert_to_uint8(music_block[:block_len])
+                    phase.record(music_block)
+                yield music_block
+
+    def write_music_stream(self, file_path, score_dict, block_size=4096):
+        """
+        边生成边写入wav文件，不保留整首歌的音频
+        返回写入的采样点数
+        """
+        sample_count = 0
         with wave.open(file_path, 'wb') as f:
             f.setnchannels(1)
             f.setsampwidth(1)
-            f.setframerate(list(self.instrument_obj_dict.values())[0].sample_rate)
-            f.writeframes(self.music_wav.tobytes())
+            f.setframerate(self.sample_rate)
+            for music_block in self.iter_music_blocks(score_dict, block_size):
+                with profile_phase(self.profiler, 'write') as phase:
+                    f.writeframes(music_block.data)
+                    phase.record(music_block)
+                sample_count += len(music_block)
+        return sample_count
 
 
 class MelodyAssist8bit(Melody8bit):
+    __slots__ = ('chord_seq', 'tonic_chords', 'dominant_chords', 'subdominant_chords', 'chord_func_dict',
+                 'popular_chord_progression_types')
+
     def __init__(self):
         super().__init__()
-        self.chord_seq = {'I': 0, 'II': 1, 'III': 2, 'IV': 3, 'V': 4, 'VI': 5, 'VII': 6}
-        self.tonic_chords = ['I', 'VI']
-        self.dominant_chords = ['V', 'III', 'VII']
-        self.subdominant_chords = ['II', 'IV']
-        self.chord_func_dict = {'T': self.tonic_chords, 'D': self.dominant_chords, 'S': self.subdominant_chords}
+        self.chord_seq = CHORD_SEQ_DICT
+        self.tonic_chords = TONIC_CHORDS
+        self.dominant_chords = DOMINANT_CHORDS
+        self.subdominant_chords = SUBDOMINANT_CHORDS
+        self.chord_func_dict = CHORD_FUNC_DICT
 
-        self.popular_chord_progression_types = ['T-S-D-T', 'S-D-D-T-S-D-T-T', 'T-D-T-D-S-T-S-T']
+        self.popular_chord_progression_types = POPULAR_CHORD_PROGRESSION_TYPES
 
     # 根据给定调性生成自然音音名
     def get_natural_pitches(self, tonality):
@@ -509,29 +1165,7 @@ class MelodyAssist8bit(Melody8bit):
          'A-min': a minor a小调
          '#F-maj': #F major #F大调
         """
-        pitch_list = []
-
-        tonality = tonality.split('-')
-        if len(tonality) != 2:
-            raise ValueError("mode example: 'C-maj', 'A-min', '#F-maj'")
-        base_pitch = tonality[0]
-        mode = tonality[1]
-        if base_pitch not in self.pitch_scale.keys():
-            raise ValueError("mode example: 'C-maj', 'A-min', '#F-maj'")
-        if mode not in ['maj', 'min']:
-            raise ValueError("mode example: 'C-maj', 'A-min', '#F-maj'")
-        scales = []
-        if mode == 'maj':
-            # 大调 全全半全全全半
-            scales = [0, 2, 2, 1, 2, 2, 2]
-        elif mode == 'min':
-            # 小调 全半全全半全全
-            scales = [0, 2, 1, 2, 2, 1, 2]
-        pitch_scale = self.pitch_scale[base_pitch]
-        for scale in scales:
-            pitch_scale += scale
-            pitch_list.append(self.scale_pitch[pitch_scale % 12])
-        return pitch_list
+        return [self.scale_pitch[pitch_code] for pitch_code in get_scale_table(tonality).tolist()]
 
     # 根据给定调性和和弦类型生成和弦进行
     def gen_random_chord_progression(self, tonality, chord_progression_type):
@@ -565,3 +1199,52 @@ class MelodyAssist8bit(Melody8bit):
         ret_dict['chord_progressions'] = chord_progressions
         ret_dict['chord_progression_pitches'] = chord_progression_pitches
         return ret_dict
+
+    # 批量生成和弦进行
+    def gen_random_chord_progressions(self, rng, count, tonalities, chord_progression_types):
+        """
+        rng: numpy.random.Generator，相同种子生成相同的结果
+        count: 生成的和弦进行数
+        tonalities: 调性或调性列表，每个和弦进行从中随机选一个，格式同gen_random_chord_progression
+        chord_progression_types: 和弦进行类型或类型列表，每个和弦进行从中随机选一个
+        返回的数组中音名用PITCH_CLASS_NAMES的序号表示，级数用CHORD_DEGREE_NAMES的序号表示（'I'为0），
+        和弦数不足最长类型的部分填-1:
+        {
+            'tonality_ids': (count,) tonalities中的序号,
+            'chord_progression_type_ids': (count,) chord_progression_types中的序号,
+            'lengths': (count,) 和弦数,
+            'natural_pitches': (count, 7) 自然音,
+            'chord_progressions': (count, max_len) 级数,
+            'chord_progression_pitches': (count, max_len, 3) 根音、三音、五音,
+        }
+        """
+        if isinstance(tonalities, str):
+            tonalities = [tonalities]
+        if isinstance(chord_progression_types, str):
+            chord_progression_types = [chord_progression_types]
+        if len(tonalities) == 0 or len(chord_progression_types) == 0:
+            raise ValueError("tonalities and chord_progression_types should not be empty")
+        scale_tables = np.stack([get_scale_table(tonality) for tonality in tonalities])
+        progression_tables = [get_chord_progression_table(t) for t in chord_progression_types]
+        max_len = max(len(progression_table) for progression_table in progression_tables)
+        # (类型数, max_len, 3)，超出类型长度的位置没有可选的级数
+        choice_tables = np.full((len(progression_tables), max_len, 3), -1, dtype=np.int8)
+        for i, progression_table in enumerate(progression_tables):
+            choice_tables[i, :len(progression_table)] = progression_table
+        choice_counts = (choice_tables >= 0).sum(axis=2)
+
+        tonality_ids = rng.integers(0, len(tonalities), count)
+        type_ids = rng.integers(0, len(progression_tables), count)
+        choice_ids = (rng.random((count, max_len)) * np.maximum(choice_counts[type_ids], 1)).astype(np.intp)
+        degrees = np.take_along_axis(choice_tables[type_ids], choice_ids[:, :, None], axis=2)[:, :, 0]
+
+        natural_pitches = scale_tables[tonality_ids]
+        chord_degrees = (np.maximum(degrees, 0)[:, :, None] + np.array([0, 2, 4])) % 7
+        chord_pitches = np.take_along_axis(natural_pitches[:, None, :], chord_degrees, axis=2)
+        chord_pitches[degrees < 0] = -1
+        return {'tonality_ids': tonality_ids,
+                'chord_progression_type_ids': type_ids,
+                'lengths': np.array([len(progression_table) for progression_table in progression_tables])[type_ids],
+                'natural_pitches': natural_pitches,
+                'chord_progressions': degrees,
+                'chord_progression_pitches': chord_pitches}
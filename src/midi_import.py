@@ -0,0 +1,355 @@
+import heapq
+import os
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+import numpy as np
+from src.pitch import MIDI_PITCH_NAMES
+from src.score_format import ScoreArray, save_song, get_output_paths
+
+# 以三十二分音符为单位的时值，从长到短，拆分时值时贪心选取
+NOTE_UNITS = (('1', 32), ('1/2.', 24), ('1/2', 16), ('1/4.', 12), ('1/4', 8), ('1/8.', 6), ('1/8', 4),
+              ('1/16.', 3), ('1/16', 2))
+NOTE_UNIT_DICT = dict(NOTE_UNITS)
+QUANTIZE_NOTES = ('1/16', '1/8', '1/4')
+MIDI_FILE_EXTENSIONS = ('.mid', '.midi')
+# General MIDI：第10通道是鼓，32-39号音色是贝司
+MIDI_DRUM_CHANNEL = 9
+MIDI_BASS_PROGRAMS = range(32, 40)
+# General MIDI鼓组音符到Drum8bit音高，低音鼓、低音桶鼓当作底鼓，军鼓、高音桶鼓当作军鼓，其余当作镲
+MIDI_DRUM_PITCH_DICT = {35: 'K', 36: 'K', 41: 'K', 43: 'K', 45: 'K',
+                        37: 'S', 38: 'S', 39: 'S', 40: 'S', 47: 'S', 48: 'S', 50: 'S'}
+# 同一时刻只保留一个鼓，底鼓 > 军鼓 > 镲
+DRUM_PITCHES = ('K', 'S', 'H')
+# Melody8bit音高表的范围 C1-B7，超出的音按八度移入范围
+MIN_MIDI_PITCH = 24
+MAX_MIDI_PITCH = 107
+DEFAULT_TEMPO = 500000  # 微秒每四分音符，即120bpm
+
+_NOTE_OFF, _NOTE_ON, _PROGRAM, _TEMPO, _TIME_SIGNATURE = range(5)
+
+
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def _iter_track_events(data, pos, end):
+    """
+    逐个解析一个MTrk块，返回 (tick, kind, channel, a, b)，只返回导入需要的事件
+    """
+    tick = 0
+    status = 0
+    while pos < end:
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+        if data[pos] >= 0x80:
+            status = data[pos]
+            pos += 1
+        elif status == 0:
+            raise ValueError("Running status without a previous channel message")
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = _read_varlen(data, pos + 1)
+            if meta_type == 0x51 and length == 3:
+                yield tick, _TEMPO, 0, int.from_bytes(data[pos:pos + 3], 'big'), 0
+            elif meta_type == 0x58 and length >= 2:
+                yield tick, _TIME_SIGNATURE, 0, data[pos], 1 << data[pos + 1]
+            elif meta_type == 0x2F:
+                return
+            pos += length
+            # meta和sysex事件取消running status
+            status = 0
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = _read_varlen(data, pos)
+            pos += length
+            status = 0
+        elif status >= 0xF0:
+            raise ValueError(f"Unexpected status byte in track: {status:#x}")
+        else:
+            kind = status & 0xF0
+            channel = status & 0x0F
+            if kind == 0xC0 or kind == 0xD0:
+                if kind == 0xC0:
+                    yield tick, _PROGRAM, channel, data[pos], 0
+                pos += 1
+            else:
+                key = data[pos]
+                velocity = data[pos + 1]
+                pos += 2
+                if kind == 0x90 and velocity > 0:
+                    yield tick, _NOTE_ON, channel, key, velocity
+                elif kind == 0x80 or kind == 0x90:
+                    yield tick, _NOTE_OFF, channel, key, 0
+
+
+def read_midi_events(file_path):
+    """
+    读取Standard MIDI File，返回 (division, events)
+    division: 每个四分音符的tick数
+    events: 所有音轨按tick归并的迭代器，依次返回 (tick, kind, channel, a, b)，边解析边返回，不建立事件列表
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if len(data) < 14 or data[:4] != b'MThd':
+        raise ValueError(f"Not a MIDI file: {file_path}")
+    header_length = int.from_bytes(data[4:8], 'big')
+    _, _, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        raise ValueError(f"SMPTE time division is not supported: {file_path}")
+    if division == 0:
+        raise ValueError(f"Invalid time division: {file_path}")
+    track_list = []
+    pos = 8 + header_length
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        length = int.from_bytes(data[pos + 4:pos + 8], 'big')
+        pos += 8
+        # 跳过未知的块
+        if chunk_id == b'MTrk':
+            track_list.append(_iter_track_events(data, pos, min(pos + length, len(data))))
+        pos += length
+    # heapq.merge对相同的tick保持音轨顺序
+    return division, heapq.merge(*track_list, key=itemgetter(0))
+
+
+def _to_pitch_name(key):
+    while key < MIN_MIDI_PITCH:
+        key += 12
+    while key > MAX_MIDI_PITCH:
+        key -= 12
+    return MIDI_PITCH_NAMES[key]
+
+
+def _split_units(units):
+    """
+    把units个三十二分音符拆成若干个支持的时值
+    """
+    notes = []
+    for note, note_units in NOTE_UNITS:
+        while units >= note_units:
+            notes.append(note)
+            units -= note_units
+    if units != 0:
+        raise ValueError("Duration is not a multiple of the quantize grid")
+    return notes
+
+
+def _get_channel_pieces(starts, ends, keys, instrument_type, division, grid):
+    """
+    量化并把一个通道的音符变成单音的 [(start, length, pitch),...]，单位是三十二分音符，空隙用休止符'O'补齐
+    同一时刻有多个音时，guitar取最高音，bass取最低音，drum按DRUM_PITCHES的优先级取
+    """
+    onsets = np.rint(starts * (8 / division / grid)).astype(np.int64) * grid
+    offsets = np.maximum(np.rint(ends * (8 / division / grid)).astype(np.int64) * grid, onsets + grid)
+    if instrument_type == 'drum':
+        priority_table = np.full(128, DRUM_PITCHES.index('H'), dtype=np.int64)
+        for key, pitch in MIDI_DRUM_PITCH_DICT.items():
+            priority_table[key] = DRUM_PITCHES.index(pitch)
+        priorities = priority_table[keys]
+    elif instrument_type == 'bass':
+        priorities = keys
+    else:
+        priorities = -keys
+    order = np.lexsort((priorities, onsets))
+    onsets = onsets[order]
+    first = np.ones(len(onsets), dtype=bool)
+    first[1:] = onsets[1:] != onsets[:-1]
+    onsets = onsets[first]
+    offsets = offsets[order][first]
+    keys = keys[order][first]
+    # 每个音持续到下一个音开始为止
+    offsets[:-1] = np.minimum(offsets[:-1], onsets[1:])
+
+    pieces = []
+    position = 0
+    for onset, offset, key in zip(onsets.tolist(), offsets.tolist(), keys.tolist()):
+        if onset > position:
+            pieces.append((position, onset - position, 'O'))
+        if instrument_type == 'drum':
+            pitch = DRUM_PITCHES[int(priority_table[key])]
+        else:
+            pitch = _to_pitch_name(key)
+        pieces.append((onset, offset - onset, pitch))
+        position = offset
+    return pieces, position
+
+
+def _split_bars(pieces, track_units, bar_units, technique):
+    """
+    按小节拆分，跨小节和超过全音符的音拆成多个音符，连续相同的小节合并为重复
+    返回 [(score_list, repeat_times),...]
+    """
+    song_units = -(-track_units // bar_units) * bar_units
+    if song_units > track_units:
+        pieces = pieces + [(track_units, song_units - track_units, 'O')]
+    block_list = []
+    bar = []
+    bar_end = bar_units
+    for start, length, pitch in pieces:
+        end = start + length
+        score_technique = technique if pitch != 'O' else ''
+        while start < end:
+            piece_end = min(end, bar_end)
+            bar += [(pitch, note, score_technique) for note in _split_units(piece_end - start)]
+            start = piece_end
+            if start == bar_end:
+                if len(block_list) > 0 and block_list[-1][0] == bar:
+                    block_list[-1][1] += 1
+                else:
+                    block_list.append([bar, 1])
+                bar = []
+                bar_end += bar_units
+    return [(score_list, repeat_times) for score_list, repeat_times in block_list]
+
+
+def import_midi(file_path, quantize='1/16', technique='pr', channel_instrument_dict=None, compact=True):
+    """
+    把Standard MIDI File转换为乐谱，返回 (metadata, score_dict)，与main.load_score_file相同
+    quantize: 量化的最小时值，'1/16'、'1/8'或'1/4'
+    technique: guitar、bass音符的技法，鼓和休止符没有技法
+    channel_instrument_dict: {channel: 'guitar'|'bass'|'drum'|None}，通道从0开始，None表示忽略该通道；
+        没有指定的通道按General MIDI：第10通道是drum，贝司音色是bass，其余是guitar
+    compact: True时每个块是共用字符串表的ScoreArray，False时是[(pitch, note, technique),...]
+    每个通道是一个乐器，名字是'类型_通道'，例如'guitar_0'；每个小节是一个块，连续相同的小节合并为重复
+    只使用第一个速度和拍号，bpm低于60时改为以八分音符为一拍
+    """
+    if quantize not in QUANTIZE_NOTES:
+        raise ValueError(f"Unknown quantize note: {quantize}, should be one of {QUANTIZE_NOTES}")
+    grid = NOTE_UNIT_DICT[quantize]
+    channel_instrument_dict = channel_instrument_dict or {}
+    division, events = read_midi_events(file_path)
+
+    tempo = None
+    time_signature = None
+    program_dict = {}
+    active_dict = {}  # {channel: {key: start_tick}}
+    note_array_dict = {}  # {channel: (starts, ends, keys)}
+    last_tick = 0
+
+    def close_note(channel, key, start, end):
+        note_arrays = note_array_dict.get(channel)
+        if note_arrays is None:
+            note_arrays = note_array_dict[channel] = (array('q'), array('q'), array('q'))
+        note_arrays[0].append(start)
+        note_arrays[1].append(end)
+        note_arrays[2].append(key)
+
+    try:
+        for tick, kind, channel, a, b in events:
+            last_tick = tick
+            if kind == _NOTE_ON:
+                active = active_dict.setdefault(channel, {})
+                if a in active:
+                    close_note(channel, a, active[a], tick)
+                active[a] = tick
+            elif kind == _NOTE_OFF:
+                active = active_dict.get(channel)
+                # 与note on同一tick的note off属于上一个音
+                if active is not None and a in active and active[a] < tick:
+                    close_note(channel, a, active.pop(a), tick)
+            elif kind == _PROGRAM:
+                program_dict.setdefault(channel, a)
+            elif kind == _TEMPO and tempo is None:
+                tempo = a
+            elif kind == _TIME_SIGNATURE and time_signature is None:
+                time_signature = (a, b)
+    except IndexError:
+        raise ValueError(f"Truncated MIDI file: {file_path}") from None
+    for channel, active in active_dict.items():
+        for key, start in active.items():
+            close_note(channel, key, start, max(last_tick, start + 1))
+
+    bpm = int(round(60000000 / (tempo or DEFAULT_TEMPO)))
+    one_beat_note = 'quarter'
+    if bpm < 60:
+        bpm *= 2
+        one_beat_note = 'eighth'
+    bpm = min(max(bpm, 60), 240)
+    numerator, denominator = time_signature or (4, 4)
+    bar_units = numerator * 32 // denominator
+    if bar_units <= 0 or bar_units % grid != 0:
+        bar_units = 32
+
+    instrument_dict = {}
+    channel_pieces_dict = {}
+    for channel in sorted(note_array_dict.keys()):
+        if channel in channel_instrument_dict:
+            instrument_type = channel_instrument_dict[channel]
+        elif channel == MIDI_DRUM_CHANNEL:
+            instrument_type = 'drum'
+        elif program_dict.get(channel) in MIDI_BASS_PROGRAMS:
+            instrument_type = 'bass'
+        else:
+            instrument_type = 'guitar'
+        if instrument_type is None:
+            continue
+        if instrument_type not in ('guitar', 'bass', 'drum'):
+            raise ValueError(f"Unknown instrument type: {instrument_type}, should be 'guitar', 'bass' or 'drum'")
+        starts, ends, keys = (np.frombuffer(note_array, dtype=np.int64) for note_array in note_array_dict[channel])
+        instrument = f'{instrument_type}_{channel}'
+        instrument_dict[instrument] = instrument_type
+        channel_pieces_dict[instrument] = _get_channel_pieces(starts, ends, keys, instrument_type, division, grid)
+
+    score_dict = {}
+    tables = ((), (), ())
+    for instrument, (pieces, track_units) in channel_pieces_dict.items():
+        block_list = _split_bars(pieces, track_units, bar_units,
+                                 technique if instrument_dict[instrument] != 'drum' else '')
+        if compact:
+            compact_block_list = []
+            for score_list, repeat_times in block_list:
+                score_array = ScoreArray.from_score_list(score_list, *tables)
+                tables = (score_array.pitch_names, score_array.note_names, score_array.technique_names)
+                compact_block_list.append((score_array, repeat_times))
+            block_list = compact_block_list
+        score_dict[instrument] = block_list
+
+    metadata = {'bpm': bpm, 'one_beat_note': one_beat_note, 'instruments': instrument_dict,
+                'source': os.path.basename(file_path)}
+    return metadata, score_dict
+
+
+def _convert_midi_file(file_path, out_path, options):
+    try:
+        metadata, score_dict = import_midi(file_path, **options)
+        save_song(out_path, score_dict, metadata)
+    except Exception as e:
+        return {'input': file_path, 'output': out_path, 'error': f'{type(e).__name__}: {e}'}
+    return {'input': file_path, 'output': out_path,
+            'notes': sum(len(score_list) * repeat_times
+                         for block_list in score_dict.values() for score_list, repeat_times in block_list)}
+
+
+def convert_midi_files(file_paths, out_dir, workers=None, report=None, chunksize=16, **options):
+    """
+    在进程池中把MIDI文件批量转换为.8bsc乐谱文件，可以直接交给main.render_batch渲染
+    workers: 进程数，None表示CPU核数，0表示在当前进程中转换
+    report: 每个文件完成时调用report(result)，失败时result中有'error'
+    chunksize: 每次交给一个进程的文件数，文件小而多时减少进程间通信
+    options: 传给import_midi的参数
+    输出文件名见src.score_format.get_output_paths，文件名相同的输入不会互相覆盖
+    返回结果列表，顺序与file_paths一致
+    """
+    out_paths = get_output_paths(file_paths, out_dir, '.8bsc')
+    for out_dir_path in {os.path.dirname(out_path) for out_path in out_paths} | {out_dir}:
+        os.makedirs(out_dir_path, exist_ok=True)
+    args = (_convert_midi_file, file_paths, out_paths, [options] * len(file_paths))
+    executor = ProcessPoolExecutor(workers) if workers != 0 else None
+    results = []
+    try:
+        result_iter = map(*args) if executor is None else executor.map(*args, chunksize=chunksize)
+        for result in result_iter:
+            results.append(result)
+            if report is not None:
+                report(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
@@ -0,0 +1,230 @@
+import numpy as np
+from src.compiler import render_events, render_events_range
+
+MIX_MODES = ['clip', 'normalize']
+# 单个乐器音轨的最大值，三和弦三个声部叠加
+MAX_TRACK_VALUE = 3 * 255
+
+
+def get_mix_dtype(track_count):
+    """
+    能容纳track_count条音轨相加的最窄整数类型，int16足够时比int32少一半内存和带宽
+    """
+    if track_count * MAX_TRACK_VALUE <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def get_blocks_sample_count(block_list):
+    """
+    block_list: [(ScoreEvents, repeat_times),...]
+    返回整条音轨的采样点数
+    """
+    return sum(score_events.sample_count * repeat_times for score_events, repeat_times in block_list)
+
+
+def add_blocks(out, block_list, offset=0):
+    """
+    把[(ScoreEvents, repeat_times),...]依次渲染并叠加到out[offset:]上
+    返回音轨结束位置
+    """
+    for score_events, repeat_times in block_list:
+        sample_count = score_events.sample_count
+        if repeat_times == 1:
+            render_events(score_events, out[offset:offset + sample_count])
+        elif repeat_times > 1:
+            block = render_events(score_events, np.zeros(sample_count, dtype=out.dtype))
+            add_repeated_wave(out, block, repeat_times, offset)
+        offset += sample_count * repeat_times
+    return offset
+
+
+def add_blocks_range(out, block_list, start, end):
+    """
+    只把[(ScoreEvents, repeat_times),...]中与[start, end)重叠的部分叠加到out上，out[0]对应start
+    区间内有完整的重复时整块合成一次，完整的重复一次广播相加，两端只加重叠部分；
+    没有完整的重复时只合成与区间重叠的事件，只有一次重复的长块也只合成区间内的部分
+    结果与add_blocks后取[start, end)相同
+    """
+    offset = 0
+    for score_events, repeat_times in block_list:
+        if offset >= end:
+            break
+        sample_count = score_events.sample_count
+        block_end = offset + sample_count * repeat_times
+        if sample_count > 0 and block_end > start:
+            full_first = max(0, -(-(start - offset) // sample_count))
+            full_last = max(full_first, min(repeat_times, (end - offset) // sample_count))
+            block = None
+            if full_last > full_first:
+                block = render_events(score_events, np.zeros(sample_count, dtype=out.dtype))
+                add_repeated_wave(out, block, full_last - full_first, offset + full_first * sample_count - start)
+            for repeat in (full_first - 1, full_last):
+                if 0 <= repeat < repeat_times:
+                    block_start = offset + repeat * sample_count
+                    range_start = max(start, block_start)
+                    range_end = min(end, block_start + sample_count)
+                    if range_end <= range_start:
+                        continue
+                    range_out = out[range_start - start:range_end - start]
+                    if block is None:
+                        render_events_range(score_events, range_out, range_start - block_start,
+                                            range_end - block_start)
+                    else:
+                        range_out += block[range_start - block_start:range_end - block_start]
+        offset = block_end
+
+
+def add_repeated_wave(out, wav, repeat_times, offset=0):
+    """
+    把wav重复repeat_times次叠加到out[offset:]上
+    out的对应区间被看作(repeat_times, len(wav))的二维视图，一次广播相加，不展开np.tile
+    """
+    sample_count = len(wav)
+    out[offset:offset + sample_count * repeat_times].reshape(repeat_times, sample_count)[:] += wav
+
+
+def convert_to_uint8(wav, mode='clip'):
+    """
+    把宽整数的混音结果转换为uint8
+    mode: 'clip' 超过255的部分削顶，'normalize' 整体按最大值缩放到0-255
+    """
+    if mode not in MIX_MODES:
+        raise ValueError(f"Unknown mix mode: {mode}, should be one of {MIX_MODES}")
+    if mode == 'normalize':
+        peak = int(wav.max()) if len(wav) > 0 else 0
+        if peak > 255:
+            wav = np.multiply(wav, 255, dtype=np.int32) // peak
+    return np.clip(wav, 0, 255).astype(np.uint8)
+
+
+def get_dirty_range(old_layout, new_layout):
+    """
+    比较同一乐器前后两次的块布局，返回需要重新混音的采样区间 (start, end)，布局相同时返回None
+    layout: [(digest, sample_count, repeat_times),...]
+    开头和结尾相同的块不算改动；总长度变化时改动点之后的部分都需要重新混音
+    """
+    prefix = 0
+    while prefix < min(len(old_layout), len(new_layout)) and old_layout[prefix] == new_layout[prefix]:
+        prefix += 1
+    if prefix == len(old_layout) == len(new_layout):
+        return None
+    old_total = sum(sample_count * repeat_times for _, sample_count, repeat_times in old_layout)
+    new_total = sum(sample_count * repeat_times for _, sample_count, repeat_times in new_layout)
+    start = sum(sample_count * repeat_times for _, sample_count, repeat_times in new_layout[:prefix])
+    if old_total != new_total:
+        return start, max(old_total, new_total)
+    suffix = 0
+    max_suffix = min(len(old_layout), len(new_layout)) - prefix
+    while suffix < max_suffix and old_layout[-1 - suffix] == new_layout[-1 - suffix]:
+        suffix += 1
+    end = new_total - sum(sample_count * repeat_times
+                          for _, sample_count, repeat_times in new_layout[len(new_layout) - suffix:])
+    return start, end
+
+
+def merge_ranges(ranges):
+    """
+    合并重叠或相邻的区间，返回按起点排序的 [(start, end),...]
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if start >= end:
+            continue
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# 分段音轨
+class Track:
+    def __init__(self):
+        """
+        每个不同的块只保存一份波形，重复只记录次数，内存只与不重复的素材量有关
+        segments: [(offset, wav, repeat_times),...]
+        """
+        self.segments = []
+        self.sample_count = 0
+
+    def __len__(self):
+        return self.sample_count
+
+    @property
+    def nbytes(self):
+        return sum(wav.nbytes for wav in {id(wav): wav for _, wav, _ in self.segments}.values())
+
+    def append(self, wav, repeat_times=1):
+        if repeat_times > 0 and len(wav) > 0:
+            self.segments.append((self.sample_count, wav, repeat_times))
+            self.sample_count += len(wav) * repeat_times
+
+    def add_to(self, out, offset=0):
+        """
+        把整条音轨叠加到out[offset:]上
+        """
+        for segment_offset, wav, repeat_times in self.segments:
+            add_repeated_wave(out, wav, repeat_times, offset + segment_offset)
+        return out
+
+    def add_range_to(self, out, start):
+        """
+        把音轨的[start, start + len(out))区间叠加到out上，超出音轨的部分不变
+        """
+        end = start + len(out)
+        for segment_offset, wav, repeat_times in self.segments:
+            segment_end = segment_offset + len(wav) * repeat_times
+            range_start = max(start, segment_offset)
+            range_end = min(end, segment_end)
+            if range_start >= range_end:
+                continue
+            # 开头和结尾不完整的重复用切片叠加，中间完整的重复用广播叠加，不生成逐采样点的下标数组
+            sample_count = len(wav)
+            head = (range_start - segment_offset) % sample_count
+            position = range_start
+            if head > 0:
+                n = min(sample_count - head, range_end - position)
+                out[position - start:position - start + n] += wav[head:head + n]
+                position += n
+            full_repeat_times = (range_end - position) // sample_count
+            if full_repeat_times > 0:
+                add_repeated_wave(out, wav, full_repeat_times, position - start)
+                position += full_repeat_times * sample_count
+            if position < range_end:
+                out[position - start:range_end - start] += wav[:range_end - position]
+        return out
+
+    def expand(self, dtype=np.uint8):
+        return self.add_to(np.zeros(self.sample_count, dtype=dtype))
+
+    def iter_blocks(self, block_size=4096):
+        """
+        按块展开音轨，最后一块可能不足block_size
+        """
+        for start in range(0, self.sample_count, block_size):
+            block = np.zeros(min(block_size, self.sample_count - start), dtype=np.uint8)
+            yield self.add_range_to(block, start)
+
+
+# 混音总线
+class MixBus:
+    def __init__(self, sample_count, dtype=np.int32):
+        """
+        预先分配整首歌长度的宽整数累加器，各音轨直接渲染到对应区间，避免uint8相加溢出回绕
+        """
+        self.sample_count = sample_count
+        self.wav = np.zeros(sample_count, dtype=dtype)
+
+    def add_blocks(self, block_list, offset=0):
+        if offset + get_blocks_sample_count(block_list) > self.sample_count:
+            raise ValueError("blocks exceed the length of the mix bus")
+        return add_blocks(self.wav, block_list, offset)
+
+    def add_track(self, track, offset=0):
+        if offset + track.sample_count > self.sample_count:
+            raise ValueError("track exceeds the length of the mix bus")
+        track.add_to(self.wav, offset)
+
+    def to_uint8(self, mode='clip'):
+        return convert_to_uint8(self.wav, mode)
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# 音轨的起点索引
+class OnsetIndex:
+    def __init__(self, block_list):
+        """
+        按采样点位置查找音符，查找耗时与音轨长度无关
+        block_list: [(score_list, note_sample_counts, repeat_times),...]，同一个乐器的各个块
+        note_onsets[i]: 第i个块中每个音符相对块起点的位置，是note_sample_count的前缀和，末尾是块的长度
+        block_offsets: 每个块（包含重复）在音轨中的起点，末尾是音轨的长度
+        """
+        self.score_lists = []
+        self.note_onsets = []
+        repeat_times_list = []
+        for score_list, note_sample_counts, repeat_times in block_list:
+            note_onsets = np.zeros(len(note_sample_counts) + 1, dtype=np.int64)
+            np.cumsum(note_sample_counts, out=note_onsets[1:])
+            self.score_lists.append(score_list)
+            self.note_onsets.append(note_onsets)
+            repeat_times_list.append(max(int(repeat_times), 0))
+        self.repeat_times = np.array(repeat_times_list, dtype=np.int64)
+        self.block_sample_counts = np.array([note_onsets[-1] for note_onsets in self.note_onsets], dtype=np.int64)
+        self.block_offsets = np.zeros(len(self.note_onsets) + 1, dtype=np.int64)
+        np.cumsum(self.block_sample_counts * self.repeat_times, out=self.block_offsets[1:])
+        self.sample_count = int(self.block_offsets[-1])
+
+    def __len__(self):
+        return self.sample_count
+
+    def find(self, start, end):
+        """
+        二分查找与[start, end)重叠的音符
+        依次返回 (block_index, repeat_start, first_note, last_note)，
+        表示第block_index个块从repeat_start开始的那次重复中[first_note, last_note)的音符
+        """
+        start = max(int(start), 0)
+        end = min(int(end), self.sample_count)
+        if start >= end:
+            return
+        block_index = int(np.searchsorted(self.block_offsets, start, side='right')) - 1
+        while block_index < len(self.note_onsets) and self.block_offsets[block_index] < end:
+            block_sample_count = int(self.block_sample_counts[block_index])
+            block_start = int(self.block_offsets[block_index])
+            block_end = int(self.block_offsets[block_index + 1])
+            if block_sample_count > 0 and block_end > start:
+                note_onsets = self.note_onsets[block_index]
+                first_repeat = (max(start, block_start) - block_start) // block_sample_count
+                last_repeat = (min(end, block_end) - block_start - 1) // block_sample_count
+                for repeat_index in range(first_repeat, last_repeat + 1):
+                    repeat_start = block_start + repeat_index * block_sample_count
+                    first_note = int(np.searchsorted(note_onsets, max(start - repeat_start, 0), side='right')) - 1
+                    last_note = int(np.searchsorted(note_onsets, min(end - repeat_start, block_sample_count),
+                                                    side='left'))
+                    yield block_index, repeat_start, first_note, last_note
+            block_index += 1
@@ -0,0 +1,88 @@
+import os
+import threading
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from src.mixer import add_blocks_range
+
+# 每个区间的最少采样点数，太短的区间里跨边界的块重复合成的比例太高
+MIN_RANGE_SAMPLES = 1 << 16
+
+_process_pool_dict = {}
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    """
+    按进程数复用的ProcessPoolExecutor，多次gen_music不再反复创建和关闭进程
+    进程池在解释器退出时关闭
+    """
+    with _process_pool_lock:
+        executor = _process_pool_dict.get(workers)
+        if executor is None:
+            executor = _process_pool_dict[workers] = ProcessPoolExecutor(workers)
+        return executor
+
+
+def _discard_process_pool(executor):
+    with _process_pool_lock:
+        for workers, cached_executor in list(_process_pool_dict.items()):
+            if cached_executor is executor:
+                del _process_pool_dict[workers]
+    executor.shutdown(wait=False)
+
+
+def _render_range_task(shm_name, sample_count, dtype, start, end, block_list_dict):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        music_wav = np.ndarray(sample_count, dtype=dtype, buffer=shm.buf)
+        for block_list in block_list_dict.values():
+            add_blocks_range(music_wav[start:end], block_list, start, end)
+        del music_wav
+    finally:
+        shm.close()
+
+
+def render_blocks_parallel(block_list_dict, sample_count, workers=None, dtype=np.int32):
+    """
+    在多个进程中并行渲染并混音各乐器的(score_list, repeat_times)块
+    block_list_dict: {instrument: [(ScoreEvents, repeat_times),...]}
+    workers: 进程数，或一个ProcessPoolExecutor；None表示使用CPU核数，进程数相同的调用复用同一个进程池
+    dtype: 混音总线的数据类型，需要能容纳所有乐器相加，见get_mix_dtype
+    歌曲按时间切成互不重叠的区间，每个子进程把所有乐器在一个区间内的部分直接叠加到共享内存中的同一条混音总线上，
+    共享内存只有sample_count * dtype大小，与乐器数无关，也不需要回传大数组；跨区间边界的块在相邻区间中各合成一次
+    返回dtype的混音结果
+    """
+    if sample_count == 0 or len(block_list_dict) == 0:
+        return np.zeros(sample_count, dtype=dtype)
+
+    if isinstance(workers, Executor):
+        executor = workers
+        range_count = os.cpu_count() or 1
+    else:
+        workers = workers or os.cpu_count() or 1
+        executor = get_process_pool(workers)
+        range_count = workers
+    range_count = max(1, min(range_count, sample_count // MIN_RANGE_SAMPLES))
+    bounds = np.linspace(0, sample_count, range_count + 1).astype(np.int64).tolist()
+
+    shm = shared_memory.SharedMemory(create=True, size=sample_count * np.dtype(dtype).itemsize)
+    try:
+        music_wav = np.ndarray(sample_count, dtype=dtype, buffer=shm.buf)
+        music_wav[:] = 0
+        futures = [executor.submit(_render_range_task, shm.name, sample_count, dtype, start, end, block_list_dict)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        try:
+            for future in futures:
+                future.result()
+        except BrokenProcessPool:
+            if executor is not workers:
+                _discard_process_pool(executor)
+            raise
+        result = music_wav.copy()
+        del music_wav
+    finally:
+        shm.close()
+        shm.unlink()
+    return result
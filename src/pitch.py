@@ -0,0 +1,150 @@
+import numpy as np
+from types import MappingProxyType
+
+# 十二平均律
+PITCH_FREQUENCY_DICT = MappingProxyType({
+    'C1': 32.70, 'D1': 36.71, 'E1': 41.20, 'F1': 43.65, 'G1': 48.99, 'A1': 55.00,
+    'B1': 61.74, 'C2': 65.41, 'D2': 73.42, 'E2': 82.41, 'F2': 87.31, 'G2': 97.99,
+    'A2': 110.00, 'B2': 123.47, 'C3': 130.81, 'D3': 146.83, 'E3': 164.81, 'F3': 174.61,
+    'G3': 196.00, 'A3': 220.00, 'B3': 246.94, 'C4': 261.63, 'D4': 293.66, 'E4': 329.63,
+    'F4': 349.23, 'G4': 392.00, 'A4': 440.00, 'B4': 493.88, 'C5': 523.25, 'D5': 587.33,
+    'E5': 659.26, 'F5': 698.46, 'G5': 783.99, 'A5': 880.00, 'B5': 987.77, 'C6': 1046.50,
+    'D6': 1174.66, 'E6': 1318.51, 'F6': 1396.91, 'G6': 1567.98, 'A6': 1760.00, 'B6': 1975.53,
+    'C7': 2093.00, 'D7': 2349.32, 'E7': 2637.02, 'F7': 2793.83, 'G7': 3135.96, 'A7': 3520.00,
+    'B7': 3951.07, '#C1': 34.65, '#D1': 39.20, '#F1': 46.25, '#G1': 52.00, '#A1': 58.27,
+    '#C2': 69.30, '#D2': 78.39, '#F2': 92.50, '#G2': 103.83, '#A2': 116.54, '#C3': 138.59,
+    '#D3': 155.56, '#F3': 185.00, '#G3': 207.65, '#A3': 233.08, '#C4': 277.18, '#D4': 311.13,
+    '#F4': 369.99, '#G4': 415.30, '#A4': 466.16, '#C5': 554.37, '#D5': 622.25, '#F5': 739.99,
+    '#G5': 830.61, '#A5': 932.33, '#C6': 1108.73, '#D6': 1244.51, '#F6': 1479.98, '#G6': 1661.22,
+    '#A6': 1864.66, '#C7': 2217.46, '#D7': 2489.02, '#F7': 2959.96, '#G7': 3322.44, '#A7': 3729.31,
+    'O': 0.0})
+
+# 音名的音阶关系
+PITCH_CLASS_NAMES = ('C', '#C', 'D', '#D', 'E', 'F', '#F', 'G', '#G', 'A', '#A', 'B')
+PITCH_CLASS_DICT = MappingProxyType({name: i for i, name in enumerate(PITCH_CLASS_NAMES)})
+SCALE_PITCH_DICT = MappingProxyType(dict(enumerate(PITCH_CLASS_NAMES)))
+
+# 以MIDI编号表示音高，C4=60，休止符为REST
+REST = -1
+MIDI_COUNT = 128
+MIDI_PITCH_NAMES = [PITCH_CLASS_NAMES[midi % 12] + str(midi // 12 - 1) if midi >= 12 else ''
+                    for midi in range(MIDI_COUNT)]
+PITCH_MIDI_DICT = {name: midi for midi, name in enumerate(MIDI_PITCH_NAMES) if len(name) > 0}
+PITCH_MIDI_DICT['O'] = REST
+# 可以合成的音高范围，即PITCH_FREQUENCY_DICT中的C1-B7
+RENDER_MIDI_MIN = PITCH_MIDI_DICT['C1']
+RENDER_MIDI_MAX = PITCH_MIDI_DICT['B7']
+
+# 频率表，pitch_dict中有的音高取pitch_dict的值，其余按十二平均律计算
+FREQUENCY_TABLE = 440.0 * 2 ** ((np.arange(MIDI_COUNT) - 69) / 12)
+for _name, _frequency in PITCH_FREQUENCY_DICT.items():
+    if _name != 'O':
+        FREQUENCY_TABLE[PITCH_MIDI_DICT[_name]] = _frequency
+FREQUENCY_TABLE.flags.writeable = False
+
+# 音程计算方法，'+maj3' 加三大度，'-semi5' 减五个半音
+INTERVAL_DICT = {'maj3': 4, 'min3': 3,
+                 'semi1': 1, 'semi2': 2, 'semi3': 3, 'semi4': 4, 'semi5': 5, 'semi6': 6, 'semi7': 7,
+                 'semi8': 8, 'semi9': 9, 'semi10': 10, 'semi11': 11, 'semi12': 12}
+METHOD_SEMITONE_DICT = {sign + interval: semitone if sign == '+' else -semitone
+                        for interval, semitone in INTERVAL_DICT.items() for sign in ['+', '-']}
+
+# 常用和弦类型，各音相对根音的半音数
+CHORD_TYPES = ('maj', 'min', 'dim', 'aug', 'maj7', '7', 'min7', 'm7-5', 'dim7')
+CHORD_INTERVAL_DICT = {'maj': (0, 4, 7),  # 大三和弦，根音、三音（大三度）、五音（小三度）
+                       'min': (0, 3, 7),  # 小三和弦，根音、三音（小三度）、五音（大三度）
+                       'dim': (0, 3, 6),  # 减三和弦，根音、三音（小三度）、五音（小三度）
+                       'aug': (0, 4, 8),  # 增三和弦，根音、三音（大三度）、五音（大三度）
+                       'maj7': (0, 4, 7, 11),  # 大七和弦：大三和弦+七音（五音大三度）
+                       '7': (0, 4, 7, 10),  # 属七和弦：大三和弦+降七音（五音小三度）
+                       'min7': (0, 3, 7, 10),  # 小七和弦：小三和弦+降七音（五音小三度）
+                       'm7-5': (0, 3, 6, 10),  # 半减七和弦：减三和弦+小七度
+                       'dim7': (0, 3, 6, 9)}  # 减七和弦：减三和弦+七音（五音小三度）
+
+# CHORD_TABLE[root_midi, chord_type_index]，三和弦第四个音为REST，超出MIDI范围的音也为REST
+CHORD_TABLE = np.full((MIDI_COUNT, len(CHORD_TYPES), 4), REST, dtype=np.int16)
+for _i, _chord_type in enumerate(CHORD_TYPES):
+    _intervals = CHORD_INTERVAL_DICT[_chord_type]
+    _chord = np.arange(MIDI_COUNT)[:, None] + np.array(_intervals)
+    CHORD_TABLE[:, _i, :len(_intervals)] = np.where(_chord < MIDI_COUNT, _chord, REST)
+CHORD_TABLE.flags.writeable = False
+
+
+def _build_chord_pitch_dict():
+    """
+    预先计算pitch_dict中每个音名和每个不带八度的音名的所有和弦，带八度的从CHORD_TABLE查得
+    与逐音程推算一致：除最后一个音外，和弦中的音必须在pitch_dict中
+    """
+    chord_pitch_dict = {}
+    for root in PITCH_CLASS_NAMES:
+        for chord_type, intervals in CHORD_INTERVAL_DICT.items():
+            chord_pitch_dict[(root, chord_type)] = [PITCH_CLASS_NAMES[(PITCH_CLASS_DICT[root] + interval) % 12]
+                                                    for interval in intervals]
+    for root in PITCH_FREQUENCY_DICT.keys():
+        if root == 'O':
+            continue
+        for i, chord_type in enumerate(CHORD_TYPES):
+            chord_midis = CHORD_TABLE[PITCH_MIDI_DICT[root], i]
+            chord_pitches = midis_to_pitches(chord_midis[:len(CHORD_INTERVAL_DICT[chord_type])])
+            if all(chord_pitch in PITCH_FREQUENCY_DICT for chord_pitch in chord_pitches[:-1]):
+                chord_pitch_dict[(root, chord_type)] = chord_pitches
+    return chord_pitch_dict
+
+
+def pitch_to_midi(pitch):
+    """
+    'A4' -> 69, 'O' -> REST
+    """
+    midi = PITCH_MIDI_DICT.get(pitch)
+    if midi is None:
+        raise ValueError(f"Unknown pitch: {pitch}")
+    return midi
+
+
+def midi_to_pitch(midi):
+    """
+    69 -> 'A4', REST -> 'O'
+    """
+    if midi == REST:
+        return 'O'
+    if midi < 12 or midi >= MIDI_COUNT:
+        raise ValueError(f"MIDI number should be between 12 and {MIDI_COUNT - 1}, got {midi}")
+    return MIDI_PITCH_NAMES[midi]
+
+
+def pitches_to_midi(pitches):
+    """
+    音名列表 -> MIDI编号的int16数组
+    """
+    return np.array([pitch_to_midi(pitch) for pitch in pitches], dtype=np.int16)
+
+
+def midis_to_pitches(midis):
+    """
+    MIDI编号数组 -> 音名列表
+    """
+    return [midi_to_pitch(midi) for midi in np.asarray(midis).tolist()]
+
+
+def transpose_midis(midis, semitones):
+    """
+    批量移调，休止符保持不变，结果超出可以合成的范围RENDER_MIDI_MIN-RENDER_MIDI_MAX时抛出ValueError
+    """
+    midis = np.asarray(midis, dtype=np.int16)
+    transposed = np.where(midis == REST, REST, midis + semitones).astype(np.int16)
+    if np.any((transposed != REST) & ((transposed < RENDER_MIDI_MIN) | (transposed > RENDER_MIDI_MAX))):
+        raise ValueError(f"Transposed pitch out of range {MIDI_PITCH_NAMES[RENDER_MIDI_MIN]}-"
+                         f"{MIDI_PITCH_NAMES[RENDER_MIDI_MAX]}")
+    return transposed
+
+
+
+def midis_to_frequencies(midis):
+    """
+    MIDI编号数组 -> 频率数组，休止符频率为0
+    """
+    midis = np.asarray(midis)
+    return np.where(midis == REST, 0.0, FREQUENCY_TABLE[np.where(midis == REST, 0, midis)])
+
+
+CHORD_PITCH_DICT = _build_chord_pitch_dict()
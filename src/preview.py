@@ -0,0 +1,259 @@
+import numpy as np
+
+# 峰值金字塔第0层每个区间的采样点数，往上每层合并相邻的两个区间
+PEAK_BASE_BLOCK = 64
+# 频谱图最多保留的帧数，超出后相邻两帧取平均合并，内存与歌曲长度无关
+SPECTROGRAM_MAX_FRAMES = 4096
+
+
+# 多分辨率的波形峰值
+class PeakPyramid:
+    def __init__(self, base_block=PEAK_BASE_BLOCK, wav=None):
+        """
+        依次调用update(block)输入波形块，最后调用finish()
+        base_block: 第0层每个区间的采样点数
+        wav: 原始波形（可以是np.memmap），放大到每个像素不足base_block个采样点时直接读取原始波形
+        """
+        if base_block <= 0:
+            raise ValueError("base_block should be positive")
+        self.base_block = base_block
+        self.wav = wav
+        self.sample_count = 0
+        self.mins = []  # mins[level]
+        self.maxs = []
+        self._min_list = []
+        self._max_list = []
+        self._remainder = np.empty(0, dtype=np.uint8)
+
+    @classmethod
+    def from_wave(cls, wav, base_block=PEAK_BASE_BLOCK, block_size=1 << 20):
+        """
+        按块扫描wav建立金字塔，wav可以是np.memmap，内存占用与wav长度无关
+        """
+        pyramid = cls(base_block, wav)
+        for start in range(0, len(wav), block_size):
+            pyramid.update(wav[start:start + block_size])
+        return pyramid.finish()
+
+    def update(self, block):
+        self.sample_count += len(block)
+        if len(self._remainder) > 0:
+            block = np.concatenate([self._remainder, block])
+        full = len(block) // self.base_block * self.base_block
+        if full > 0:
+            bins = block[:full].reshape(-1, self.base_block)
+            self._min_list.append(bins.min(axis=1))
+            self._max_list.append(bins.max(axis=1))
+        self._remainder = np.array(block[full:], dtype=np.uint8)
+        return self
+
+    def finish(self):
+        if len(self._remainder) > 0:
+            self._min_list.append(self._remainder.min(keepdims=True))
+            self._max_list.append(self._remainder.max(keepdims=True))
+            self._remainder = np.empty(0, dtype=np.uint8)
+        mins = np.concatenate(self._min_list) if len(self._min_list) > 0 else np.empty(0, dtype=np.uint8)
+        maxs = np.concatenate(self._max_list) if len(self._max_list) > 0 else np.empty(0, dtype=np.uint8)
+        self._min_list = []
+        self._max_list = []
+        self.mins = [mins]
+        self.maxs = [maxs]
+        while len(mins) > 1:
+            if len(mins) % 2 == 1:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = mins.reshape(-1, 2).min(axis=1)
+            maxs = maxs.reshape(-1, 2).max(axis=1)
+            self.mins.append(mins)
+            self.maxs.append(maxs)
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(mins.nbytes + maxs.nbytes for mins, maxs in zip(self.mins, self.maxs))
+
+    def get_peaks(self, pixels, start=0, end=None):
+        """
+        把[start, end)分成pixels个像素，返回每个像素的 (mins, maxs)
+        选用每个区间不超过一个像素宽度的最粗一层，耗时与pixels有关，与区间长度无关
+        """
+        end = self.sample_count if end is None else min(end, self.sample_count)
+        start = max(start, 0)
+        if pixels <= 0 or start >= end:
+            return np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint8)
+        edges = start + (np.arange(pixels + 1) * (end - start)) // pixels
+        samples_per_pixel = (end - start) / pixels
+        if samples_per_pixel < self.base_block and self.wav is not None:
+            mins_source = maxs_source = np.asarray(self.wav[start:end])
+            bin_size = 1
+            edges = edges - start
+        else:
+            level = 0
+            while level + 1 < len(self.mins) and self.base_block << (level + 1) <= samples_per_pixel:
+                level += 1
+            mins_source = self.mins[level]
+            maxs_source = self.maxs[level]
+            bin_size = self.base_block << level
+        # 每个像素包含与它重叠的所有区间，像素边界落在区间中间时相邻像素共用该区间
+        bin_end = min(-(-int(edges[-1]) // bin_size), len(mins_source))
+        bin_starts = np.minimum(edges[:-1] // bin_size, bin_end - 1)
+        bin_lasts = np.minimum((edges[1:] - 1) // bin_size, bin_end - 1)
+        mins = np.minimum(np.minimum.reduceat(mins_source[:bin_end], bin_starts), mins_source[bin_lasts])
+        maxs = np.maximum(np.maximum.reduceat(maxs_source[:bin_end], bin_starts), maxs_source[bin_lasts])
+        return mins, maxs
+
+
+# 流式计算的频谱图
+class Spectrogram:
+    def __init__(self, sample_rate, n_fft=512, hop=256, max_frames=SPECTROGRAM_MAX_FRAMES, chunk_frames=256):
+        """
+        依次调用update(block)输入波形块，最后调用finish()
+        每次对chunk_frames帧做一次批量FFT，帧数超过max_frames时相邻两列取平均，
+        之后每列代表的帧数加倍，内存只与max_frames和chunk_frames有关
+        magnitudes: (列数, n_fft // 2 + 1) 的幅度谱
+        """
+        if hop <= 0 or n_fft < hop:
+            raise ValueError("hop should be positive and no larger than n_fft")
+        if max_frames <= 0:
+            raise ValueError("max_frames should be positive")
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop = hop
+        self.max_frames = max_frames
+        self.chunk_frames = chunk_frames
+        self.frames_per_column = 1
+        self.frame_count = 0
+        self._column_list = []
+        self._column_count = 0
+        self._window = np.hanning(n_fft).astype(np.float32)
+        self._buffer = np.empty(0, dtype=np.float32)
+        self._pending = np.empty((0, n_fft // 2 + 1), dtype=np.float32)
+
+    def update(self, block):
+        self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=np.float32)])
+        frame_count = (len(self._buffer) - self.n_fft) // self.hop + 1
+        while frame_count >= self.chunk_frames:
+            self._add_frames(self.chunk_frames)
+            frame_count -= self.chunk_frames
+        return self
+
+    def _add_frames(self, frame_count):
+        frame_starts = np.arange(frame_count) * self.hop
+        frames = self._buffer[frame_starts[:, None] + np.arange(self.n_fft)]
+        # 波形都是非负的，去掉每帧的直流分量
+        frames -= frames.mean(axis=1, keepdims=True)
+        frames *= self._window
+        self._buffer = self._buffer[frame_count * self.hop:]
+        self.frame_count += frame_count
+        self._append_columns(np.abs(np.fft.rfft(frames, axis=1)).astype(np.float32))
+
+    def _append_columns(self, magnitudes):
+        # 凑够frames_per_column帧合成一列
+        magnitudes = np.concatenate([self._pending, magnitudes])
+        full = len(magnitudes) // self.frames_per_column * self.frames_per_column
+        self._pending = magnitudes[full:]
+        columns = magnitudes[:full].reshape(-1, self.frames_per_column, magnitudes.shape[1]).mean(axis=1)
+        self._column_list.append(columns)
+        self._column_count += len(columns)
+        self._merge_columns()
+
+    def _merge_columns(self, final=False):
+        # final为True时没有后续的帧，落单的一列单独保留
+        while self._column_count > self.max_frames:
+            columns = self.magnitudes
+            last = columns[:0]
+            if len(columns) % 2 == 1:
+                if final:
+                    last = columns[-1:]
+                else:
+                    # 落单的一列放回待合并的帧中
+                    self._pending = np.concatenate([np.repeat(columns[-1:], self.frames_per_column, axis=0),
+                                                    self._pending])
+                columns = columns[:-1]
+            self._column_list = [np.concatenate([columns.reshape(-1, 2, columns.shape[1]).mean(axis=1), last])]
+            self._column_count = len(self._column_list[0])
+            self.frames_per_column *= 2
+
+    @property
+    def magnitudes(self):
+        if len(self._column_list) != 1:
+            self._column_list = [np.concatenate(self._column_list) if len(self._column_list) > 0
+                                 else np.empty((0, self.n_fft // 2 + 1), dtype=np.float32)]
+        return self._column_list[0]
+
+    def finish(self):
+        frame_count = max((len(self._buffer) - self.n_fft) // self.hop + 1, 0)
+        if frame_count > 0:
+            self._add_frames(frame_count)
+        if len(self._pending) > 0:
+            self._column_list.append(self._pending.mean(axis=0, keepdims=True))
+            self._column_count += 1
+            self._pending = self._pending[:0]
+            self._merge_columns(final=True)
+        return self
+
+    @property
+    def seconds_per_column(self):
+        return self.hop * self.frames_per_column / self.sample_rate
+
+    def to_db(self, floor_db=-80.0):
+        """
+        返回以最大值为0dB的分贝谱
+        """
+        peak = self.magnitudes.max() if self.magnitudes.size > 0 else 0.0
+        if peak <= 0:
+            return np.full(self.magnitudes.shape, floor_db, dtype=np.float32)
+        return np.maximum(20 * np.log10(np.maximum(self.magnitudes / peak, 1e-12)), floor_db).astype(np.float32)
+
+
+def build_previews(blocks, sample_rate, base_block=PEAK_BASE_BLOCK, n_fft=512, hop=256,
+                   max_frames=SPECTROGRAM_MAX_FRAMES):
+    """
+    一次扫描波形块同时建立峰值金字塔和频谱图
+    blocks: uint8波形块的迭代器，例如Band8bit.iter_music_blocks的返回值
+    返回 (PeakPyramid, Spectrogram)
+    """
+    pyramid = PeakPyramid(base_block)
+    spectrogram = Spectrogram(sample_rate, n_fft, hop, max_frames)
+    for block in blocks:
+        pyramid.update(block)
+        spectrogram.update(block)
+    return pyramid.finish(), spectrogram.finish()
+
+
+def _new_figure(width, height, dpi):
+    # 不使用pyplot，不影响全局的matplotlib后端
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def save_waveform_png(pyramid, file_path, sample_rate, start=0, end=None, width=1200, height=240, dpi=100):
+    """
+    把[start, end)区间的波形画成宽width像素的PNG，每个像素一个峰值，耗时与歌曲长度无关
+    """
+    end = pyramid.sample_count if end is None else min(end, pyramid.sample_count)
+    mins, maxs = pyramid.get_peaks(width, start, end)
+    figure = _new_figure(width, height, dpi)
+    ax = figure.add_axes([0, 0, 1, 1])
+    x = (start + (np.arange(len(mins)) + 0.5) * (end - start) / max(len(mins), 1)) / sample_rate
+    ax.fill_between(x, mins, maxs, step='mid', linewidth=0)
+    ax.set_xlim(start / sample_rate, end / sample_rate)
+    ax.set_ylim(0, 255)
+    ax.set_axis_off()
+    figure.savefig(file_path, dpi=dpi)
+
+
+def save_spectrogram_png(spectrogram, file_path, width=1200, height=240, dpi=100, floor_db=-80.0):
+    """
+    把频谱图画成PNG，列数已被限制在max_frames以内
+    """
+    figure = _new_figure(width, height, dpi)
+    ax = figure.add_axes([0, 0, 1, 1])
+    duration = len(spectrogram.magnitudes) * spectrogram.seconds_per_column
+    ax.imshow(spectrogram.to_db(floor_db).T, origin='lower', aspect='auto', interpolation='nearest',
+              extent=(0, duration, 0, spectrogram.sample_rate / 2), vmin=floor_db, vmax=0)
+    ax.set_axis_off()
+    figure.savefig(file_path, dpi=dpi)
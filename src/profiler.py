@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import defaultdict
+
+PHASES = ['compile', 'synthesize', 'regularize', 'concatenate', 'mix', 'write']
+
+
+def _new_stats():
+    return {'calls': 0, 'notes': 0, 'seconds': 0.0, 'samples': 0, 'bytes': 0}
+
+
+# 一次计时
+class _Phase:
+    __slots__ = ('profiler', 'name', 'instrument', 'technique', 'start', 'child_seconds', 'samples', 'nbytes')
+
+    def __init__(self, profiler, name, instrument, technique):
+        self.profiler = profiler
+        self.name = name
+        self.instrument = instrument
+        self.technique = technique
+        self.start = 0.0
+        self.child_seconds = 0.0
+        self.samples = 0
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.profiler.begin_phase(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.end_phase(self, time.perf_counter() - self.start)
+        return False
+
+    def record(self, wav):
+        """
+        记录本阶段生成的波形，累计采样点数和分配的字节数
+        """
+        self.samples += len(wav)
+        self.nbytes += wav.nbytes
+
+
+# 未开启统计时使用的空计时，不做任何事
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def record(self, wav):
+        pass
+
+
+NULL_PHASE = _NullPhase()
+
+
+def profile_phase(profiler, name, instrument=None, technique=None):
+    """
+    profiler为None时返回空计时，开销只有一次函数调用
+    with profile_phase(self.profiler, 'synthesize', self.instrument_name, technique) as phase:
+        wav = ...
+        phase.record(wav)
+    """
+    if profiler is None:
+        return NULL_PHASE
+    return _Phase(profiler, name, instrument, technique)
+
+
+# 渲染统计
+class RenderProfiler:
+    def __init__(self, hook=None):
+        """
+        按阶段、乐器、技法统计耗时、音符数、采样点数和分配的字节数
+        hook: 每个阶段结束时调用hook(event)，event example:
+            {'phase': 'synthesize', 'instrument': 'guitar_theme', 'technique': 'tr',
+             'seconds': 0.0003, 'samples': 2756, 'bytes': 2756}
+        嵌套的阶段只记自身的耗时（扣除子阶段），未指定乐器和技法时沿用外层阶段的
+        """
+        self.hook = hook
+        self.phase_stats = defaultdict(_new_stats)
+        self.instrument_stats = defaultdict(_new_stats)
+        self.technique_stats = defaultdict(_new_stats)
+        self._local = threading.local()
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def begin_phase(self, phase):
+        stack = self._get_stack()
+        if len(stack) > 0:
+            parent = stack[-1]
+            if phase.instrument is None:
+                phase.instrument = parent.instrument
+            if phase.technique is None:
+                phase.technique = parent.technique
+        stack.append(phase)
+
+    def end_phase(self, phase, seconds):
+        stack = self._get_stack()
+        stack.pop()
+        if len(stack) > 0:
+            stack[-1].child_seconds += seconds
+        self.record_phase(phase.name, phase.instrument, phase.technique, seconds - phase.child_seconds,
+                          phase.samples, phase.nbytes)
+
+    def record_phase(self, name, instrument=None, technique=None, seconds=0.0, samples=0, nbytes=0):
+        """
+        直接记录一次在别处计时的阶段，例如在其他进程中合成的耗时，不参与嵌套扣除
+        """
+        for stats in self._stats_list(name, instrument, technique):
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['samples'] += samples
+            stats['bytes'] += nbytes
+        if self.hook is not None:
+            self.hook({'phase': name, 'instrument': instrument, 'technique': technique,
+                       'seconds': seconds, 'samples': samples, 'bytes': nbytes})
+
+    def count_notes(self, instrument, technique, notes):
+        """
+        technique为''表示普通单音
+        """
+        self.instrument_stats[instrument]['notes'] += notes
+        self.technique_stats[technique]['notes'] += notes
+
+    def _stats_list(self, name, instrument, technique):
+        stats_list = [self.phase_stats[name]]
+        if instrument is not None:
+            stats_list.append(self.instrument_stats[instrument])
+        if technique is not None:
+            stats_list.append(self.technique_stats[technique])
+        return stats_list
+
+    def reset(self):
+        self.phase_stats.clear()
+        self.instrument_stats.clear()
+        self.technique_stats.clear()
+
+    def report(self):
+        """
+        返回 {'phases': {...}, 'instruments': {...}, 'techniques': {...}}
+        """
+        return {'phases': {name: dict(stats) for name, stats in self.phase_stats.items()},
+                'instruments': {name: dict(stats) for name, stats in self.instrument_stats.items()},
+                'techniques': {name: dict(stats) for name, stats in self.technique_stats.items()}}
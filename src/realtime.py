@@ -0,0 +1,244 @@
+import threading
+import time
+import wave
+import numpy as np
+
+
+# 单生产者单消费者的环形缓冲区
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.uint8):
+        """
+        capacity: 缓冲区能容纳的采样点数，决定最大延迟
+        """
+        if capacity <= 0:
+            raise ValueError("capacity should be positive")
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=dtype)
+        self._read_pos = 0
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, data, stop_event=None):
+        """
+        写入data，缓冲区满时等待消费者读取
+        stop_event被设置或缓冲区被关闭时提前返回，返回实际写入的采样点数
+        """
+        written = 0
+        while written < len(data):
+            with self._cond:
+                while self._size == self.capacity and not self._closed:
+                    if stop_event is not None and stop_event.is_set():
+                        return written
+                    self._cond.wait(0.05)
+                if self._closed:
+                    return written
+                n = min(len(data) - written, self.capacity - self._size)
+                write_pos = (self._read_pos + self._size) % self.capacity
+                first = min(n, self.capacity - write_pos)
+                self._buf[write_pos:write_pos + first] = data[written:written + first]
+                self._buf[:n - first] = data[written + first:written + n]
+                self._size += n
+                written += n
+                self._cond.notify_all()
+        return written
+
+    def read(self, out, timeout=0.0):
+        """
+        读取最多len(out)个采样点到out，数据不足时最多等待timeout秒
+        返回实际读取的采样点数
+        """
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while self._size < len(out) and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(out), self._size)
+            first = min(n, self.capacity - self._read_pos)
+            out[:first] = self._buf[self._read_pos:self._read_pos + first]
+            out[first:n] = self._buf[:n - first]
+            self._read_pos = (self._read_pos + n) % self.capacity
+            self._size -= n
+            self._cond.notify_all()
+        return n
+
+    def close(self):
+        """
+        生产者结束后关闭，之后read不再等待
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# 拉取式实时渲染
+class RealtimeRenderer:
+    def __init__(self, band, score_dict, block_frames=256, buffer_frames=4096):
+        """
+        后台线程用Band8bit.iter_music_blocks边生成边写入环形缓冲区，播放端调用pull按需取块
+        band: Band8bit
+        score_dict: 格式同Band8bit.gen_music
+        block_frames: 生成端每块的采样点数，越小首个采样点越快可用
+        buffer_frames: 环形缓冲区大小，生成端最多领先播放端buffer_frames个采样点
+        """
+        if block_frames <= 0 or buffer_frames < block_frames:
+            raise ValueError("block_frames should be positive and no larger than buffer_frames")
+        self.band = band
+        self.score_dict = score_dict
+        self.block_frames = block_frames
+        self.sample_rate = band.sample_rate
+        self.ring = RingBuffer(buffer_frames)
+        self.deadline_misses = 0
+        self.underrun_frames = 0
+        self.frames_pulled = 0
+        self.time_to_first_sample = None
+        self._start_time = None
+        self._first_sample_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    @property
+    def finished(self):
+        return self.ring.closed and len(self.ring) == 0
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("RealtimeRenderer already started")
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        return self
+
+    def _produce(self):
+        try:
+            for music_block in self.band.iter_music_blocks(self.score_dict, self.block_frames):
+                if self.time_to_first_sample is None:
+                    self.time_to_first_sample = time.perf_counter() - self._start_time
+                    self._first_sample_event.set()
+                if self.ring.write(music_block, self._stop_event) < len(music_block):
+                    break
+                if self._stop_event.is_set():
+                    break
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._first_sample_event.set()
+            self.ring.close()
+
+    def wait_first_sample(self, timeout=None):
+        """
+        等待第一个块生成完成，返回time_to_first_sample（秒）
+        """
+        self._first_sample_event.wait(timeout)
+        return self.time_to_first_sample
+
+    def pull(self, out, timeout=0.0):
+        """
+        用接下来的len(out)个采样点填满调用方提供的uint8数组out
+        timeout秒内数据不足时算一次deadline miss，缺的部分填静音，保证按时返回
+        返回有效采样点数，歌曲结束后返回0
+        """
+        if self._thread is None:
+            raise RuntimeError("RealtimeRenderer not started, call start() first")
+        n = self.ring.read(out, timeout)
+        if self._error is not None:
+            raise self._error
+        if n < len(out):
+            out[n:] = 0
+            if not self.ring.closed:
+                self.deadline_misses += 1
+                self.underrun_frames += len(out) - n
+                n = len(out)
+        self.frames_pulled += n
+        return n
+
+    def play(self, sink, frames_per_pull=None, paced=True):
+        """
+        按播放速度从缓冲区取块写入sink，直到歌曲结束
+        paced为False时不等待，尽快取完（仍按一个块的时长作为deadline）
+        返回写入的采样点数
+        """
+        frames_per_pull = frames_per_pull or self.block_frames
+        period = frames_per_pull / self.sample_rate
+        out = np.empty(frames_per_pull, dtype=np.uint8)
+        self.wait_first_sample()
+        next_time = time.perf_counter()
+        sample_count = 0
+        while True:
+            next_time += period
+            n = self.pull(out, max(next_time - time.perf_counter(), 0.0) if paced else period)
+            if n == 0:
+                break
+            sink.write(out[:n])
+            sample_count += n
+            if paced:
+                time.sleep(max(next_time - time.perf_counter(), 0.0))
+        return sample_count
+
+    def stop(self):
+        self._stop_event.set()
+        self.ring.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return {'time_to_first_sample_ms': None if self.time_to_first_sample is None
+                else self.time_to_first_sample * 1000,
+                'deadline_misses': self.deadline_misses,
+                'underrun_frames': self.underrun_frames,
+                'frames_pulled': self.frames_pulled,
+                'buffered_frames': len(self.ring)}
+
+
+# 丢弃数据的输出，用于测试和基准
+class NullSink:
+    def __init__(self):
+        self.sample_count = 0
+
+    def write(self, block):
+        self.sample_count += len(block)
+
+    def close(self):
+        pass
+
+
+# 写入wav文件的输出
+class WaveFileSink:
+    def __init__(self, file_path, sample_rate):
+        self.sample_count = 0
+        self._f = wave.open(file_path, 'wb')
+        self._f.setnchannels(1)
+        self._f.setsampwidth(1)
+        self._f.setframerate(sample_rate)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, block):
+        self._f.writeframes(np.ascontiguousarray(block).data)
+        self.sample_count += len(block)
+
+    def close(self):
+        self._f.close()
@@ -0,0 +1,225 @@
+import json
+import os
+from collections import Counter
+import numpy as np
+
+# 紧凑乐谱：每个音符4字节，音高、时值、技法都是字符串表中的序号
+SCORE_DTYPE = np.dtype([('pitch', '<u2'), ('note', 'u1'), ('technique', 'u1')])
+
+# 文件格式：魔数 | 版本(uint16) | 头部长度(uint32) | JSON头部 | 补齐到16字节 | SCORE_DTYPE记录
+SCORE_FILE_MAGIC = b'8BSC'
+SCORE_FILE_VERSION = 1
+_PREFIX_SIZE = len(SCORE_FILE_MAGIC) + 2 + 4
+_ALIGNMENT = 16
+
+
+# 数组形式的乐谱
+class ScoreArray:
+    def __init__(self, records, pitch_names, note_names, technique_names):
+        """
+        records: SCORE_DTYPE数组，可以是np.memmap
+        pitch_names, note_names, technique_names: 字符串表，records中的编码是这些表的序号
+        可以代替[(pitch, note, technique),...]传给Rhythm8bit.gen_wave和Band8bit.gen_music，
+        编译时只把不重复的音符转换成元组
+        """
+        if records.dtype != SCORE_DTYPE:
+            raise ValueError(f"records should be of SCORE_DTYPE, got {records.dtype}")
+        self.records = records
+        self.pitch_names = tuple(pitch_names)
+        self.note_names = tuple(note_names)
+        self.technique_names = tuple(technique_names)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for pitch, note, technique in self.records.tolist():
+            yield self.pitch_names[pitch], self.note_names[note], self.technique_names[technique]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ScoreArray(self.records[index], self.pitch_names, self.note_names, self.technique_names)
+        pitch, note, technique = self.records[index].tolist()
+        return self.pitch_names[pitch], self.note_names[note], self.technique_names[technique]
+
+    @classmethod
+    def from_score_list(cls, score_list, pitch_names=(), note_names=(), technique_names=()):
+        """
+        [(pitch, note, technique),...] -> ScoreArray
+        已有的字符串表会被沿用并扩充，多个乐谱可以共用一套字符串表
+        """
+        pitch_dict = {name: i for i, name in enumerate(pitch_names)}
+        note_dict = {name: i for i, name in enumerate(note_names)}
+        technique_dict = {name: i for i, name in enumerate(technique_names)}
+        records = np.empty(len(score_list), dtype=SCORE_DTYPE)
+        for i, score in enumerate(score_list):
+            if not isinstance(score, tuple) or len(score) != 3:
+                raise ValueError("score_list: [(pitch, note, technique),...]")
+            pitch, note, technique = score
+            record = (pitch_dict.setdefault(pitch, len(pitch_dict)),
+                      note_dict.setdefault(note, len(note_dict)),
+                      technique_dict.setdefault(technique, len(technique_dict)))
+            # 超出SCORE_DTYPE的范围时赋值会抛出OverflowError，先检查
+            if record[0] > 0xFFFF or record[1] > 0xFF or record[2] > 0xFF:
+                raise ValueError("Too many distinct pitches, notes or techniques")
+            records[i] = record
+        return cls(records, pitch_dict.keys(), note_dict.keys(), technique_dict.keys())
+
+    def to_score_list(self):
+        """
+        ScoreArray -> [(pitch, note, technique),...]
+        """
+        return list(self)
+
+    @property
+    def key(self):
+        """
+        可哈希的内容键，与字符串表的顺序无关，内容相同的ScoreArray键相同
+        """
+        return _get_canonical_key(*self.unique_scores())
+
+    def unique_scores(self):
+        """
+        返回 (不重复的音符元组列表, 每个音符对应的序号数组)
+        """
+        if len(self.records) == 0:
+            return [], np.empty(0, dtype=np.intp)
+        codes = np.ascontiguousarray(self.records).view('<u4')
+        unique_codes, score_ids = np.unique(codes, return_inverse=True)
+        unique_records = unique_codes.view(SCORE_DTYPE)
+        scores = [(self.pitch_names[pitch], self.note_names[note], self.technique_names[technique])
+                  for pitch, note, technique in unique_records.tolist()]
+        return scores, score_ids
+
+    def count_techniques(self, repeat_times=1):
+        """
+        返回 {technique: 音符数}
+        """
+        counts = np.bincount(self.records['technique'], minlength=len(self.technique_names))
+        return {technique: int(count) * repeat_times
+                for technique, count in zip(self.technique_names, counts) if count > 0}
+
+
+def _get_canonical_key(scores, score_ids):
+    """
+    不重复的音符按元组排序，每个音符用排序后的序号表示
+    """
+    order = sorted(range(len(scores)), key=scores.__getitem__)
+    rank = np.empty(len(scores), dtype=np.int32)
+    rank[order] = np.arange(len(scores), dtype=np.int32)
+    return tuple(scores[i] for i in order), rank[np.asarray(score_ids, dtype=np.intp)].tobytes()
+
+
+def get_score_list_key(score_list):
+    """
+    乐谱的可哈希内容键，score_list可以是元组列表或ScoreArray，内容相同时两种形式的键相同
+    """
+    if isinstance(score_list, ScoreArray):
+        return score_list.key
+    score_id_dict = {}
+    score_ids = []
+    for score in score_list:
+        if not isinstance(score, tuple) or len(score) != 3:
+            raise ValueError("score_list: [(pitch, note, technique),...]")
+        score_ids.append(score_id_dict.setdefault(score, len(score_id_dict)))
+    return _get_canonical_key(list(score_id_dict), score_ids)
+
+
+def _to_score_array(score_list, tables):
+    if isinstance(score_list, ScoreArray):
+        score_list = score_list.to_score_list()
+    score_array = ScoreArray.from_score_list(score_list, *tables)
+    return score_array, (score_array.pitch_names, score_array.note_names, score_array.technique_names)
+
+
+def save_song(file_path, score_dict, metadata=None):
+    """
+    把gen_music格式的score_dict写入二进制乐谱文件，所有块共用一套字符串表
+    score_dict: {instrument: [(score_list, repeat_times),...]}，score_list可以是元组列表或ScoreArray
+    metadata: 可以转为JSON的附加信息，例如 {'bpm': 120, 'instruments': {'guitar_theme': 'guitar'}}
+    """
+    tables = ((), (), ())
+    record_list = []
+    blocks = []
+    start = 0
+    for instrument, score_list_list in score_dict.items():
+        for score_list, repeat_times in score_list_list:
+            score_array, tables = _to_score_array(score_list, tables)
+            record_list.append(score_array.records)
+            blocks.append({'instrument': instrument, 'repeat_times': int(repeat_times),
+                           'start': start, 'count': len(score_array)})
+            start += len(score_array)
+
+    header = json.dumps({'pitches': tables[0], 'notes': tables[1], 'techniques': tables[2], 'count': start,
+                         'blocks': blocks, 'metadata': metadata or {}}, ensure_ascii=False).encode()
+    padding = -(_PREFIX_SIZE + len(header)) % _ALIGNMENT
+    with open(file_path, 'wb') as f:
+        f.write(SCORE_FILE_MAGIC)
+        f.write(np.array([SCORE_FILE_VERSION], dtype='<u2').tobytes())
+        f.write(np.array([len(header) + padding], dtype='<u4').tobytes())
+        f.write(header + b' ' * padding)
+        for records in record_list:
+            f.write(records.tobytes())
+
+
+def _read_header(f, file_path):
+    prefix = f.read(_PREFIX_SIZE)
+    if len(prefix) < _PREFIX_SIZE or prefix[:len(SCORE_FILE_MAGIC)] != SCORE_FILE_MAGIC:
+        raise ValueError(f"Not an 8bit score file: {file_path}")
+    version = int(np.frombuffer(prefix, dtype='<u2', count=1, offset=len(SCORE_FILE_MAGIC))[0])
+    if version != SCORE_FILE_VERSION:
+        raise ValueError(f"Unsupported score file version: {version}")
+    header_size = int(np.frombuffer(prefix, dtype='<u4', count=1, offset=len(SCORE_FILE_MAGIC) + 2)[0])
+    return json.loads(f.read(header_size)), _PREFIX_SIZE + header_size
+
+
+def load_song_metadata(file_path):
+    """
+    只读取文件头，返回save_song时的metadata
+    """
+    with open(file_path, 'rb') as f:
+        return _read_header(f, file_path)[0].get('metadata', {})
+
+
+def load_song(file_path, mmap=True):
+    """
+    读取save_song写入的文件，返回 {instrument: [(ScoreArray, repeat_times),...]}，可以直接传给gen_music
+    mmap为True时记录通过np.memmap只读映射，不读入内存
+    """
+    with open(file_path, 'rb') as f:
+        header, offset = _read_header(f, file_path)
+        if mmap and header['count'] > 0:
+            records = np.memmap(file_path, dtype=SCORE_DTYPE, mode='r', offset=offset, shape=header['count'])
+        else:
+            f.seek(offset)
+            records = np.fromfile(f, dtype=SCORE_DTYPE, count=header['count'])
+
+    score_dict = {}
+    for block in header['blocks']:
+        score_array = ScoreArray(records[block['start']:block['start'] + block['count']],
+                                 header['pitches'], header['notes'], header['techniques'])
+        score_dict.setdefault(block['instrument'], []).append((score_array, block['repeat_times']))
+    return score_dict
+
+
+def get_output_paths(file_paths, out_dir, suffix):
+    """
+    批量转换时每个输入文件对应的输出路径，通常是 out_dir/文件名+suffix，例如 out/song.wav
+    文件名相同的输入（例如不同目录下的song.json，或song.json和song.mid）改为保留相对所有输入公共目录的路径，
+    仍然相同时再保留扩展名，例如 out/a/song.json.wav，互不覆盖；同一个文件出现两次时抛出ValueError
+    """
+    abs_paths = [os.path.abspath(file_path) for file_path in file_paths]
+    if len(abs_paths) == 0:
+        return []
+    path_counts = Counter(os.path.normcase(abs_path) for abs_path in abs_paths)
+    for abs_path in abs_paths:
+        if path_counts[os.path.normcase(abs_path)] > 1:
+            raise ValueError(f"Duplicate input file: {abs_path}")
+    common_dir = os.path.commonpath([os.path.dirname(abs_path) for abs_path in abs_paths])
+    names = [os.path.splitext(os.path.basename(abs_path))[0] for abs_path in abs_paths]
+    for get_name in [lambda abs_path: os.path.splitext(os.path.relpath(abs_path, common_dir))[0],
+                     lambda abs_path: os.path.relpath(abs_path, common_dir)]:
+        name_counts = Counter(os.path.normcase(name) for name in names)
+        names = [get_name(abs_path) if name_counts[os.path.normcase(name)] > 1 else name
+                 for name, abs_path in zip(names, abs_paths)]
+    return [os.path.join(out_dir, name + suffix) for name in names]
@@ -0,0 +1,186 @@
+import os
+import tempfile
+import threading
+import numpy as np
+
+STEM_FILE_SUFFIX = '.pcm'
+# 超过上限时淘汰到上限的这个比例，之后的多次写入不需要每次都扫描目录
+EVICT_LOW_WATER = 0.9
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+# 磁盘上的波形缓存，按内容哈希寻址，多个进程可以共用同一个目录
+class StemCache:
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        """
+        cache_dir: 缓存目录，每个波形保存为 cache_dir/键的前两位/键.pcm 的原始uint8 PCM文件
+        max_bytes: 目录中缓存文件的总大小上限（字节），超出后删除最久未使用的文件
+        key: 十六进制的内容哈希，例如Rhythm8bit.get_score_digest、Band8bit.get_stem_digest的返回值
+        写入时先写同目录下的临时文件再os.replace，其他进程只会读到完整的文件
+        命中时返回只读的np.memmap，不读入内存；接口与WaveCache相同，也可以作为Band8bit的segment_cache
+        hits、misses等计数只统计本进程的访问，entries、bytes是整个目录的
+        创建时不扫描目录，第一次写入时才统计目录大小，适合大量短命进程共用一个目录
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes should be positive")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 其他进程也会写入，只是估计值，超过上限时重新扫描目录；None表示还没有统计
+        self.current_bytes = None
+
+    def _get_path(self, key):
+        if not isinstance(key, str) or len(key) < 2 or not _HEX_DIGITS.issuperset(key):
+            raise ValueError(f"key should be a lowercase hex digest, got {key!r}")
+        return os.path.join(self.cache_dir, key[:2], key + STEM_FILE_SUFFIX)
+
+    def _scan(self):
+        """
+        返回 [(mtime, size, path),...]
+        """
+        entries = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith(STEM_FILE_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # 已被其他进程淘汰
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def __len__(self):
+        return len(self._scan())
+
+    def __contains__(self, key):
+        return os.path.exists(self._get_path(key))
+
+    def get(self, key):
+        """
+        命中返回只读的np.memmap，未命中返回None
+        命中时更新文件的修改时间，淘汰按修改时间从旧到新进行
+        """
+        path = self._get_path(key)
+        try:
+            if os.path.getsize(path) > 0:
+                wav = np.memmap(path, dtype=np.uint8, mode='r')
+            else:
+                wav = np.zeros(0, dtype=np.uint8)
+                wav.flags.writeable = False
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return wav
+
+    def put(self, key, wav):
+        """
+        写入波形，返回只读的波形
+        单个波形超过max_bytes时不缓存，直接返回只读波形
+        键是内容哈希，文件已经存在且大小相同时只更新修改时间，不重复写入
+        """
+        path = self._get_path(key)
+        wav = np.ascontiguousarray(wav, dtype=np.uint8)
+        # 视图可能被其他数组改写，先复制一份
+        if wav.base is not None:
+            wav = wav.copy()
+        wav.flags.writeable = False
+        if wav.nbytes > self.max_bytes:
+            return wav
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = None
+        if old_size == wav.nbytes:
+            try:
+                os.utime(path)
+                return wav
+            except FileNotFoundError:
+                # 刚被其他进程淘汰
+                old_size = None
+        if self.current_bytes is None:
+            # 第一次写入前统计目录大小，其中包含将被覆盖的旧文件
+            current_bytes = sum(size for _, size, _ in self._scan())
+            with self._lock:
+                if self.current_bytes is None:
+                    self.current_bytes = current_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(wav.data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self.writes += 1
+            self.current_bytes += wav.nbytes - (old_size or 0)
+            over = self.current_bytes > self.max_bytes
+        if over:
+            self.evict()
+        return wav
+
+    def evict(self):
+        """
+        目录总大小超过max_bytes时，按修改时间从旧到新删除文件，直到不超过max_bytes * EVICT_LOW_WATER，
+        返回删除的文件数；其他进程正在映射的文件被删除后仍然可以读取
+        """
+        entries = self._scan()
+        total_bytes = sum(size for _, size, _ in entries)
+        evictions = 0
+        low_water = int(self.max_bytes * EVICT_LOW_WATER) if total_bytes > self.max_bytes else self.max_bytes
+        for _, size, path in sorted(entries):
+            if total_bytes <= low_water:
+                break
+            try:
+                os.remove(path)
+                evictions += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            total_bytes -= size
+        with self._lock:
+            self.current_bytes = total_bytes
+            self.evictions += evictions
+        return evictions
+
+    def clear(self):
+        for _, _, path in self._scan():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self.current_bytes = 0
+
+    def stats(self):
+        entries = self._scan()
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes}
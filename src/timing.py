@@ -0,0 +1,80 @@
+import numbers
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+ONE_BEAT_NOTES = ('half', 'quarter', 'eighth')
+
+TimingTable = namedtuple('TimingTable', ['bpm', 'one_beat_note', 'sample_rate',
+                                         'eighth_beat_sample_count', 'quarter_beat_sample_count',
+                                         'half_beat_sample_count', 'one_beat_sample_count',
+                                         'two_beat_sample_count', 'four_beat_sample_count',
+                                         'eight_beat_sample_count', 'note_sample_count'])
+
+
+@lru_cache(maxsize=1024, typed=True)
+def get_timing_table(bpm, one_beat_note='quarter', sample_rate=11025):
+    """
+    相同(bpm, one_beat_note, sample_rate)的乐器共享同一张只读的时值表
+    note_sample_count: {note: 采样点数}
+    """
+    if bpm < 60 or bpm > 240:
+        raise ValueError("BPM should be between 60 and 240")
+    if one_beat_note not in ONE_BEAT_NOTES:
+        raise ValueError("One beat note should be 'half', 'quarter', or 'eighth'")
+    # 也接受np.int64等整数类型，例如从numpy数组或wav文件头读出的采样率，表中保存为int
+    if not isinstance(sample_rate, numbers.Integral) or sample_rate <= 0:
+        raise ValueError("Sample rate should be a positive integer")
+    sample_rate = int(sample_rate)
+
+    one_beat_duration = 60 / bpm  # seconds
+    eighth_beat_duration = one_beat_duration * 0.125
+
+    eighth_beat_sample_count = int(round(eighth_beat_duration * sample_rate))
+    quarter_beat_sample_count = int(eighth_beat_sample_count * 2)
+    half_beat_sample_count = int(eighth_beat_sample_count * 4)
+    one_beat_sample_count = int(eighth_beat_sample_count * 8)
+    two_beat_sample_count = int(eighth_beat_sample_count * 16)
+    four_beat_sample_count = int(eighth_beat_sample_count * 32)
+    eight_beat_sample_count = int(eighth_beat_sample_count * 64)
+
+    note_sample_count = {}
+    # 以二分音符为一拍
+    if one_beat_note == 'half':
+        # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的采样点数
+        note_sample_count = {'1/2': one_beat_sample_count,
+                             '1/2.': one_beat_sample_count + half_beat_sample_count,
+                             '1/4': half_beat_sample_count,
+                             '1/4.': half_beat_sample_count + quarter_beat_sample_count,
+                             '1/8': quarter_beat_sample_count,
+                             '1/8.': quarter_beat_sample_count + eighth_beat_sample_count,
+                             '1': two_beat_sample_count}
+    # 以四分音符为一拍
+    elif one_beat_note == 'quarter':
+        # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的时长
+        note_sample_count = {'1/2': two_beat_sample_count,
+                             '1/2.': two_beat_sample_count + one_beat_sample_count,
+                             '1/4': one_beat_sample_count,
+                             '1/4.': one_beat_sample_count + half_beat_sample_count,
+                             '1/8': half_beat_sample_count,
+                             '1/8.': half_beat_sample_count + quarter_beat_sample_count,
+                             '1/16': quarter_beat_sample_count,
+                             '1/16.': quarter_beat_sample_count + eighth_beat_sample_count,
+                             '1': four_beat_sample_count}
+    # 以八分音符为一拍
+    elif one_beat_note == 'eighth':
+        # 二分音符、附点二分音符、四分音符、附点四分音符、八分音符、附点八分音符、全音符的时长
+        note_sample_count = {'1/2': four_beat_sample_count,
+                             '1/2.': four_beat_sample_count + two_beat_sample_count,
+                             '1/4': two_beat_sample_count,
+                             '1/4.': two_beat_sample_count + one_beat_sample_count,
+                             '1/8': one_beat_sample_count,
+                             '1/8.': one_beat_sample_count + half_beat_sample_count,
+                             '1/16': half_beat_sample_count,
+                             '1/16.': half_beat_sample_count + quarter_beat_sample_count,
+                             '1': eight_beat_sample_count}
+
+    return TimingTable(bpm, one_beat_note, sample_rate,
+                       eighth_beat_sample_count, quarter_beat_sample_count, half_beat_sample_count,
+                       one_beat_sample_count, two_beat_sample_count, four_beat_sample_count,
+                       eight_beat_sample_count, MappingProxyType(note_sample_count))
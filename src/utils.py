@@ -1,13 +1,122 @@
 import numpy as np
+from functools import lru_cache
+
+PHASE_BITS = 32  # phase accumulator width, one cycle == 2 ** PHASE_BITS
+PHASE_MASK = (1 << PHASE_BITS) - 1
+WAVETABLE_BITS = 10
+WAVETABLE_SIZE = 1 << WAVETABLE_BITS
+NOISE_LFSR_BITS = 15  # NES noise channel shift register width
+NOISE_LFSR_SEED = 1
+NOISE_TABLE_SIZE = (1 << NOISE_LFSR_BITS) - 1  # one full LFSR period
+
+_phase_ramp = np.arange(4096, dtype=np.uint32)
+
+
+@lru_cache(maxsize=None)
+def get_wavetable(shape, amplitude):
+    """
+    shape: 'square' or 'triangle'
+    amplitude: 0-255
+    return a read-only uint8 array holding one cycle of the waveform
+    """
+    phase = np.arange(WAVETABLE_SIZE) / WAVETABLE_SIZE
+    if shape == 'square':
+        wavetable = np.where(phase < 0.5, amplitude, 0)
+    elif shape == 'triangle':
+        wavetable = np.abs(phase - 0.5) * 2 * amplitude
+    else:
+        raise ValueError(f"Unknown shape: {shape}, should be one of ['square', 'triangle']")
+    wavetable = np.uint8(wavetable)
+    wavetable.flags.writeable = False
+    return wavetable
+
+
+@lru_cache(maxsize=None)
+def _get_lfsr_bits():
+    """
+    one period of the NES-style 15-bit LFSR output, feedback = bit0 ^ bit1
+    """
+    bits = np.empty(NOISE_TABLE_SIZE, dtype=np.uint8)
+    register = NOISE_LFSR_SEED
+    for i in range(NOISE_TABLE_SIZE):
+        bits[i] = register & 1
+        feedback = (register ^ (register >> 1)) & 1
+        register = (register >> 1) | (feedback << (NOISE_LFSR_BITS - 1))
+    return bits
+
+
+@lru_cache(maxsize=None)
+def get_noise_table(amplitude):
+    """
+    amplitude: 0-255
+    return a read-only uint8 array of NOISE_TABLE_SIZE deterministic noise samples in [0, amplitude)
+    each sample packs 8 consecutive LFSR bits, the table repeats seamlessly after NOISE_TABLE_SIZE samples
+    """
+    samples = np.packbits(np.tile(_get_lfsr_bits(), 8).reshape(-1, 8), axis=1).ravel()
+    noise_table = ((samples.astype(np.uint16) * amplitude) >> 8).astype(np.uint8)
+    noise_table.flags.writeable = False
+    return noise_table
+
+
+def cal_phase_increment(frequency, sample_rate):
+    """
+    return the per-sample phase increment of the accumulator
+    """
+    return int(round(frequency * (1 << PHASE_BITS) / sample_rate)) & PHASE_MASK
+
+
+def get_phase_ramp(num_samples):
+    """
+    return a shared read-only uint32 array of 0, 1, ..., num_samples - 1
+    """
+    global _phase_ramp
+    if len(_phase_ramp) < num_samples:
+        ramp = np.arange(max(num_samples, 2 * len(_phase_ramp)), dtype=np.uint32)
+        ramp.flags.writeable = False
+        _phase_ramp = ramp
+    return _phase_ramp[:num_samples]
+
+
+def fill_wavetable_wave(out, wavetable, frequency, sample_rate, phase=0):
+    """
+    write len(out) samples of a phase-accumulator oscillator into the uint8 array out
+    phase: start phase in accumulator units, one cycle == 2 ** PHASE_BITS
+    return the end phase, pass it as the next start phase to keep phase continuous
+    """
+    num_samples = len(out)
+    increment = cal_phase_increment(frequency, sample_rate)
+    # uint32 arithmetic wraps at one cycle, so no mod is needed
+    acc = np.multiply(get_phase_ramp(num_samples), np.uint32(increment))
+    acc += np.uint32(phase & PHASE_MASK)
+    acc >>= PHASE_BITS - WAVETABLE_BITS
+    np.take(wavetable, acc, out=out)
+    return (phase + increment * num_samples) & PHASE_MASK
+
+
+def fill_square_wave(out, frequency, amplitude, sample_rate, phase=0):
+    """
+    amplitude: 0-255
+    write a square wave into the uint8 array out, return the end phase
+    """
+    return fill_wavetable_wave(out, get_wavetable('square', amplitude), frequency, sample_rate, phase)
+
+
+def fill_triangle_wave(out, frequency, amplitude, sample_rate, phase=0):
+    """
+    amplitude: 0-255
+    write a triangle wave into the uint8 array out, return the end phase
+    """
+    return fill_wavetable_wave(out, get_wavetable('triangle', amplitude), frequency, sample_rate, phase)
+
+
 def gen_square_wave(frequency, amplitude, duration, sample_rate):
     """
     amplitude: 0-255
     return an uint8 array of square wave
     """
     num_samples = int(duration * sample_rate)
-    t = np.linspace(0, duration, num_samples, endpoint=False)
-    square_wave = np.where(np.mod(frequency * t, 1) < 0.5, amplitude, 0)
-    square_wave = np.uint8(square_wave)
+    square_wave = np.empty(num_samples, dtype=np.uint8)
+    fill_square_wave(square_wave, frequency, amplitude, sample_rate)
     return square_wave
 
 
@@ -17,9 +126,8 @@ def gen_triangle_wave(frequency, amplitude, duration, sample_rate):
     return an uint8 array of triangle wave
     """
     num_samples = int(duration * sample_rate)
-    t = np.linspace(0, duration, num_samples, endpoint=False)
-    triangle_wave = np.abs(np.mod(frequency * t, 1) - 0.5) * 2 * amplitude
-    triangle_wave = np.uint8(triangle_wave)
+    triangle_wave = np.empty(num_samples, dtype=np.uint8)
+    fill_triangle_wave(triangle_wave, frequency, amplitude, sample_rate)
     return triangle_wave
 
 
@@ -33,10 +141,11 @@ def gen_zero_wave(num_samples):
 
 def gen_noise_wave(amplitude, duration, sample_rate):
     """
-    return an uint8 array of noise wave
+    return an uint8 array of noise wave, always starting from the same LFSR state
+    so the same arguments give byte-identical output
     """
     num_samples = int(duration * sample_rate)
-    noise_wave = np.random.randint(0, amplitude, num_samples, dtype=np.uint8)
+    noise_wave = np.resize(get_noise_table(amplitude), num_samples)
     return noise_wave
 
 
@@ -47,3 +156,27 @@ def regularize_wave(wav, num_samples):
     elif len(wav) > num_samples:
         wav = wav[:num_samples]
     return wav
+
+
+def gen_wave_blocks(wav_iter, block_size):
+    """
+    将逐段生成的波形重新切分为长度为block_size的块
+    最后一块可能不足block_size
+    """
+    if block_size <= 0:
+        raise ValueError("block_size should be positive")
+    block = np.empty(block_size, dtype=np.uint8)
+    filled = 0
+    for wav in wav_iter:
+        start = 0
+        while start < len(wav):
+            n = min(block_size - filled, len(wav) - start)
+            block[filled:filled + n] = wav[start:start + n]
+            filled += n
+            start += n
+            if filled == block_size:
+                yield block
+                block = np.empty(block_size, dtype=np.uint8)
+                filled = 0
+    if filled > 0:
+        yield block[:filled]
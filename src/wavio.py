@@ -0,0 +1,113 @@
+import struct
+import wave
+import numpy as np
+
+# 标准PCM wav文件头：RIFF块 + fmt块 + data块头
+WAV_HEADER_SIZE = 44
+SAMPLE_DTYPE_DICT = {1: np.uint8, 2: np.dtype('<i2')}
+
+
+def write_wave_file(file_path, wav, sample_rate):
+    """
+    把单声道uint8波形写入wav文件，直接写入数组的内存，不额外复制一份bytes
+    """
+    with wave.open(file_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(1)
+        f.setframerate(sample_rate)
+        f.writeframes(np.ascontiguousarray(wav, dtype=np.uint8).data)
+
+
+def _make_header(sample_count, sample_rate, channels, sample_width):
+    data_size = sample_count * channels * sample_width
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size + data_size % 2, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, sample_rate * channels * sample_width,
+                       channels * sample_width, sample_width * 8,
+                       b'data', data_size)
+
+
+def create_wave_memmap(file_path, sample_count, sample_rate, channels=1, sample_width=1):
+    """
+    预先分配wav文件并写好文件头，返回映射到data块的可写np.memmap
+    单声道时形状为(sample_count,)，否则为(sample_count, channels)
+    8bit的静音是0，与gen_zero_wave一致，新文件的数据全为0
+    """
+    if sample_width not in SAMPLE_DTYPE_DICT:
+        raise ValueError(f"Unsupported sample width: {sample_width}, should be one of {list(SAMPLE_DTYPE_DICT)}")
+    data_size = sample_count * channels * sample_width
+    with open(file_path, 'wb') as f:
+        f.write(_make_header(sample_count, sample_rate, channels, sample_width))
+        # RIFF块的长度必须是偶数
+        f.truncate(WAV_HEADER_SIZE + data_size + data_size % 2)
+    if sample_count == 0:
+        return np.zeros((0,) if channels == 1 else (0, channels), dtype=SAMPLE_DTYPE_DICT[sample_width])
+    shape = (sample_count,) if channels == 1 else (sample_count, channels)
+    return np.memmap(file_path, dtype=SAMPLE_DTYPE_DICT[sample_width], mode='r+', offset=WAV_HEADER_SIZE,
+                     shape=shape)
+
+
+def open_wave_memmap(file_path, mode='r'):
+    """
+    把已有的PCM wav文件映射为np.memmap，不读入内存
+    返回 (wav, sample_rate)，wav的形状同create_wave_memmap
+    mode: 'r' 只读，'r+' 可写，'c' 写时复制
+    """
+    with open(file_path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+            raise ValueError(f"Not a wav file: {file_path}")
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"No data chunk in wav file: {file_path}")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+    if fmt is None:
+        raise ValueError(f"No fmt chunk in wav file: {file_path}")
+    audio_format, channels, sample_rate, _, _, bits = fmt
+    sample_width = bits // 8
+    if audio_format != 1 or sample_width not in SAMPLE_DTYPE_DICT:
+        raise ValueError(f"Only 8bit or 16bit PCM wav files are supported: {file_path}")
+    sample_count = chunk_size // (channels * sample_width)
+    dtype = SAMPLE_DTYPE_DICT[sample_width]
+    if sample_count == 0:
+        return np.zeros((0,) if channels == 1 else (0, channels), dtype=dtype), sample_rate
+    shape = (sample_count,) if channels == 1 else (sample_count, channels)
+    return np.memmap(file_path, dtype=dtype, mode=mode, offset=data_offset, shape=shape), sample_rate
+
+
+def concatenate_wave_files(out_path, file_paths):
+    """
+    按顺序拼接多个采样率和格式相同的wav文件，输入和输出都是映射的，内存占用与文件长度无关
+    返回输出的采样点数
+    """
+    wav_list = []
+    sample_rate = None
+    for file_path in file_paths:
+        wav, file_sample_rate = open_wave_memmap(file_path)
+        if sample_rate is not None and (file_sample_rate != sample_rate or wav.shape[1:] != wav_list[0].shape[1:]
+                                        or wav.dtype != wav_list[0].dtype):
+            raise ValueError(f"Wav format mismatch: {file_path}")
+        sample_rate = file_sample_rate
+        wav_list.append(wav)
+    if len(wav_list) == 0:
+        raise ValueError("file_paths should not be empty")
+    sample_count = sum(len(wav) for wav in wav_list)
+    channels = 1 if wav_list[0].ndim == 1 else wav_list[0].shape[1]
+    out = create_wave_memmap(out_path, sample_count, sample_rate, channels, wav_list[0].dtype.itemsize)
+    offset = 0
+    for wav in wav_list:
+        out[offset:offset + len(wav)] = wav
+        offset += len(wav)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return sample_count
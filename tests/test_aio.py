@@ -0,0 +1,80 @@
+import asyncio
+import wave
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pytest
+from src.aio import AsyncRenderer
+from src.melody import Band8bit
+
+INSTRUMENT_DICT = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+SCORE_DICT = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('G4', '1/4', 'maj-chord')], 3),
+                         ([('A4', '1/8', 'sl')], 2),
+                         ([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('G4', '1/4', 'maj-chord')], 1)],
+              'bass': [([('C2', '1/4', ''), ('G2', '1/4', 'pr')], 2)],
+              'drum': [([('K', '1/8', ''), ('H', '1/8', ''), ('S', '1/8', '')], 4), ([('K', '1/16', '')], 3)]}
+
+
+@pytest.mark.parametrize('executor_cls', [None, ThreadPoolExecutor, ProcessPoolExecutor])
+def test_gen_music_equals_serial(executor_cls):
+    expected = Band8bit(120, INSTRUMENT_DICT).gen_music(SCORE_DICT).copy()
+    band = Band8bit(120, INSTRUMENT_DICT)
+    if executor_cls is None:
+        music_wav = asyncio.run(AsyncRenderer().gen_music(band, SCORE_DICT))
+    else:
+        with executor_cls(2) as executor:
+            music_wav = asyncio.run(AsyncRenderer(executor, max_concurrency=2).gen_music(band, SCORE_DICT))
+    assert np.array_equal(music_wav, expected)
+    assert music_wav is band.music_wav
+
+
+def test_progress_events_in_order():
+    band = Band8bit(120, INSTRUMENT_DICT)
+    events = []
+
+    async def progress(event):
+        events.append(event)
+
+    music_wav = asyncio.run(AsyncRenderer().gen_music(band, SCORE_DICT, progress=progress))
+    expected_events = []
+    for instrument, score_list_list in SCORE_DICT.items():
+        block_list = band.compile_one_instrument(instrument, score_list_list)
+        instrument_samples = 0
+        for i, (score_events, repeat_times) in enumerate(block_list):
+            expected_events.append({'type': 'block', 'instrument': instrument, 'block': i, 'blocks': len(block_list),
+                                    'samples': score_events.sample_count * repeat_times})
+            instrument_samples += score_events.sample_count * repeat_times
+        expected_events.append({'type': 'instrument', 'instrument': instrument, 'samples': instrument_samples})
+    expected_events.append({'type': 'done', 'samples': len(music_wav)})
+    assert events == expected_events
+
+    # 普通函数也可以作为progress
+    events.clear()
+    asyncio.run(AsyncRenderer().gen_music(band, SCORE_DICT, progress=events.append))
+    assert events == expected_events
+
+
+def test_timeout_raises():
+    band = Band8bit(120, INSTRUMENT_DICT)
+
+    async def slow_progress(event):
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(AsyncRenderer().gen_music(band, SCORE_DICT, timeout=0.05, progress=slow_progress))
+    with pytest.raises(ValueError):
+        asyncio.run(AsyncRenderer().gen_music(band, {'piano': SCORE_DICT['guitar']}))
+
+
+def test_write_and_render_music_to_file(tmp_path):
+    band = Band8bit(120, INSTRUMENT_DICT)
+    renderer = AsyncRenderer()
+    expected = asyncio.run(renderer.gen_music(band, SCORE_DICT)).copy()
+
+    async def write():
+        await renderer.write_music(band, str(tmp_path / 'music.wav'))
+        return await renderer.render_music_to_file(band, str(tmp_path / 'stream.wav'), SCORE_DICT)
+
+    assert asyncio.run(write()) == len(expected)
+    for name in ['music.wav', 'stream.wav']:
+        with wave.open(str(tmp_path / name), 'rb') as f:
+            assert np.array_equal(np.frombuffer(f.readframes(f.getnframes()), dtype=np.uint8), expected)
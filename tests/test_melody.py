@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from src.melody import MelodyAssist8bit, CHORD_DEGREE_NAMES, CHORD_FUNC_DICT
+from src.pitch import PITCH_CLASS_NAMES
+
+TONALITIES = ['C-maj', 'A-min', '#F-maj', 'D-min']
+CHORD_PROGRESSION_TYPES = ['T-S-D-T', 'S-D-D-T-S-D-T-T', 'T-D']
+
+
+def test_chord_progressions_reproducible():
+    melody = MelodyAssist8bit()
+    result = melody.gen_random_chord_progressions(np.random.default_rng(42), 50, TONALITIES, CHORD_PROGRESSION_TYPES)
+    same = melody.gen_random_chord_progressions(np.random.default_rng(42), 50, TONALITIES, CHORD_PROGRESSION_TYPES)
+    other = melody.gen_random_chord_progressions(np.random.default_rng(43), 50, TONALITIES, CHORD_PROGRESSION_TYPES)
+    assert result.keys() == same.keys()
+    for key in result.keys():
+        assert np.array_equal(result[key], same[key])
+    assert not np.array_equal(result['chord_progressions'], other['chord_progressions'])
+
+
+def test_chord_progressions_follow_tonality_and_type():
+    melody = MelodyAssist8bit()
+    count = 200
+    result = melody.gen_random_chord_progressions(np.random.default_rng(0), count, TONALITIES, CHORD_PROGRESSION_TYPES)
+    max_len = max(len(t.split('-')) for t in CHORD_PROGRESSION_TYPES)
+    assert result['natural_pitches'].shape == (count, 7)
+    assert result['chord_progressions'].shape == (count, max_len)
+    assert result['chord_progression_pitches'].shape == (count, max_len, 3)
+    # 每个调性和类型都被选到
+    assert set(result['tonality_ids'].tolist()) == set(range(len(TONALITIES)))
+    assert set(result['chord_progression_type_ids'].tolist()) == set(range(len(CHORD_PROGRESSION_TYPES)))
+    for i in range(count):
+        natural_pitches = melody.get_natural_pitches(TONALITIES[result['tonality_ids'][i]])
+        assert [PITCH_CLASS_NAMES[code] for code in result['natural_pitches'][i]] == natural_pitches
+        chord_funcs = CHORD_PROGRESSION_TYPES[result['chord_progression_type_ids'][i]].split('-')
+        length = len(chord_funcs)
+        assert result['lengths'][i] == length
+        for j, chord_func in enumerate(chord_funcs):
+            degree = int(result['chord_progressions'][i, j])
+            assert CHORD_DEGREE_NAMES[degree] in CHORD_FUNC_DICT[chord_func]
+            chord_pitches = [PITCH_CLASS_NAMES[code] for code in result['chord_progression_pitches'][i, j]]
+            assert chord_pitches == [natural_pitches[(degree + k) % 7] for k in (0, 2, 4)]
+        # 短于最长类型的部分填-1
+        assert np.all(result['chord_progressions'][i, length:] == -1)
+        assert np.all(result['chord_progression_pitches'][i, length:] == -1)
+
+
+def test_chord_progressions_single_and_empty():
+    melody = MelodyAssist8bit()
+    result = melody.gen_random_chord_progressions(np.random.default_rng(0), 10, 'A-min', 'T-S-D-T')
+    assert np.all(result['tonality_ids'] == 0) and np.all(result['chord_progression_type_ids'] == 0)
+    assert result['chord_progressions'].shape == (10, 4)
+    assert np.all(result['chord_progressions'] >= 0)
+    result = melody.gen_random_chord_progressions(np.random.default_rng(0), 0, TONALITIES, CHORD_PROGRESSION_TYPES)
+    assert result['natural_pitches'].shape == (0, 7)
+    assert result['chord_progressions'].shape == (0, 8)
+    assert result['chord_progression_pitches'].shape == (0, 8, 3)
+    assert len(result['lengths']) == 0
+    for tonalities, chord_progression_types in [([], 'T-S-D-T'), ('C-maj', []), ('C-major', 'T-S-D-T'),
+                                                ('C-maj', 'T-X-D')]:
+        with pytest.raises(ValueError):
+            melody.gen_random_chord_progressions(np.random.default_rng(0), 1, tonalities, chord_progression_types)
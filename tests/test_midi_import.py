@@ -0,0 +1,141 @@
+import struct
+import pytest
+from src.midi_import import import_midi, convert_midi_files
+from src.score_format import load_song
+
+# 每个四分音符8个tick，一个tick就是一个三十二分音符
+DIVISION = 8
+TEMPO_120 = b'\xff\x51\x03' + (500000).to_bytes(3, 'big')
+END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+
+def vlq(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def make_track(events, end=True):
+    """
+    events: [(delta_tick, bytes),...]，bytes原样写入，可以省略状态字节（running status）
+    """
+    data = b''.join(vlq(delta) + message for delta, message in events) + (END_OF_TRACK if end else b'')
+    return b'MTrk' + struct.pack('>I', len(data)) + data
+
+
+def write_midi(path, tracks, division=DIVISION):
+    path.write_bytes(b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), division) + b''.join(tracks))
+    return str(path)
+
+
+def notes_track(channel, notes):
+    """
+    notes: [(start_tick, end_tick, key),...]，用note on/note off写入
+    """
+    messages = []
+    for start, end, key in notes:
+        messages.append((start, bytes([0x90 | channel, key, 100])))
+        messages.append((end, bytes([0x80 | channel, key, 0])))
+    messages.sort(key=lambda message: (message[0], message[1][0] & 0xF0 == 0x90))
+    events = []
+    tick = 0
+    for message_tick, message in messages:
+        events.append((message_tick - tick, message))
+        tick = message_tick
+    return make_track(events)
+
+
+def test_running_status_and_meta_sysex_skipped(tmp_path):
+    track = make_track([(0, TEMPO_120),
+                        (0, b'\xff\x58\x04\x04\x02\x18\x08'),
+                        (0, b'\xff\x01\x04text'),
+                        (0, b'\xf0\x03\x7e\x01\xf7'),
+                        (0, b'\x90\x3c\x64'),
+                        # running status：省略0x90，力度0的note on表示note off
+                        (8, b'\x3c\x00'),
+                        (0, b'\x40\x64'),
+                        (0, b'\xff\x01\x01x'),
+                        # meta事件之后不能沿用running status
+                        (8, b'\x90\x40\x00')])
+    metadata, score_dict = import_midi(write_midi(tmp_path / 'song.mid', [track]), compact=False)
+    assert metadata['bpm'] == 120
+    assert metadata['instruments'] == {'guitar_0': 'guitar'}
+    assert score_dict['guitar_0'] == [([('C4', '1/4', 'pr'), ('E4', '1/4', 'pr'), ('O', '1/2', '')], 1)]
+
+
+def test_invalid_files_raise_value_error(tmp_path):
+    data = write_midi(tmp_path / 'song.mid', [notes_track(0, [(0, 8, 60), (8, 16, 62)])])
+    truncated = tmp_path / 'truncated.mid'
+    truncated.write_bytes(open(data, 'rb').read()[:-len(END_OF_TRACK) - 2])
+    for path in [str(truncated), write_midi(tmp_path / 'running.mid', [make_track([(0, b'\x3c\x64')])])]:
+        with pytest.raises(ValueError):
+            import_midi(path)
+    not_midi = tmp_path / 'not.mid'
+    not_midi.write_bytes(b'RIFF' + bytes(20))
+    with pytest.raises(ValueError):
+        import_midi(str(not_midi))
+
+
+def test_channel_instrument_mapping(tmp_path):
+    tracks = [notes_track(0, [(0, 8, 60)]),
+              make_track([(0, b'\xc1\x21')]),
+              notes_track(1, [(0, 8, 36), (0, 8, 40)]),
+              notes_track(2, [(0, 8, 60), (0, 8, 67)]),
+              notes_track(9, [(0, 4, 36), (0, 4, 42), (8, 12, 38), (16, 20, 42)])]
+    path = write_midi(tmp_path / 'song.mid', tracks)
+    metadata, score_dict = import_midi(path, compact=False)
+    assert metadata['instruments'] == {'guitar_0': 'guitar', 'bass_1': 'bass', 'guitar_2': 'guitar', 'drum_9': 'drum'}
+    # 同时发声时guitar取最高音，bass取最低音，鼓按 底鼓 > 军鼓 > 镲
+    assert score_dict['bass_1'][0][0][0] == ('C2', '1/4', 'pr')
+    assert score_dict['guitar_2'][0][0][0] == ('G4', '1/4', 'pr')
+    assert score_dict['drum_9'] == [([('K', '1/8', ''), ('O', '1/8', ''), ('S', '1/8', ''), ('O', '1/8', ''),
+                                      ('H', '1/8', ''), ('O', '1/4.', '')], 1)]
+    metadata = import_midi(path, channel_instrument_dict={0: 'bass', 2: None})[0]
+    assert metadata['instruments'] == {'bass_0': 'bass', 'bass_1': 'bass', 'drum_9': 'drum'}
+    with pytest.raises(ValueError):
+        import_midi(path, channel_instrument_dict={0: 'piano'})
+
+
+def test_quantize_and_bar_splitting(tmp_path):
+    # 第一个音偏离十六分音符网格一个tick，第二个音跨小节
+    path = write_midi(tmp_path / 'song.mid', [notes_track(0, [(7, 16, 60), (24, 40, 62)])])
+    score_dict = import_midi(path, compact=False)[1]
+    assert score_dict['guitar_0'] == [([('O', '1/4', ''), ('C4', '1/4', 'pr'), ('O', '1/4', ''),
+                                        ('D4', '1/4', 'pr')], 1),
+                                      ([('D4', '1/4', 'pr'), ('O', '1/2.', '')], 1)]
+    score_dict = import_midi(path, quantize='1/4', technique='', compact=False)[1]
+    assert score_dict['guitar_0'][0] == ([('O', '1/4', ''), ('C4', '1/4', ''), ('O', '1/4', ''), ('D4', '1/4', '')], 1)
+    with pytest.raises(ValueError):
+        import_midi(path, quantize='1/32')
+
+
+def test_identical_bars_merged_into_repeats(tmp_path):
+    notes = [(bar * 32 + beat * 8, bar * 32 + beat * 8 + 8, 60 + beat) for bar in range(4) for beat in range(4)]
+    notes.append((4 * 32, 5 * 32, 48))
+    path = write_midi(tmp_path / 'song.mid', [make_track([(0, TEMPO_120)]), notes_track(0, notes)])
+    score_dict = import_midi(path, compact=False)[1]
+    assert score_dict['guitar_0'] == [([('C4', '1/4', 'pr'), ('#C4', '1/4', 'pr'), ('D4', '1/4', 'pr'),
+                                        ('#D4', '1/4', 'pr')], 4),
+                                      ([('C3', '1', 'pr')], 1)]
+    compact_score_dict = import_midi(path)[1]
+    assert [(score_array.to_score_list(), repeat_times) for score_array, repeat_times in
+            compact_score_dict['guitar_0']] == score_dict['guitar_0']
+
+
+def test_convert_midi_files_keeps_same_named_outputs(tmp_path):
+    file_paths = []
+    for i, relative_path in enumerate(['a/song.mid', 'b/song.mid', 'b/song.midi']):
+        (tmp_path / relative_path).parent.mkdir(exist_ok=True)
+        file_paths.append(write_midi(tmp_path / relative_path, [notes_track(0, [(0, 8, 60 + i)])]))
+    results = convert_midi_files(file_paths, str(tmp_path / 'out'), workers=0)
+    out_paths = [result['output'] for result in results]
+    assert all('error' not in result for result in results)
+    assert len(set(out_paths)) == 3
+    for i, out_path in enumerate(out_paths):
+        score_array, _ = load_song(out_path, mmap=False)['guitar_0'][0]
+        assert score_array[0][0] == ['C4', '#C4', 'D4'][i]
+    with pytest.raises(ValueError):
+        convert_midi_files(file_paths[:1] * 2, str(tmp_path / 'out'), workers=0)
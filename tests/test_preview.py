@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from src.preview import PeakPyramid, Spectrogram, build_previews, save_waveform_png, save_spectrogram_png
+
+
+def get_wave(sample_count, seed=0):
+    # 随机游走，相邻像素的峰值各不相同
+    steps = np.random.default_rng(seed).integers(-9, 10, sample_count)
+    return (np.cumsum(steps) % 256).astype(np.uint8)
+
+
+def brute_force_peaks(wav, pixels, start, end, bin_size):
+    """
+    每个像素取与它重叠的所有bin_size长的区间的最小最大值
+    """
+    edges = start + (np.arange(pixels + 1) * (end - start)) // pixels
+    mins = []
+    maxs = []
+    for pixel_start, pixel_end in zip(edges[:-1], edges[1:]):
+        pixel_wav = wav[pixel_start // bin_size * bin_size:-(-pixel_end // bin_size) * bin_size]
+        mins.append(pixel_wav.min())
+        maxs.append(pixel_wav.max())
+    return np.array(mins), np.array(maxs)
+
+
+@pytest.mark.parametrize('with_wave', [True, False])
+def test_peaks_match_brute_force(with_wave):
+    base_block = 16
+    wav = get_wave(10007)
+    pyramid = PeakPyramid.from_wave(wav, base_block, block_size=1000)
+    if not with_wave:
+        pyramid.wav = None
+    for pixels, start, end in [(100, 0, None), (7, 0, None), (1, 0, None), (333, 5, 10007), (50, 4000, 4400),
+                               (30, 123, 500), (64, 9000, 20000), (10, -50, 30), (900, 0, 1000)]:
+        end_clipped = len(wav) if end is None else min(end, len(wav))
+        start_clipped = max(start, 0)
+        samples_per_pixel = (end_clipped - start_clipped) / pixels
+        if samples_per_pixel < base_block and with_wave:
+            bin_size = 1
+        else:
+            level = 0
+            while level + 1 < len(pyramid.mins) and base_block << (level + 1) <= samples_per_pixel:
+                level += 1
+            bin_size = base_block << level
+        mins, maxs = pyramid.get_peaks(pixels, start, end)
+        expected_mins, expected_maxs = brute_force_peaks(wav, pixels, start_clipped, end_clipped, bin_size)
+        assert np.array_equal(mins, expected_mins), (pixels, start, end)
+        assert np.array_equal(maxs, expected_maxs), (pixels, start, end)
+        # 峰值一定包住像素内的所有采样点
+        exact_mins, exact_maxs = brute_force_peaks(wav, pixels, start_clipped, end_clipped, 1)
+        assert np.all(mins <= exact_mins) and np.all(maxs >= exact_maxs)
+    assert [len(peaks) for peaks in pyramid.get_peaks(10, 500, 500)] == [0, 0]
+    assert [len(peaks) for peaks in pyramid.get_peaks(0)] == [0, 0]
+
+
+def test_pyramid_streaming_equals_from_wave():
+    wav = get_wave(5000, 1)
+    pyramid = PeakPyramid(64)
+    for start in range(0, len(wav), 777):
+        pyramid.update(wav[start:start + 777])
+    pyramid.finish()
+    expected = PeakPyramid.from_wave(wav, 64)
+    assert pyramid.sample_count == len(wav)
+    assert len(pyramid.mins) == len(expected.mins)
+    for level in range(len(expected.mins)):
+        assert np.array_equal(pyramid.mins[level], expected.mins[level])
+        assert np.array_equal(pyramid.maxs[level], expected.maxs[level])
+    assert pyramid.mins[-1].tolist() == [wav.min()] and pyramid.maxs[-1].tolist() == [wav.max()]
+
+
+@pytest.mark.parametrize('max_frames', [1, 5, 16, 1000])
+@pytest.mark.parametrize('chunk_frames', [1, 7, 256])
+def test_spectrogram_frames_bounded(max_frames, chunk_frames):
+    wav = get_wave(30001, 2)
+    spectrogram = Spectrogram(11025, 128, 64, max_frames, chunk_frames)
+    for start in range(0, len(wav), 1000):
+        spectrogram.update(wav[start:start + 1000])
+        assert len(spectrogram.magnitudes) <= max_frames
+    spectrogram.finish()
+    frame_count = (len(wav) - 128) // 64 + 1
+    assert spectrogram.frame_count == frame_count
+    assert 0 < len(spectrogram.magnitudes) <= max_frames
+    assert spectrogram.magnitudes.shape[1] == 128 // 2 + 1
+    # 每列代表frames_per_column帧，最后一列可能不满
+    assert len(spectrogram.magnitudes) == -(-frame_count // spectrogram.frames_per_column)
+    db = spectrogram.to_db()
+    assert db.max() == 0 and db.min() >= -80
+
+
+def test_spectrogram_without_merge_equals_fft():
+    wav = get_wave(2000, 3)
+    spectrogram = Spectrogram(11025, 128, 64, chunk_frames=5)
+    spectrogram.update(wav).finish()
+    frames = np.lib.stride_tricks.sliding_window_view(wav.astype(np.float64), 128)[::64]
+    frames = (frames - frames.mean(axis=1, keepdims=True)) * np.hanning(128)
+    assert spectrogram.frames_per_column == 1
+    assert np.allclose(spectrogram.magnitudes, np.abs(np.fft.rfft(frames, axis=1)), rtol=1e-4, atol=1e-2)
+
+
+def test_save_png(tmp_path):
+    pytest.importorskip('matplotlib')
+    wav = get_wave(20000, 4)
+    pyramid, spectrogram = build_previews([wav[:7000], wav[7000:]], 11025, max_frames=64)
+    save_waveform_png(pyramid, str(tmp_path / 'wave.png'), 11025, width=200, height=50)
+    save_waveform_png(pyramid, str(tmp_path / 'zoom.png'), 11025, 100, 300, width=200, height=50)
+    save_spectrogram_png(spectrogram, str(tmp_path / 'spectrogram.png'), width=200, height=50)
+    for name in ['wave.png', 'zoom.png', 'spectrogram.png']:
+        assert (tmp_path / name).read_bytes()[:8] == b'\x89PNG\r\n\x1a\n'
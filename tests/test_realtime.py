@@ -0,0 +1,81 @@
+import threading
+import wave
+import numpy as np
+import pytest
+from src.melody import Band8bit
+from src.realtime import RealtimeRenderer, NullSink, WaveFileSink
+
+INSTRUMENT_DICT = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+SCORE_DICT = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('G4', '1/4', 'maj-chord')], 3)],
+              'bass': [([('C2', '1/4', ''), ('G2', '1/4', 'pr')], 2)],
+              'drum': [([('K', '1/8', ''), ('H', '1/8', ''), ('S', '1/8', ''), ('H', '1/8', '')], 2),
+                       ([('K', '1/16', '')], 3)]}
+
+
+class ListSink(NullSink):
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+
+    def write(self, block):
+        super().write(block)
+        self.blocks.append(block.copy())
+
+
+@pytest.mark.parametrize('block_frames, buffer_frames, frames_per_pull', [(256, 4096, None), (64, 128, 100)])
+def test_play_unpaced_equals_gen_music(block_frames, buffer_frames, frames_per_pull):
+    band = Band8bit(120, INSTRUMENT_DICT)
+    expected = band.gen_music(SCORE_DICT).copy()
+    sink = ListSink()
+    with RealtimeRenderer(band, SCORE_DICT, block_frames, buffer_frames) as renderer:
+        assert renderer.play(sink, frames_per_pull, paced=False) == len(expected)
+    assert renderer.finished
+    assert sink.sample_count == len(expected)
+    assert np.array_equal(np.concatenate(sink.blocks), expected)
+    assert renderer.stats()['frames_pulled'] == len(expected)
+
+
+def test_play_into_wave_file_sink(tmp_path):
+    band = Band8bit(120, INSTRUMENT_DICT)
+    expected = band.gen_music(SCORE_DICT).copy()
+    file_path = str(tmp_path / 'out.wav')
+    with RealtimeRenderer(band, SCORE_DICT) as renderer:
+        with WaveFileSink(file_path, renderer.sample_rate) as sink:
+            renderer.play(sink, paced=False)
+    with wave.open(file_path, 'rb') as f:
+        assert (f.getnchannels(), f.getsampwidth(), f.getframerate()) == (1, 1, band.sample_rate)
+        assert np.array_equal(np.frombuffer(f.readframes(f.getnframes()), dtype=np.uint8), expected)
+
+
+def test_pull_pads_silence_on_underrun(monkeypatch):
+    release = threading.Event()
+
+    def slow_iter_music_blocks(self, score_dict, block_size=4096):
+        release.wait()
+        yield np.full(block_size, 7, dtype=np.uint8)
+
+    monkeypatch.setattr(Band8bit, 'iter_music_blocks', slow_iter_music_blocks)
+    renderer = RealtimeRenderer(Band8bit(120, INSTRUMENT_DICT), SCORE_DICT, 16, 64).start()
+    out = np.full(10, 255, dtype=np.uint8)
+    # 生产者还没有数据，按时返回静音并记一次deadline miss
+    assert renderer.pull(out, timeout=0.01) == 10
+    assert np.all(out == 0)
+    assert (renderer.deadline_misses, renderer.underrun_frames) == (1, 10)
+    release.set()
+    assert renderer.pull(out, timeout=1.0) == 10
+    assert np.all(out == 7)
+    # 歌曲结束后不足的部分补静音，但不算deadline miss
+    assert renderer.pull(out, timeout=1.0) == 6
+    assert np.array_equal(out, [7] * 6 + [0] * 4)
+    assert renderer.pull(out, timeout=1.0) == 0
+    assert renderer.deadline_misses == 1
+    renderer.stop()
+
+
+def test_producer_error_raised_from_pull():
+    renderer = RealtimeRenderer(Band8bit(120, INSTRUMENT_DICT), {'piano': SCORE_DICT['guitar']}).start()
+    with pytest.raises(ValueError):
+        renderer.pull(np.empty(10, dtype=np.uint8), timeout=1.0)
+    renderer.stop()
+    with pytest.raises(RuntimeError):
+        RealtimeRenderer(Band8bit(120, INSTRUMENT_DICT), SCORE_DICT).pull(np.empty(10, dtype=np.uint8))
@@ -0,0 +1,296 @@
+import json
+import os
+import wave
+import numpy as np
+import pytest
+from src.cache import WaveCache
+import main
+from src import compiler, parallel
+from src.compiler import render_events
+from src.melody import Band8bit, Guitar8bit, Bass8bit, Drum8bit, Melody8bit
+from src.mixer import add_blocks, add_blocks_range, get_blocks_sample_count
+from src.pitch import PITCH_FREQUENCY_DICT, midis_to_frequencies, pitch_to_midi
+from src.profiler import RenderProfiler
+from src.score_format import ScoreArray, get_output_paths
+
+PITCHES = ['C4', 'A4', '#F3', 'B6', 'E1', 'O']
+
+
+def get_scores(instrument_obj, pitches):
+    return [(pitch, note, technique) for pitch in pitches for note in instrument_obj.note_sample_count
+            for technique in [''] + list(instrument_obj.performances)]
+
+
+@pytest.mark.parametrize('cls', [Guitar8bit, Bass8bit])
+@pytest.mark.parametrize('bpm', [72, 120, 240])
+@pytest.mark.parametrize('one_beat_note', ['half', 'quarter', 'eighth'])
+def test_gen_wave_equals_per_note(cls, bpm, one_beat_note):
+    instrument_obj = cls(bpm, one_beat_note)
+    scores = get_scores(instrument_obj, PITCHES)
+    expected = np.concatenate([instrument_obj._gen_one_score_wave(score) for score in scores])
+    assert np.array_equal(instrument_obj.gen_wave(scores), expected)
+
+
+def test_drum_gen_wave_equals_per_note():
+    drum = Drum8bit(97, 'eighth')
+    scores = get_scores(drum, ['K', 'S', 'H', 'O'])
+    expected = np.concatenate([drum._gen_one_score_wave(score) for score in scores])
+    assert np.array_equal(drum.gen_wave(scores, 3), np.tile(expected, 3))
+
+
+def test_wave_cache_used_by_gen_music():
+    wave_cache = WaveCache()
+    band = Band8bit(120, {'guitar': 'guitar', 'drum': 'drum'}, wave_cache=wave_cache)
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('C4', '1/8', 'pr')], 2)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/8', '')], 4)]}
+    expected = Band8bit(120, {'guitar': 'guitar', 'drum': 'drum'}).gen_music(score_dict).copy()
+    assert np.array_equal(band.gen_music(score_dict), expected)
+    assert wave_cache.misses == 4
+    assert np.array_equal(band.gen_music(score_dict), expected)
+    assert wave_cache.hits == 4
+
+
+def test_profiler_times_synthesis_per_technique():
+    band = Band8bit(120, {'guitar': 'guitar', 'drum': 'drum'})
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('C4', '1/8', '')], 2)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/8', '')], 4)]}
+    expected = band.gen_music(score_dict).copy()
+    profiler = RenderProfiler()
+    band.set_profiler(profiler)
+    assert np.array_equal(band.gen_music(score_dict), expected)
+    technique_stats = profiler.report()['techniques']
+    for technique in ['', 'pr', 'tr']:
+        assert technique_stats[technique]['calls'] > 0
+        assert technique_stats[technique]['samples'] > 0
+
+
+def test_score_digest_same_for_score_array():
+    guitar = Guitar8bit(120)
+    score_list = [('C4', '1/8', 'pr'), ('E4', '1/4', ''), ('C4', '1/8', 'pr'), ('O', '1/8', '')]
+    score_array = ScoreArray.from_score_list(score_list[::-1])[::-1]
+    assert guitar.get_score_digest(score_list) == guitar.get_score_digest(score_array)
+    assert guitar.get_score_digest(score_list) != guitar.get_score_digest(score_list[1:])
+    band = Band8bit(120, {'guitar': 'guitar'})
+    assert band.get_stem_digest('guitar', [(score_list, 2)]) == band.get_stem_digest('guitar', [(score_array, 2)])
+
+
+def test_add_blocks_range_equals_slice():
+    guitar = Guitar8bit(120)
+    block_list = [(guitar.compile_score([('C4', '1/8', 'tr'), ('O', '1/16', ''), ('E4', '1/4', 'maj-chord')]), 5),
+                  (guitar.compile_score([]), 3),
+                  (guitar.compile_score([('G3', '1/16', 'sl')]), 7)]
+    sample_count = get_blocks_sample_count(block_list)
+    expected = np.zeros(sample_count + 100, dtype=np.int32)
+    add_blocks(expected, block_list)
+    for start, end in [(0, sample_count), (1, 2), (3000, 17001), (sample_count - 5, sample_count + 100)]:
+        out = np.zeros(end - start, dtype=np.int32)
+        add_blocks_range(out, block_list, start, end)
+        assert np.array_equal(out, expected[start:end])
+
+
+def get_long_block(instrument_obj, note_count, pitches=('C4', 'E4', 'G4', 'O')):
+    techniques = [''] + list(instrument_obj.performances)
+    notes = ['1/8', '1/4', '1/16']
+    return instrument_obj.compile_score([(pitches[i % 4], notes[i % 3], techniques[i % len(techniques)])
+                                         for i in range(note_count)])
+
+
+@pytest.mark.parametrize('cls, pitches', [(Guitar8bit, ('C4', 'E4', 'G4', 'O')), (Drum8bit, ('K', 'S', 'H', 'O'))])
+def test_add_blocks_range_single_block_equals_slice(cls, pitches):
+    score_events = get_long_block(cls(120), 200, pitches)
+    sample_count = score_events.sample_count
+    expected = render_events(score_events, np.zeros(sample_count, dtype=np.int32))
+    for start, end in [(0, sample_count), (0, 1), (12345, 23456), (sample_count // 3, 2 * sample_count // 3),
+                       (sample_count - 1000, sample_count)]:
+        out = np.zeros(end - start, dtype=np.int32)
+        add_blocks_range(out, [(score_events, 1)], start, end)
+        assert np.array_equal(out, expected[start:end])
+
+
+def test_add_blocks_range_synthesizes_only_the_range(monkeypatch):
+    synthesized = []
+    render_voice_chunk = compiler._render_voice_chunk
+
+    def count_voice_chunk(events, shape, sample_rate, out):
+        synthesized.append(int(events['onset'][-1] + events['length'][-1] - events['onset'][0]))
+        return render_voice_chunk(events, shape, sample_rate, out)
+
+    monkeypatch.setattr(compiler, '_render_voice_chunk', count_voice_chunk)
+    score_events = get_long_block(Guitar8bit(120), 800)
+    sample_count = score_events.sample_count
+    render_events(score_events, np.zeros(sample_count, dtype=np.int32))
+    total = sum(synthesized)
+    k = 8
+    for i in range(k):
+        synthesized.clear()
+        start, end = sample_count * i // k, sample_count * (i + 1) // k
+        add_blocks_range(np.zeros(end - start, dtype=np.int32), [(score_events, 1)], start, end)
+        assert sum(synthesized) < total / k * 1.1
+
+
+def test_parallel_gen_music_reuses_pool(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_RANGE_SAMPLES', 1000)
+    instrument_dict = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr'), ('C4', '1/4', 'maj-chord')], 3)],
+                  'bass': [([('C2', '1/4', ''), ('G2', '1/8', '')], 5)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/8', '')], 9)]}
+    expected = Band8bit(120, instrument_dict).gen_music(score_dict).copy()
+    band = Band8bit(120, instrument_dict)
+    assert np.array_equal(band.gen_music(score_dict, workers=2), expected)
+    executor = parallel.get_process_pool(2)
+    assert np.array_equal(band.gen_music(score_dict, workers=2), expected)
+    assert parallel.get_process_pool(2) is executor
+
+
+def test_update_music_does_not_modify_previous_result():
+    band = Band8bit(120, {'guitar': 'guitar', 'drum': 'drum'})
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/8', 'tr')], 2), ([('G4', '1/4', '')], 1)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/8', '')], 4)]}
+    first = band.update_music(score_dict)
+    expected = first.copy()
+    score_dict['guitar'][1] = ([('A4', '1/4', 'sl')], 1)
+    second = band.update_music(score_dict)
+    assert np.array_equal(first, expected)
+    assert np.array_equal(second, Band8bit(120, {'guitar': 'guitar', 'drum': 'drum'}).gen_music(score_dict))
+    assert not np.array_equal(first, second)
+
+
+@pytest.mark.parametrize('make_score', [lambda i: ('C4', str(i), ''), lambda i: ('C4', '1/4', str(i))])
+def test_score_array_too_many_names(make_score):
+    ScoreArray.from_score_list([make_score(i) for i in range(256)])
+    with pytest.raises(ValueError):
+        ScoreArray.from_score_list([make_score(i) for i in range(257)])
+
+
+def test_transpose_score_stays_renderable():
+    melody = Melody8bit()
+    assert melody.transpose_score([('C4', '1/4', 'pr'), ('O', '1/4', '')], 12) == [('C5', '1/4', 'pr'),
+                                                                                     ('O', '1/4', '')]
+    assert melody.transpose_score([('A7', '1/4', '')], 2) == [('B7', '1/4', '')]
+    for score, semitones in [(('B7', '1/4', 'pr'), 1), (('C1', '1/4', ''), -1)]:
+        with pytest.raises(ValueError):
+            melody.transpose_score([score], semitones)
+
+
+def test_output_paths_do_not_collide(tmp_path):
+    file_paths = [str(tmp_path / 'a' / 'song.json'), str(tmp_path / 'a' / 'song.mid'),
+                  str(tmp_path / 'b' / 'song.json'), str(tmp_path / 'b' / 'other.json')]
+    out_paths = get_output_paths(file_paths, 'out', '.wav')
+    assert len(set(out_paths)) == len(file_paths)
+    assert out_paths[3] == os.path.join('out', 'other.wav')
+    assert out_paths[2] == os.path.join('out', 'b', 'song.wav')
+    assert get_output_paths([str(tmp_path / 'song.json')], 'out', '.wav') == [os.path.join('out', 'song.wav')]
+
+
+@pytest.mark.parametrize('mix_mode', [None, 'clip'])
+def test_cli_mix_mode_overrides_metadata(tmp_path, mix_mode):
+    # 六把吉他的三和弦叠加后超过255，'clip'和'normalize'的结果不同
+    instruments = {f'guitar{i}': 'guitar' for i in range(6)}
+    song = {'bpm': 120, 'instruments': instruments, 'mix_mode': 'normalize',
+            'scores': {instrument: [[[['C4', '1/4', 'maj-chord']], 2]] for instrument in instruments}}
+    file_path = tmp_path / 'song.json'
+    file_path.write_text(json.dumps(song))
+    main.render_song(str(file_path), str(tmp_path / 'song.wav'), mix_mode)
+    score_dict = main.load_score_file(str(file_path))[1]
+    expected_mode, other_mode = ('normalize', 'clip') if mix_mode is None else ('clip', 'normalize')
+    expected = Band8bit(120, instruments).gen_music(score_dict, expected_mode)
+    assert not np.array_equal(expected, Band8bit(120, instruments).gen_music(score_dict, other_mode))
+    with wave.open(str(tmp_path / 'song.wav')) as f:
+        assert np.array_equal(np.frombuffer(f.readframes(f.getnframes()), dtype=np.uint8), expected)
+
+
+@pytest.mark.parametrize('score', [('K', '1/16', ''), ('H', '1/4', ''), ('O', '1/8', '')])
+def test_drum_note_wave_writeable_without_cache(score):
+    drum = Drum8bit(240)
+    wav = drum.gen_one_score_wave(score)
+    assert wav.flags.writeable
+    wav[:] = 0
+    assert np.array_equal(drum.gen_one_score_wave(score), drum._gen_one_score_wave(score))
+
+
+def test_frequency_table_matches_pitch_dict():
+    for pitch, frequency in PITCH_FREQUENCY_DICT.items():
+        assert midis_to_frequencies([pitch_to_midi(pitch)])[0] == frequency
+    guitar = Guitar8bit(120)
+    events = guitar.compile_score([('C4', '1/4', 'maj-chord'), ('A4', '1/4', 'min-arpeggio'), ('E2', '1/4', '')]).events
+    assert events['frequency'].tolist() == [PITCH_FREQUENCY_DICT[pitch] for pitch in
+                                            ['C4', 'E4', 'G4', 'A4', 'C5', 'E5', 'A5', 'E2']]
+
+
+def test_render_range_equals_gen_music_slice():
+    instrument_dict = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/16', 'tr'), ('G4', '1/4', 'maj-chord')], 3),
+                             ([('A4', '1/8', 'sl'), ('O', '1/16', '')], 2)],
+                  'bass': [([('C2', '1/4', ''), ('G2', '1/8', 'pr')], 4)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/16', ''), ('S', '1/8', '')], 5), ([('K', '1/16', '')], 3)]}
+    band = Band8bit(120, instrument_dict)
+    expected = band.gen_music(score_dict).copy()
+    sample_count = len(expected)
+    # 各乐器块和每次重复的边界
+    boundaries = set()
+    for instrument, score_list_list in score_dict.items():
+        offset = 0
+        for score_list, repeat_times in score_list_list:
+            block_sample_count = int(band.instrument_obj_dict[instrument].get_note_sample_counts(score_list).sum())
+            for _ in range(repeat_times):
+                offset += block_sample_count
+                boundaries.add(offset)
+    windows = [(0, sample_count), (-100, 50), (-500, -1), (sample_count - 10, sample_count + 1000),
+               (sample_count + 1, sample_count + 9), (123, 123)]
+    windows += [(boundary - 37, boundary + 41) for boundary in sorted(boundaries)]
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        start = int(rng.integers(-1000, sample_count))
+        windows.append((start, start + int(rng.integers(1, sample_count // 3))))
+    onset_index_dict = band.build_onset_index(score_dict)
+    for start, end in windows:
+        music_range = band.render_range(score_dict, start, end, onset_index_dict=onset_index_dict)
+        assert np.array_equal(music_range, expected[max(start, 0):max(min(end, sample_count), 0)]), (start, end)
+    assert np.array_equal(band.render_range(score_dict, 100, 5000), expected[100:5000])
+
+
+# 28938个采样点，1113整除歌曲长度
+@pytest.mark.parametrize('block_size', [1000, 1113, 4096, 1 << 20])
+def test_music_stream_equals_gen_music(tmp_path, block_size):
+    instrument_dict = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/16', 'tr'), ('G4', '1/4', 'maj-chord')], 3)],
+                  'bass': [([('C2', '1/4', ''), ('G2', '1/8', 'pr')], 2)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/16', '')], 5), ([('S', '1/16', '')], 3)]}
+    band = Band8bit(120, instrument_dict)
+    expected = band.gen_music(score_dict).copy()
+    assert len(expected) == 28938
+    blocks = list(band.iter_music_blocks(score_dict, block_size))
+    # 只有最后一块可能不足block_size，不产生空块
+    assert [len(block) for block in blocks] == [min(block_size, len(expected) - start)
+                                                for start in range(0, len(expected), block_size)]
+    assert all(block.dtype == np.uint8 for block in blocks)
+    assert np.array_equal(np.concatenate(blocks), expected)
+    file_path = str(tmp_path / 'stream.wav')
+    assert band.write_music_stream(file_path, score_dict, block_size) == len(expected)
+    with wave.open(file_path) as f:
+        assert (f.getnchannels(), f.getsampwidth(), f.getframerate()) == (1, 1, band.sample_rate)
+        assert np.array_equal(np.frombuffer(f.readframes(f.getnframes()), dtype=np.uint8), expected)
+
+
+@pytest.mark.parametrize('sample_rate', [22050, 44100, np.int64(22050)])
+def test_sample_rates_agree(tmp_path, monkeypatch, sample_rate):
+    monkeypatch.setattr(parallel, 'MIN_RANGE_SAMPLES', 1000)
+    instrument_dict = {'guitar': 'guitar', 'bass': 'bass', 'drum': 'drum'}
+    score_dict = {'guitar': [([('C4', '1/8', 'pr'), ('E4', '1/16', 'tr'), ('G4', '1/4', 'maj-chord')], 3)],
+                  'bass': [([('C2', '1/4', ''), ('G2', '1/8', 'sl')], 2)],
+                  'drum': [([('K', '1/8', ''), ('H', '1/16', '')], 5)]}
+    band = Band8bit(120, instrument_dict, sample_rate=sample_rate)
+    assert type(band.sample_rate) is int
+    expected = band.gen_music(score_dict).copy()
+    # 120bpm时一拍的八分之一为1/16秒，吉他最长：3 * (1/8 + 1/16 + 1/4)音符 = 3 * (4 + 2 + 8)个1/16秒
+    assert len(expected) == 3 * 14 * round(sample_rate / 16)
+    assert np.array_equal(np.concatenate(list(band.iter_music_blocks(score_dict, 4096))), expected)
+    assert np.array_equal(band.gen_music(score_dict, workers=2), expected)
+    assert np.array_equal(band.render_range(score_dict, 1000, 9000), expected[1000:9000])
+    file_path = str(tmp_path / 'music.wav')
+    band.write_music(file_path)
+    with wave.open(file_path) as f:
+        assert (f.getframerate(), f.getnframes()) == (sample_rate, len(expected))
+    for invalid_sample_rate in [0, -11025, 22050.0, '22050']:
+        with pytest.raises(ValueError):
+            Band8bit(120, instrument_dict, sample_rate=invalid_sample_rate)
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pytest
+from src.stem_cache import StemCache, EVICT_LOW_WATER
+
+KEYS = ['%032x' % i for i in range(1, 11)]
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = StemCache(str(tmp_path))
+    wav = np.arange(1000, dtype=np.int64).astype(np.uint8)
+    assert cache.get(KEYS[0]) is None
+    stored = cache.put(KEYS[0], wav[::2])
+    assert not stored.flags.writeable
+    # 写入是原子的，目录中只有最终文件，没有残留的临时文件
+    assert [name for _, _, names in os.walk(tmp_path) for name in names] == [KEYS[0] + '.pcm']
+    got = cache.get(KEYS[0])
+    assert isinstance(got, np.memmap)
+    assert not got.flags.writeable
+    assert np.array_equal(got, wav[::2])
+    # 其他进程打开同一个目录也能读到
+    assert np.array_equal(StemCache(str(tmp_path)).get(KEYS[0]), wav[::2])
+    cache.put(KEYS[1], np.zeros(0, dtype=np.uint8))
+    assert len(cache.get(KEYS[1])) == 0
+    assert KEYS[0] in cache and KEYS[2] not in cache
+    with pytest.raises(ValueError):
+        cache.get('../escape')
+
+
+def test_stats_count_hits_and_misses(tmp_path):
+    cache = StemCache(str(tmp_path))
+    cache.get(KEYS[0])
+    cache.put(KEYS[0], np.ones(100, dtype=np.uint8))
+    cache.get(KEYS[0])
+    cache.get(KEYS[0])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['writes']) == (2, 1, 1)
+    assert stats['hit_rate'] == 2 / 3
+    assert (stats['entries'], stats['bytes']) == (1, 100)
+
+
+def test_overwrite_not_double_counted(tmp_path):
+    cache = StemCache(str(tmp_path), max_bytes=1000)
+    for _ in range(20):
+        cache.put(KEYS[0], np.ones(300, dtype=np.uint8))
+    assert cache.current_bytes == 300
+    cache.put(KEYS[0], np.ones(200, dtype=np.uint8))
+    assert cache.current_bytes == 200
+    assert cache.evictions == 0
+
+
+def test_construction_does_not_scan(tmp_path, monkeypatch):
+    StemCache(str(tmp_path)).put(KEYS[0], np.ones(300, dtype=np.uint8))
+
+    def fail_scan(self):
+        raise AssertionError('scanned')
+
+    monkeypatch.setattr(StemCache, '_scan', fail_scan)
+    cache = StemCache(str(tmp_path))
+    assert cache.get(KEYS[0]) is not None
+    monkeypatch.undo()
+    cache.put(KEYS[1], np.ones(100, dtype=np.uint8))
+    assert cache.current_bytes == 400
+
+
+def test_evict_oldest_first_down_to_low_water(tmp_path):
+    cache = StemCache(str(tmp_path), max_bytes=1000)
+    for i, key in enumerate(KEYS[:5]):
+        cache.put(key, np.full(200, i, dtype=np.uint8))
+        os.utime(cache._get_path(key), (1000 + i, 1000 + i))
+    # 命中更新修改时间，KEYS[0]变成最新的
+    cache.get(KEYS[0])
+    cache.put(KEYS[5], np.ones(200, dtype=np.uint8))
+    assert cache.evictions == 2
+    assert [key in cache for key in KEYS[:6]] == [True, False, False, True, True, True]
+    assert cache.current_bytes <= 1000 * EVICT_LOW_WATER
+    # 降到低水位后，下一次写入不需要再淘汰
+    cache.put(KEYS[6], np.ones(100, dtype=np.uint8))
+    assert cache.evictions == 2
+    assert cache.stats()['bytes'] == cache.current_bytes == 900
@@ -0,0 +1,111 @@
+import struct
+import wave
+import numpy as np
+import pytest
+from src.melody import Band8bit
+from src.wavio import WAV_HEADER_SIZE, write_wave_file, create_wave_memmap, open_wave_memmap, concatenate_wave_files
+
+# 六把吉他的三和弦叠加后超过255，'clip'和'normalize'的结果不同
+INSTRUMENT_DICT = dict({f'guitar{i}': 'guitar' for i in range(6)}, drum='drum')
+SCORE_DICT = dict({f'guitar{i}': [([('C4', '1/8', 'maj-chord'), ('E4', '1/16', 'tr')], 3), ([('G4', '1/4', 'pr')], 1)]
+                   for i in range(6)}, drum=[([('K', '1/8', ''), ('H', '1/16', '')], 5)])
+
+
+def read_wave(file_path):
+    with wave.open(file_path, 'rb') as f:
+        params = (f.getnchannels(), f.getsampwidth(), f.getframerate())
+        return params, f.readframes(f.getnframes())
+
+
+@pytest.mark.parametrize('sample_count', [0, 1, 1001, 1002])
+def test_create_wave_memmap_header_and_padding(tmp_path, sample_count):
+    file_path = str(tmp_path / 'out.wav')
+    wav = np.arange(sample_count).astype(np.uint8)
+    out = create_wave_memmap(file_path, sample_count, 22050)
+    assert out.shape == (sample_count,) and out.dtype == np.uint8
+    assert np.all(out == 0)
+    out[:] = wav
+    if isinstance(out, np.memmap):
+        out.flush()
+    del out
+    data = open(file_path, 'rb').read()
+    # 奇数长度的data块后补一个字节，RIFF块的长度是偶数
+    assert len(data) == WAV_HEADER_SIZE + sample_count + sample_count % 2
+    assert struct.unpack('<I', data[4:8])[0] == len(data) - 8
+    assert read_wave(file_path) == ((1, 1, 22050), wav.tobytes())
+    mapped, sample_rate = open_wave_memmap(file_path)
+    assert sample_rate == 22050
+    assert np.array_equal(mapped, wav)
+
+
+def test_create_wave_memmap_16bit_stereo(tmp_path):
+    file_path = str(tmp_path / 'out.wav')
+    wav = np.arange(-300, 300, dtype=np.int16).reshape(-1, 2)
+    out = create_wave_memmap(file_path, len(wav), 8000, channels=2, sample_width=2)
+    assert out.shape == (300, 2)
+    out[:] = wav
+    out.flush()
+    del out
+    assert read_wave(file_path) == ((2, 2, 8000), wav.astype('<i2').tobytes())
+    mapped, _ = open_wave_memmap(file_path)
+    assert np.array_equal(mapped, wav)
+    with pytest.raises(ValueError):
+        create_wave_memmap(file_path, 10, 8000, sample_width=3)
+
+
+def test_open_wave_memmap_skips_other_chunks(tmp_path):
+    wav = np.arange(11).astype(np.uint8)
+    file_path = tmp_path / 'list.wav'
+    fmt = struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, 1, 11025, 11025, 1, 8)
+    # 奇数长度的LIST块后有一个填充字节
+    chunks = fmt + struct.pack('<4sI', b'LIST', 3) + b'abc\x00' + struct.pack('<4sI', b'data', len(wav)) + wav.tobytes()
+    file_path.write_bytes(b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks)
+    mapped, sample_rate = open_wave_memmap(str(file_path))
+    assert sample_rate == 11025
+    assert np.array_equal(mapped, wav)
+    copied, _ = open_wave_memmap(str(file_path), 'c')
+    copied[:] = 0
+    assert np.array_equal(open_wave_memmap(str(file_path))[0], wav)
+
+    not_wave = tmp_path / 'not.wav'
+    not_wave.write_bytes(b'RIFF\x00\x00\x00\x00AVI ')
+    no_data = tmp_path / 'no_data.wav'
+    no_data.write_bytes(b'RIFF' + struct.pack('<I', 4 + len(fmt)) + b'WAVE' + fmt)
+    for path in [not_wave, no_data]:
+        with pytest.raises(ValueError):
+            open_wave_memmap(str(path))
+
+
+def test_concatenate_wave_files(tmp_path):
+    wav_list = [np.arange(n).astype(np.uint8) for n in [5, 0, 1000, 7]]
+    file_paths = []
+    for i, wav in enumerate(wav_list):
+        file_paths.append(str(tmp_path / f'{i}.wav'))
+        write_wave_file(file_paths[-1], wav, 11025)
+    out_path = str(tmp_path / 'out.wav')
+    assert concatenate_wave_files(out_path, file_paths) == 1012
+    assert read_wave(out_path) == ((1, 1, 11025), np.concatenate(wav_list).tobytes())
+
+    write_wave_file(str(tmp_path / 'other_rate.wav'), wav_list[0], 22050)
+    with pytest.raises(ValueError):
+        concatenate_wave_files(out_path, file_paths + [str(tmp_path / 'other_rate.wav')])
+    with pytest.raises(ValueError):
+        concatenate_wave_files(out_path, [])
+
+
+@pytest.mark.parametrize('mix_mode', ['clip', 'normalize'])
+@pytest.mark.parametrize('block_size', [1000, 1 << 16])
+def test_render_music_to_file_equals_gen_music(tmp_path, mix_mode, block_size):
+    band = Band8bit(120, INSTRUMENT_DICT)
+    expected = band.gen_music(SCORE_DICT, mix_mode).copy()
+    file_path = str(tmp_path / 'out.wav')
+    assert band.render_music_to_file(file_path, SCORE_DICT, mix_mode, block_size) == len(expected)
+    assert read_wave(file_path) == ((1, 1, band.sample_rate), expected.tobytes())
+
+
+def test_render_music_to_file_empty(tmp_path):
+    band = Band8bit(120, INSTRUMENT_DICT)
+    file_path = str(tmp_path / 'out.wav')
+    assert band.render_music_to_file(file_path, {'drum': []}) == 0
+    assert read_wave(file_path) == ((1, 1, band.sample_rate), b'')
+    assert len(open_wave_memmap(file_path)[0]) == 0